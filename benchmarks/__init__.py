@@ -0,0 +1,13 @@
+"""Throughput benchmarks for tax_calc.
+
+generator writes seeded, realistic input files and run times the stages of
+pricing a cart as well as whole parse_files runs, saving lines per second
+and peak memory as JSON that later runs can be compared against:
+
+/tax_calc$ python -m benchmarks.run --sizes 1MB,100MB --output results.json
+/tax_calc$ python -m benchmarks.run --baseline results.json
+
+load measures the latency and throughput of the receipt service under
+concurrent connections, startup the start up time of tax_calc.py --stdin
+and its throughput as a persistent pipeline stage.
+"""
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Seeded generator of shopping cart input files in the format read by
+tax_calc.parse_files. The same seed and settings always give the same file
+"""
+
+import codecs
+import random
+
+_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+# filler words contain none of the keywords that make goods imported or exempt
+_WORDS = [u"bottle", u"box", u"packet", u"of", u"music", u"CD", u"perfume", u"bar",
+          u"headache", u"large", u"small", u"red", u"blue", u"green", u"set",
+          u"jar", u"tin", u"crate", u"premium", u"classic", u"organic", u"café",
+          u"deluxe", u"mini", u"pack", u"roll", u"sheet", u"kit", u"tube"]
+_EXEMPT_WORDS = [u"book", u"pills", u"chocolate", u"chocolates"]
+
+
+def parse_size(size):
+    """converts a size such as "100MB" to a number of bytes"""
+    size = size.strip().upper()
+    number = size.rstrip("KMGB")
+    return int(float(number) * _UNITS[size[len(number):]])
+
+
+class BasketGenerator(object):
+
+    """Produces random shopping list lines and carts. lines_per_cart and
+    name_length are (minimum, maximum) ranges, the ratios are the chance of
+    a line being for an imported or a tax exempt good
+    """
+
+    def __init__(self, seed=0, lines_per_cart=(1, 10), imported_ratio=0.3,
+                 exempt_ratio=0.3, name_length=(8, 40)):
+        self.random = random.Random(seed)
+        self.lines_per_cart = lines_per_cart
+        self.imported_ratio = imported_ratio
+        self.exempt_ratio = exempt_ratio
+        self.name_length = name_length
+
+    def name(self):
+        words = []
+        if self.random.random() < self.exempt_ratio:
+            words.append(self.random.choice(_EXEMPT_WORDS))
+        if self.random.random() < self.imported_ratio:
+            words.insert(0, u"imported")
+        length = self.random.randint(*self.name_length)
+        while len(u" ".join(words)) < length:
+            words.insert(self.random.randint(0, len(words)),
+                         self.random.choice(_WORDS))
+        return u" ".join(words)
+
+    def line(self):
+        quantity = self.random.choice([u"1", u"1", u"1", u"2", u"3", u"5", u"1.5", u"12"])
+        price = u"%d.%02d" % (self.random.randint(0, 300), self.random.randint(0, 99))
+        return u"%s %s at %s" % (quantity, self.name(), price)
+
+    def cart(self):
+        return [self.line() for _ in range(self.random.randint(*self.lines_per_cart))]
+
+    def write(self, file_out, size=None, carts=None):
+        """writes carts until either size characters or a number of carts
+        have been written, returns (carts, lines, characters) written
+        """
+        written = lines = number = 0
+        while (carts is None or number < carts) and (size is None or written < size):
+            number += 1
+            text = u"Input %s:\n%s\n\n" % (number, u"\n".join(self.cart()))
+            lines += text.count(u"\n") - 2
+            written += len(text)
+            file_out.write(text)
+        return number, lines, written
+
+
+def write_input_file(filename, size=None, carts=None, **settings):
+    """writes a UTF-8 input file of roughly size bytes or a number of carts,
+    keyword settings and the seed are passed on to BasketGenerator
+    """
+    with codecs.open(filename, "w", "utf-8") as file_out:
+        return BasketGenerator(**settings).write(file_out, size, carts)
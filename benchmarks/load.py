@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Load test of the receipt service in docs/server.py.
+
+Concurrent connections each send generated carts as JSON requests, one at a
+time, timing how long each receipt takes to come back. The latency
+percentiles and requests per second are written as JSON. With --spawn a
+server is started on a Unix socket for the length of the test:
+
+/tax_calc$ python -m benchmarks.load --spawn --connections 32 --requests 20000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.generator import BasketGenerator
+
+_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                       "docs", "server.py")
+
+
+def parse_address(address):
+    """reads host:port as a TCP address, anything else as a socket path"""
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+class Client(object):
+
+    """A connection to the receipt service sending JSON requests"""
+
+    def __init__(self, address):
+        family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.connect(address)
+        self.file = self.socket.makefile("rb")
+        self.requests = 0
+
+    def price(self, cart):
+        """returns the response dict for a cart text"""
+        self.requests += 1
+        request = json.dumps({"id": self.requests, "cart": cart})
+        self.socket.sendall(request + "\n")
+        return json.loads(self.file.readline())
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def percentile(values, fraction):
+    """nearest-rank percentile of a sorted list"""
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _connection(address, carts, latencies, errors):
+    client = Client(address)
+    try:
+        for cart in carts:
+            start = time.time()
+            response = client.price(cart)
+            latencies.append(time.time() - start)
+            if "error" in response:
+                errors.append(response["error"])
+    finally:
+        client.close()
+
+
+def run_load(address, connections=16, requests=2000, seed=0):
+    """sends requests carts spread over concurrent connections, returns the
+    requests per second and latency percentiles in milliseconds
+    """
+    generator = BasketGenerator(seed)
+    carts = [u"\n".join(generator.cart()) for _ in range(requests)]
+    latencies, errors = [], []
+    threads = [threading.Thread(target=_connection,
+                                args=(address, carts[i::connections], latencies, errors))
+               for i in range(connections)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.time() - start
+    latencies.sort()
+    milliseconds = dict(("%s_ms" % name, round(percentile(latencies, fraction) * 1000, 3)
+                         if latencies else None)
+                        for name, fraction in (("p50", 0.5), ("p99", 0.99), ("max", 1.0)))
+    result = {"requests": len(latencies), "errors": len(errors), "connections": connections,
+              "seconds": round(seconds, 6),
+              "requests_per_sec": round(len(latencies) / seconds, 1) if seconds else None}
+    result.update(milliseconds)
+    return result
+
+
+def spawn_server(path, args=()):
+    """starts docs/server.py on a Unix socket, returning once it accepts
+    connections
+    """
+    server = subprocess.Popen([sys.executable, _SERVER, "--socket", path] + list(args))
+    while True:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with status %s" % server.returncode)
+        try:
+            Client(path).close()
+            return server
+        except socket.error:
+            time.sleep(0.05)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Load tests the receipt service")
+    parser.add_argument("--address", default="127.0.0.1:8000",
+                        help="host:port or Unix socket path of a running server")
+    parser.add_argument("--spawn", action="store_true",
+                        help="start a server on a Unix socket for the test")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes of a spawned server")
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the results JSON to")
+    args = parser.parse_args(argv)
+    server = directory = None
+    address = parse_address(args.address)
+    if args.spawn:
+        directory = tempfile.mkdtemp()
+        address = os.path.join(directory, "server.sock")
+        server = spawn_server(address, ["--workers", str(args.workers)] if args.workers else [])
+    try:
+        result = run_load(address, args.connections, args.requests, args.seed)
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            server.wait()
+            shutil.rmtree(directory)
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file_out:
+            file_out.write(text + "\n")
+    else:
+        print text
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runs the tax_calc benchmarks and writes their results as JSON.
+
+Microbenchmarks time each stage of pricing a line on its own: parse
+(tokenize_line), classify (KeywordIndex.classify), tax (each engine's
+amounts) and render (building receipts of ready carts). End-to-end
+benchmarks time parse_files on generated files of the sizes asked for, each
+in its own process so that its peak RSS can be reported. They run before
+the microbenchmarks, as a forked child inherits the peak RSS its parent
+has reached.
+"""
+
+from Queue import Empty
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+from benchmarks.generator import BasketGenerator, parse_size, write_input_file
+from docs import pricing
+
+_MICRO_LINES = 20000
+
+# seconds between checks that an end-to-end child is still running
+_POLL_SECONDS = 1.0
+
+
+def best_time(function, repeat):
+    """returns the shortest of repeat timings of function()"""
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def _result(lines, seconds, **extra):
+    result = {"lines": lines, "seconds": round(seconds, 6),
+              "lines_per_sec": round(lines / seconds, 1) if seconds else None}
+    result.update(extra)
+    return result
+
+
+def _render_all(carts):
+    for cart in carts:
+        cart._receipt = None
+        cart.receipt
+
+
+def run_micro(seed, repeat, lines=_MICRO_LINES):
+    """times each stage over the same generated lines"""
+    generator = BasketGenerator(seed)
+    texts = [generator.line() for _ in range(lines)]
+    tokens = [pricing.tokenize_line(text) for text in texts]
+    names = [name for _, name, _, _ in tokens]
+    rates = [pricing.tax_rate(*pricing.CLASSIFIER.classify(name)) for name in names]
+    numbers = [(quantity, unit_price, rate)
+               for (_, _, quantity, unit_price), rate in zip(tokens, rates)]
+    carts = [pricing.Cart(u"\n".join(texts[i:i + 10])) for i in range(0, lines, 10)]
+    stages = [
+        ("parse", lambda: [pricing.tokenize_line(text) for text in texts]),
+        ("classify", lambda: [pricing.CLASSIFIER.classify(name) for name in names]),
+        ("tax_decimal", lambda: [pricing.DECIMAL_ENGINE.amounts(*line) for line in numbers]),
+        ("tax_cents", lambda: [pricing.CENTS_ENGINE.amounts(*line) for line in numbers]),
+        ("render", lambda: _render_all(carts)),
+    ]
+    return dict(("micro.%s" % name, _result(lines, best_time(function, repeat)))
+                for name, function in stages)
+
+
+def _end_to_end(filename, lines, options, queue):
+    """child process body, parse_files output goes nowhere but memory"""
+    sys.stdout = open(os.devnull, "w")
+    start = time.time()
+    pricing.parse_files([filename], **options)
+    seconds = time.time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put(_result(lines, seconds, bytes=os.path.getsize(filename), peak_rss_kb=peak))
+
+
+def run_end_to_end(size, seed, data_dir, timeout=None, **options):
+    """times parse_files over a generated file of size, reusing the file
+    from an earlier run if data_dir already has it. Raises RuntimeError when
+    the child process dies without a result, or is still running after
+    timeout seconds
+    """
+    filename = os.path.join(data_dir, "input-%s-%s.txt" % (size, seed))
+    counts = filename + ".lines"
+    if not os.path.exists(counts):
+        _, lines, _ = write_input_file(filename, size=parse_size(size), seed=seed)
+        with open(counts, "w") as file_out:
+            file_out.write(str(lines))
+    with open(counts) as file_in:
+        lines = int(file_in.read())
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(
+        target=_end_to_end, args=(filename, lines, options, queue))
+    child.start()
+    try:
+        result = _wait_for_result(child, queue, timeout)
+    except RuntimeError:
+        child.terminate()
+        child.join()
+        raise
+    child.join()
+    if child.exitcode:
+        raise RuntimeError("Benchmark of %s exited with code %s" % (size, child.exitcode))
+    return result
+
+
+def _wait_for_result(child, queue, timeout):
+    """returns what the child puts on the queue, checking that it is still
+    running every _POLL_SECONDS
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        try:
+            return queue.get(timeout=_POLL_SECONDS)
+        except Empty:
+            pass
+        if not child.is_alive() and queue.empty():
+            raise RuntimeError("Benchmark process exited with code %s without a result"
+                               % child.exitcode)
+        if deadline is not None and time.time() > deadline:
+            raise RuntimeError("Benchmark process still running after %s seconds" % timeout)
+
+
+def compare(results, baseline, tolerance, memory_tolerance=0.2):
+    """returns a report line per benchmark and measure in both results, and
+    whether any is slower than the baseline by more than tolerance, or
+    reached a peak RSS larger by more than memory_tolerance
+    """
+    report = []
+    regressed = False
+    for name in sorted(set(results) & set(baseline)):
+        for measure, worse in (("lines_per_sec", lambda ratio: ratio < 1 - tolerance),
+                               ("peak_rss_kb", lambda ratio: ratio > 1 + memory_tolerance)):
+            new, old = results[name].get(measure), baseline[name].get(measure)
+            if not new or not old:
+                continue
+            ratio = float(new) / old
+            regression = worse(ratio)
+            regressed = regressed or regression
+            report.append("%-24s %-14s %12.1f %12.1f %7.2fx%s" % (
+                name, measure, old, new, ratio, "  REGRESSION" if regression else ""))
+    return report, regressed
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks tax_calc throughput")
+    parser.add_argument("--sizes", default="1MB",
+                        help="comma separated end-to-end input sizes, e.g. 1MB,100MB,1GB")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="microbenchmark repetitions, the best is kept")
+    parser.add_argument("--micro-only", action="store_true")
+    parser.add_argument("--engine", choices=sorted(pricing.ENGINES), default="decimal")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="seconds an end-to-end benchmark may run before it is stopped")
+    parser.add_argument("--data-dir", default=tempfile.gettempdir(),
+                        help="where generated inputs are kept between runs")
+    parser.add_argument("--output", help="file to write the results JSON to")
+    parser.add_argument("--baseline", help="results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="fraction slower than the baseline that is reported")
+    parser.add_argument("--memory-tolerance", type=float, default=0.2,
+                        help="fraction more peak RSS than the baseline that is reported")
+    args = parser.parse_args(argv)
+    results = {}
+    if not args.micro_only:
+        options = {"engine": pricing.ENGINES[args.engine], "workers": args.workers}
+        for size in args.sizes.split(","):
+            results["parse_files.%s" % size] = run_end_to_end(
+                size, args.seed, args.data_dir, args.timeout, **options)
+    results.update(run_micro(args.seed, args.repeat))
+    document = {"meta": {"python": platform.python_version(), "platform": platform.platform(),
+                         "seed": args.seed, "engine": args.engine, "workers": args.workers,
+                         "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+                "results": results}
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file_out:
+            file_out.write(text + "\n")
+    else:
+        print text
+    if args.baseline:
+        with open(args.baseline) as file_in:
+            report, regressed = compare(results, json.load(file_in)["results"], args.tolerance,
+                                        args.memory_tolerance)
+        print "%-24s %-14s %12s %12s %8s" % ("benchmark", "measure", "baseline", "current", "ratio")
+        print "\n".join(report)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Start up and sustained throughput of tax_calc.py --stdin.
+
+Start up is timed three ways, keeping the best of repeat runs: the bare
+interpreter, tax_calc.py --stdin exiting at once on an empty input, and
+the time until the receipt of a first cart comes back. Sustained
+throughput feeds generated carts to a single --stdin process and counts
+the JSON Lines receipts coming back, against starting a process for each
+cart as a pipeline calling tax_calc.py per file would:
+
+/tax_calc$ python -m benchmarks.startup --carts 20000 --output startup.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from benchmarks.generator import BasketGenerator
+
+_TAX_CALC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                         "docs", "tax_calc.py")
+
+
+def stdin_process(args=()):
+    """starts tax_calc.py --stdin writing a JSON line for each receipt"""
+    process = subprocess.Popen(
+        [sys.executable, _TAX_CALC, "--stdin", "--format", "jsonl"] + list(args),
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return process
+
+
+def _best(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        timings.append(time.time() - start)
+    return round(min(timings) * 1000, 3)
+
+
+def _first_receipt(cart, args):
+    process = stdin_process(args)
+    process.stdin.write(cart + "\n\n")
+    process.stdin.flush()
+    process.stdout.readline()
+    process.stdin.close()
+    process.wait()
+
+
+def time_startup(repeat=5, seed=0, args=()):
+    """returns the best start up times in milliseconds"""
+    devnull = open(os.devnull, "r+")
+    try:
+        interpreter = _best(lambda: subprocess.call([sys.executable, "-c", "pass"]), repeat)
+        empty = _best(lambda: subprocess.call(
+            [sys.executable, _TAX_CALC, "--stdin"] + list(args),
+            stdin=devnull, stdout=devnull), repeat)
+    finally:
+        devnull.close()
+    cart = u"\n".join(BasketGenerator(seed).cart()).encode("utf-8")
+    return {"interpreter_ms": interpreter, "startup_ms": empty,
+            "first_receipt_ms": _best(lambda: _first_receipt(cart, args), repeat)}
+
+
+def _feed(process, carts):
+    for cart in carts:
+        process.stdin.write(cart)
+    process.stdin.close()
+
+
+def run_sustained(carts=2000, seed=0, args=()):
+    """pushes carts through one --stdin process, returns carts and lines per
+    second
+    """
+    generator = BasketGenerator(seed)
+    texts = [generator.cart() for _ in range(carts)]
+    lines = sum(len(text) for text in texts)
+    texts = [(u"\n".join(text) + u"\n\n").encode("utf-8") for text in texts]
+    process = stdin_process(args)
+    start = time.time()
+    feeder = threading.Thread(target=_feed, args=(process, texts))
+    feeder.start()
+    receipts = sum(1 for _ in iter(process.stdout.readline, ""))
+    seconds = time.time() - start
+    feeder.join()
+    process.wait()
+    return {"carts": receipts, "lines": lines, "seconds": round(seconds, 6),
+            "carts_per_sec": round(receipts / seconds, 1) if seconds else None,
+            "lines_per_sec": round(lines / seconds, 1) if seconds else None}
+
+
+def run_per_process(carts=20, seed=0, args=()):
+    """prices carts each in a process of its own, returns carts per second"""
+    generator = BasketGenerator(seed)
+    texts = [u"\n".join(generator.cart()).encode("utf-8") for _ in range(carts)]
+    start = time.time()
+    for text in texts:
+        _first_receipt(text, args)
+    seconds = time.time() - start
+    return {"carts": carts, "seconds": round(seconds, 6),
+            "carts_per_sec": round(carts / seconds, 1) if seconds else None}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks tax_calc.py --stdin")
+    parser.add_argument("--carts", type=int, default=2000,
+                        help="carts pushed through the persistent process")
+    parser.add_argument("--process-carts", type=int, default=20,
+                        help="carts priced with a process each")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="start up repetitions, the best is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engine", choices=["decimal", "cents"], default="decimal")
+    parser.add_argument("--output", help="file to write the results JSON to")
+    args = parser.parse_args(argv)
+    options = ["--engine", args.engine]
+    results = {"startup": time_startup(args.repeat, args.seed, options),
+               "sustained": run_sustained(args.carts, args.seed, options),
+               "per_process": run_per_process(args.process_carts, args.seed, options)}
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as file_out:
+            file_out.write(text + "\n")
+    else:
+        print text
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
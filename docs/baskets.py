@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A compact binary file of priced shopping carts, so that carts priced once
+can be read back, sliced or summed again without parsing any text.
+
+All integers are little-endian and every section starts on an 8 byte
+boundary. A file is laid out as:
+
+Header, 64 bytes, struct "<4sHHQQQQQQQ":
+    magic "TAXB", format version, item record size in bytes, then the
+    number of item records, carts and strings, followed by the byte
+    offsets of the item records, the cart index, the string offsets and
+    the string data.
+
+Item records, 48 bytes each, struct "<qqqqIIbbB5x":
+    quantity and unit price as integers scaled by 10 ** exponent, sales
+    tax and taxed price in integer cents, the string numbers of the name
+    and of the quantity as written, the quantity and unit price exponents,
+    flag bits (1 imported, 2 tax exempt) and 5 bytes of padding.
+
+Cart index, 40 bytes a cart, struct "<QIII4xqq":
+    number of the cart's first item record, its number of records, the
+    string numbers of the file it was read from and of the name of the
+    jurisdiction it was priced in, 4 bytes of padding, then its sales tax
+    and total in integer cents. The records of a cart are contiguous.
+
+String table:
+    strings + 1 uint64 offsets into the string data, string i being the
+    UTF-8 bytes between offsets i and i + 1. Each string is stored once.
+
+The header is written last, so a file left incomplete has no magic and is
+refused by BasketFile. A BasketWriter left by an exception removes its file.
+"""
+
+from collections import namedtuple
+import argparse
+import mmap
+import os
+import struct
+import sys
+
+from pricing import Cart, ENGINES, Item, decode_filename, from_cents, from_fixed, \
+    load_classifier, load_rules, read_carts, to_cents, to_fixed
+
+MAGIC = "TAXB"
+VERSION = 2
+
+HEADER = struct.Struct("<4sHHQQQQQQQ")
+RECORD = struct.Struct("<qqqqIIbbB5x")
+CART = struct.Struct("<QIII4xqq")
+OFFSET = struct.Struct("<Q")
+
+IMPORTED = 1
+TAX_EXEMPT = 2
+
+PricedItem = namedtuple("PricedItem", ["quantity_text", "name", "unit_price", "imported",
+                                       "tax_exempt", "sales_tax", "price"])
+
+
+class PricedCart(namedtuple("PricedCart", ["source", "items", "sales_tax", "total",
+                                           "jurisdiction"])):
+
+    """A cart read back from a basket file, its items being PricedItems in
+    the fields of ItemList.entries, and jurisdiction the name of the one it
+    was priced in
+    """
+
+    __slots__ = ()
+
+    @property
+    def receipt(self):
+        lines = [u"%s %s: %s\n" % (item.quantity_text, item.name, item.price)
+                 for item in self.items]
+        lines.append(u"Sales Taxes: %s\n" % self.sales_tax)
+        lines.append(u"Total: %s\n" % self.total)
+        return u"".join(lines)
+
+    def to_cart(self, engine=None, classifier=None, compact=False, rules=None):
+        """prices the items again as a Cart, keeping their stored tax status,
+        in the jurisdiction of rules they were priced in
+        """
+        cart = Cart(engine=engine, classifier=classifier, compact=compact, rules=rules)
+        cart.set_jurisdiction(self.jurisdiction)
+        for item in self.items:
+            cart.add_item(Item.from_fields(item.quantity_text, item.name, item.unit_price,
+                                           item.imported, item.tax_exempt, cart.engine,
+                                           cart.jurisdiction))
+        return cart
+
+
+class BasketWriter(object):
+
+    """Writes carts to a new basket file. Item records are written as carts
+    are added, the cart index and strings are kept until close
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, "wb")
+        self.file.write("\0" * HEADER.size)
+        self.records = 0
+        self.carts = bytearray()
+        self.cart_count = 0
+        self.strings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def string(self, text):
+        """returns the number of a string, adding it to the table if new"""
+        return self.strings.setdefault(text, len(self.strings))
+
+    def add_cart(self, cart, source=u""):
+        """appends a Cart, or a PricedCart read from another basket file,
+        noting the name of the file it came from
+        """
+        if isinstance(cart, PricedCart):
+            entries, jurisdiction = cart.items, cart.jurisdiction
+        else:
+            entries, jurisdiction = cart.lines.entries(), cart.jurisdiction.name
+        records = []
+        try:
+            for quantity_text, name, unit_price, imported, tax_exempt, sales_tax, price \
+                    in entries:
+                quantity, quantity_exponent = to_fixed(quantity_text)
+                unit_price, price_exponent = to_fixed(unit_price)
+                records.append(RECORD.pack(
+                    quantity, unit_price, to_cents(sales_tax), to_cents(price),
+                    self.string(name), self.string(quantity_text),
+                    quantity_exponent, price_exponent,
+                    IMPORTED * imported | TAX_EXEMPT * tax_exempt))
+            index = CART.pack(self.records, len(records), self.string(source),
+                              self.string(jurisdiction), to_cents(cart.sales_tax),
+                              to_cents(cart.total))
+        except struct.error:
+            raise ValueError("Values are too large for a basket file")
+        self.file.write("".join(records))
+        self.carts += index
+        self.records += len(records)
+        self.cart_count += 1
+
+    def close(self):
+        if self.file.closed:
+            return
+        carts_offset = HEADER.size + self.records * RECORD.size
+        self.file.write(str(self.carts))
+        strings = [None] * len(self.strings)
+        for text, number in self.strings.iteritems():
+            strings[number] = text.encode("utf-8")
+        strings_offset = carts_offset + len(self.carts)
+        data_offset = strings_offset + (len(strings) + 1) * OFFSET.size
+        offset = 0
+        for data in strings:
+            self.file.write(OFFSET.pack(offset))
+            offset += len(data)
+        self.file.write(OFFSET.pack(offset))
+        self.file.write("".join(strings))
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self.records,
+                                    self.cart_count, len(strings), HEADER.size,
+                                    carts_offset, strings_offset, data_offset))
+        self.file.close()
+
+    def discard(self):
+        """closes the file without its header and removes it"""
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.filename)
+
+
+class BasketFile(object):
+
+    """Memory-maps a basket file. Carts are read as PricedCarts by number or
+    slice, or iterated over, decoding only the records and strings they use
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, "rb")
+        try:
+            if os.fstat(self.file.fileno()).st_size < HEADER.size:
+                raise ValueError("%s is not a basket file" % filename)
+            self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.file.close()
+            raise
+        (magic, version, record_size, self.records, self.carts, self.string_count,
+         self.records_offset, self.carts_offset, self.strings_offset,
+         self.data_offset) = HEADER.unpack_from(self.data, 0)
+        if version != VERSION and magic == MAGIC:
+            self.close()
+            raise ValueError("%s has basket format version %s, not %s"
+                             % (filename, version, VERSION))
+        if magic != MAGIC or record_size != RECORD.size:
+            self.close()
+            raise ValueError("%s is not a basket file" % filename)
+        self._strings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if not self.file.closed:
+            self.data.close()
+            self.file.close()
+
+    def __len__(self):
+        return self.carts
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.cart(number) for number in xrange(*index.indices(self.carts))]
+        return self.cart(index)
+
+    def __iter__(self):
+        for number in xrange(self.carts):
+            yield self.cart(number)
+
+    def string(self, number):
+        text = self._strings.get(number)
+        if text is None:
+            start, end = struct.unpack_from(
+                "<QQ", self.data, self.strings_offset + number * OFFSET.size)
+            text = self._strings[number] = \
+                self.data[self.data_offset + start:self.data_offset + end].decode("utf-8")
+        return text
+
+    def record(self, number):
+        """returns the raw fields of an item record, as RECORD unpacks them"""
+        if not 0 <= number < self.records:
+            raise IndexError("Item record %s is not in the file" % number)
+        return RECORD.unpack_from(self.data, self.records_offset + number * RECORD.size)
+
+    def item(self, number):
+        (quantity, unit_price, sales_tax, price, name, quantity_text, quantity_exponent,
+         price_exponent, flags) = self.record(number)
+        return PricedItem(self.string(quantity_text), self.string(name),
+                          from_fixed(unit_price, price_exponent), bool(flags & IMPORTED),
+                          bool(flags & TAX_EXEMPT), from_cents(sales_tax), from_cents(price))
+
+    def cart(self, number):
+        if number < 0:
+            number += self.carts
+        if not 0 <= number < self.carts:
+            raise IndexError("Cart %s is not in the file" % number)
+        first, count, source, jurisdiction, sales_tax, total = CART.unpack_from(
+            self.data, self.carts_offset + number * CART.size)
+        return PricedCart(self.string(source),
+                          [self.item(record) for record in xrange(first, first + count)],
+                          from_cents(sales_tax), from_cents(total), self.string(jurisdiction))
+
+    def receipt(self, number):
+        return self.cart(number).receipt
+
+
+def write_files(filenames, output, **options):
+    """prices the carts of files of shopping lists into a basket file,
+    returning the number of carts written. Keyword options are passed on to
+    each Cart
+    """
+    with BasketWriter(output) as writer:
+        for filename in filenames:
+            source = decode_filename(filename)
+            for cart in read_carts(filename):
+                writer.add_cart(Cart(cart, **options), source)
+        return writer.cart_count
+
+
+def main(argv):
+    """command-line entry point, argv excludes the name of this file"""
+    parser = argparse.ArgumentParser(description="Writes and reads basket files")
+    parser.add_argument("filenames", nargs="*", metavar="FILE",
+                        help="files of shopping carts to price")
+    parser.add_argument("--output", metavar="FILE",
+                        help="basket file to write the priced carts to")
+    parser.add_argument("--receipts", metavar="FILE",
+                        help="print the receipts of a basket file")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="decimal")
+    parser.add_argument("--catalog", metavar="FILE")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="tax jurisdictions carts can name, see tax_calc.load_rules")
+    parser.add_argument("--jurisdiction", metavar="NAME",
+                        help="jurisdiction of carts that do not name one")
+    args = parser.parse_args(argv)
+    if args.jurisdiction and not args.rules:
+        parser.error("--jurisdiction requires --rules")
+    if args.output:
+        options = {"engine": ENGINES[args.engine]}
+        if args.catalog:
+            options["classifier"] = load_classifier(args.catalog)
+        if args.rules:
+            options["rules"] = load_rules(args.rules, args.jurisdiction)
+        write_files(args.filenames, args.output, **options)
+    elif args.receipts:
+        with BasketFile(args.receipts) as baskets:
+            for number, cart in enumerate(baskets):
+                sys.stdout.write((u"Output %s:\n%s" % (number + 1, cart.receipt))
+                                 .encode("utf-8"))
+    else:
+        parser.error("either --output or --receipts is required")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Vectorized pricing of shopping carts held as NumPy columns.
+
+Each line of a basket is a row across parallel arrays: the quantity and unit
+price as scaled integers and the imported and tax exempt flags. Carts are
+contiguous runs of rows, described by the offset of their first row.
+
+All arithmetic is done on int64, rounding half to even to the cent then up to
+the nearest 0.05 exactly as tax_calc does, so totals match
+Cart.calculate_total to the cent. NumPy is only required by this module.
+"""
+
+from collections import namedtuple
+from decimal import Decimal
+
+import numpy as np
+
+import baskets
+from pricing import CentsEngine, is_item_imported, is_item_tax_exempt, \
+    match_input, read_carts, tax_rate, to_fixed
+from pricing import round_cents as exact_round_cents
+
+Columns = namedtuple("Columns", ["quantity", "unit_price", "imported", "exempt",
+                                 "cart_offsets", "quantity_exponent", "price_exponent"])
+
+PricedColumns = namedtuple(
+    "PricedColumns", ["tax", "line_total", "cart_tax", "cart_total"])
+
+
+def rate_table():
+    """returns an int64 lookup of tax rates indexed by imported * 2 + exempt,
+    along with the decimal exponent the rates are scaled by
+    """
+    rates = [to_fixed(tax_rate(imported, exempt))
+             for imported in (False, True) for exempt in (False, True)]
+    exponent = max(rate_exponent for _, rate_exponent in rates)
+    return np.array([rate * 10 ** (exponent - rate_exponent)
+                     for rate, rate_exponent in rates], dtype=np.int64), exponent
+
+
+def round_cents(values, exponent):
+    """vectorized tax_calc.round_cents, rounds values * 10 ** -exponent to
+    whole cents, half to even
+    """
+    if exponent <= 2:
+        return values * 10 ** (2 - exponent)
+    divisor = 10 ** (exponent - 2)
+    cents, remainder = np.divmod(values, divisor)
+    cents += (2 * remainder > divisor) | (
+        (2 * remainder == divisor) & (cents & 1 == 1))
+    return cents
+
+
+def sum_carts(values, cart_offsets):
+    """sums a column over each cart, carts may be empty"""
+    running = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+    ends = np.append(cart_offsets[1:], len(values))
+    return running[ends] - running[cart_offsets]
+
+
+# the largest power of ten an int64 holds
+_MAX_SCALE = 18
+
+
+def _check_columns(quantity, unit_price, rates, exponent, rate_exponent, increment):
+    if len(quantity) != len(unit_price):
+        raise ValueError("Columns must all have the same length")
+    if not len(quantity):
+        return
+    if quantity.min() < 0:
+        raise ValueError("Quantity cannot be negative")
+    if unit_price.min() < 0:
+        raise ValueError("Price of items cannot be negative")
+    # every intermediate value grows with the quantity, unit price and rate,
+    # so priced exactly, those of the largest of each have to fit in an
+    # int64: their product, the same scaled to cents and times the scaled
+    # rate, and the taxed price summed over every row. Scaling to cents
+    # multiplies or divides by a power of ten that has to fit too
+    if not -_MAX_SCALE <= exponent - 2 <= _MAX_SCALE:
+        raise OverflowError("Values are too large to be priced as int64 columns")
+    product = int(quantity.max()) * int(unit_price.max())
+    untaxed_cost = exact_round_cents(product, exponent)
+    taxed = untaxed_cost * int(rates.max())
+    tax = -(-exact_round_cents(taxed, rate_exponent + 2) // increment) * increment
+    if max(product, taxed, (untaxed_cost + tax) * len(quantity)) >= 2 ** 63:
+        raise OverflowError("Values are too large to be priced as int64 columns")
+
+
+def price_columns(quantity, unit_price, imported, exempt, cart_offsets=None,
+                  quantity_exponent=0, price_exponent=2, precision=Decimal('0.05')):
+    """
+    prices every line of a columnar basket. quantity and unit_price are integer
+    arrays holding value * 10 ** exponent, so by default unit prices are in
+    cents. Returns the per-line tax and taxed price and the per-cart sums of
+    both, all in integer cents
+    """
+    quantity = np.asarray(quantity, dtype=np.int64)
+    unit_price = np.asarray(unit_price, dtype=np.int64)
+    category = np.asarray(imported, dtype=np.int64) * 2 + \
+        np.asarray(exempt, dtype=np.int64)
+    if cart_offsets is None:
+        cart_offsets = [0]
+    cart_offsets = np.asarray(cart_offsets, dtype=np.int64)
+    rates, rate_exponent = rate_table()
+    increment = CentsEngine(precision).increment
+    _check_columns(quantity, unit_price, rates, quantity_exponent + price_exponent,
+                   rate_exponent, increment)
+    untaxed_cost = round_cents(
+        quantity * unit_price, quantity_exponent + price_exponent)
+    tax = round_cents(untaxed_cost * rates[category], rate_exponent + 2)
+    tax = -(-tax // increment) * increment
+    line_total = untaxed_cost + tax
+    return PricedColumns(tax, line_total, sum_carts(tax, cart_offsets),
+                         sum_carts(line_total, cart_offsets))
+
+
+def _scale(numbers):
+    """brings a list of (integer, exponent) pairs to a common exponent,
+    refusing scales no int64 could hold before computing them
+    """
+    exponent = max([0] + [number_exponent for number, number_exponent in numbers if number])
+    if any(number and exponent - number_exponent > _MAX_SCALE
+           for number, number_exponent in numbers):
+        raise OverflowError("Values are too large to be priced as int64 columns")
+    return [number * 10 ** (exponent - number_exponent) if number else 0
+            for number, number_exponent in numbers], exponent
+
+
+def read_columns(filenames):
+    """parses files of shopping carts into Columns for price_columns"""
+    quantities, prices, imported, exempt, cart_offsets = [], [], [], [], []
+    for filename in filenames:
+        for cart in read_carts(filename):
+            cart_offsets.append(len(quantities))
+            for line in cart.split(u"\n"):
+                if line.strip() == u"":
+                    continue
+                groups = match_input(line.strip())
+                quantities.append(to_fixed(groups[0]))
+                prices.append(to_fixed(groups[-1]))
+                imported.append(is_item_imported(groups[1]))
+                exempt.append(is_item_tax_exempt(groups[1]))
+    quantities, quantity_exponent = _scale(quantities)
+    prices, price_exponent = _scale(prices)
+    return Columns(np.array(quantities, dtype=np.int64), np.array(prices, dtype=np.int64),
+                   np.array(imported, dtype=bool), np.array(exempt, dtype=bool),
+                   np.array(cart_offsets, dtype=np.int64), quantity_exponent, price_exponent)
+
+
+# the item records of a basket file, see docs/baskets.py
+RECORD_DTYPE = np.dtype([("quantity", "<i8"), ("unit_price", "<i8"), ("sales_tax", "<i8"),
+                         ("price", "<i8"), ("name", "<u4"), ("quantity_text", "<u4"),
+                         ("quantity_exponent", "i1"), ("price_exponent", "i1"),
+                         ("flags", "u1"), ("padding", "V5")])
+
+
+def _common_exponent(values, exponents):
+    """scales a column of integers with per-row exponents to the largest, as
+    _scale does, refusing values the scaling would take out of an int64
+    """
+    values = np.asarray(values, dtype=np.int64)
+    exponents = np.asarray(exponents, dtype=np.int64)
+    nonzero = values != 0
+    exponent = max(0, int(exponents[nonzero].max())) if nonzero.any() else 0
+    shifts = np.where(nonzero, exponent - exponents, 0)
+    if len(shifts) and shifts.max() > _MAX_SCALE:
+        raise OverflowError("Values are too large to be priced as int64 columns")
+    scales = 10 ** shifts
+    limits = np.iinfo(np.int64).max // scales
+    if np.any((values > limits) | (values < -limits)):
+        raise OverflowError("Values are too large to be priced as int64 columns")
+    return values * scales, exponent
+
+
+def basket_columns(filename):
+    """reads the item records of a basket file into Columns for
+    price_columns, mapping the file rather than parsing any text
+    """
+    with baskets.BasketFile(filename) as basket_file:
+        records, carts = basket_file.records, len(basket_file)
+        records_offset, carts_offset = basket_file.records_offset, basket_file.carts_offset
+    rows = np.memmap(filename, dtype=RECORD_DTYPE, mode="r", offset=records_offset,
+                     shape=(records,)) if records else np.zeros(0, dtype=RECORD_DTYPE)
+    first_records = np.memmap(filename, dtype="<u8", mode="r", offset=carts_offset,
+                              shape=(carts, baskets.CART.size // 8))[:, 0] if carts else []
+    quantity, quantity_exponent = _common_exponent(rows["quantity"], rows["quantity_exponent"])
+    unit_price, price_exponent = _common_exponent(rows["unit_price"], rows["price_exponent"])
+    flags = rows["flags"]
+    return Columns(quantity, unit_price, flags & baskets.IMPORTED != 0,
+                   flags & baskets.TAX_EXEMPT != 0, np.array(first_records, dtype=np.int64),
+                   quantity_exponent, price_exponent)
+
+
+def price_files(filenames, precision=Decimal('0.05')):
+    """reads files of shopping carts and prices them as columns"""
+    columns = read_columns(filenames)
+    return price_columns(*columns, precision=precision)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""SQLite cache of rendered receipts kept between runs, see ReceiptCache.
+Only runs with --cache import it, and sqlite3 along with it.
+"""
+
+from itertools import islice
+import hashlib
+import json
+import os
+import sqlite3
+
+import pricing
+from pricing import CLASSIFIER, DECIMAL_ENGINE, RULES, decode_cart, decode_filename, mapped_file, \
+    render_carts
+
+# byte ranges of carts a ReceiptCache commits at a time, and the version of
+# the receipt layout, part of the key of every receipt it keeps
+_CHECKPOINT_RANGES = 4096
+_RECEIPT_FORMAT = 1
+
+
+class ReceiptCache(object):
+
+    """
+    SQLite database of rendered receipts, keyed by a digest of the
+    normalized text of their cart and of the tax rules they were priced
+    with, so that unchanged carts are not priced again on later runs.
+
+    As each file is gone through it also keeps a checkpoint: the byte offset
+    in the file up to which carts have been priced, and the keys of their
+    receipts in order. A run that is resumed gives those receipts straight
+    from the database and carries on from the offset, unless the file or
+    the rules have changed since. Receipts are never evicted
+    """
+
+    def __init__(self, filename):
+        self.connection = sqlite3.connect(filename)
+        self.connection.text_factory = unicode
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS receipts (
+                key BLOB PRIMARY KEY, receipt TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS checkpoints (
+                filename TEXT PRIMARY KEY, identity TEXT NOT NULL,
+                offset INTEGER NOT NULL);
+            CREATE TABLE IF NOT EXISTS progress (
+                filename TEXT NOT NULL, chunk INTEGER NOT NULL, keys BLOB NOT NULL,
+                PRIMARY KEY (filename, chunk));
+        """)
+
+    def close(self):
+        self.connection.close()
+
+    def get_many(self, keys):
+        """returns a dict of the receipts found for a list of keys"""
+        found = {}
+        unique = list(set(keys))
+        # under SQLite's default limit of 999 parameters per statement
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self.connection.execute(
+                "SELECT key, receipt FROM receipts WHERE key IN (%s)" % ",".join("?" * len(batch)),
+                [buffer(key) for key in batch])
+            found.update((str(key), receipt) for key, receipt in rows)
+        return found
+
+    def checkpoint(self, filename, identity):
+        """returns the offset a file was gone through up to, 0 when it has
+        not been or has changed since
+        """
+        row = self.connection.execute(
+            "SELECT identity, offset FROM checkpoints WHERE filename = ?", (filename,)).fetchone()
+        return row[1] if row and row[0] == identity else 0
+
+    def restart(self, filename, identity):
+        """forgets the progress through a file"""
+        with self.connection:
+            self.connection.execute("DELETE FROM progress WHERE filename = ?", (filename,))
+            self.connection.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, 0)",
+                                    (filename, identity))
+
+    def done(self, filename):
+        """generator yielding the receipts a file has been priced to so far"""
+        chunks = self.connection.execute(
+            "SELECT keys FROM progress WHERE filename = ? ORDER BY chunk", (filename,)).fetchall()
+        for keys, in chunks:
+            keys = [str(keys[i:i + 20]) for i in range(0, len(keys), 20)]
+            found = self.get_many(keys)
+            if len(found) < len(set(keys)):
+                raise ValueError("Receipts of the checkpoint are missing from the cache")
+            for key in keys:
+                yield found[key]
+
+    def record(self, filename, offset, keys, receipts):
+        """stores the receipts of a chunk of a file and moves its checkpoint
+        on to offset, in one transaction
+        """
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO receipts VALUES (?, ?)",
+                [(buffer(key), receipt) for key, receipt in zip(keys, receipts)])
+            self.connection.execute(
+                "INSERT INTO progress SELECT ?, COUNT(*), ? FROM progress WHERE filename = ?",
+                (filename, buffer("".join(keys)), filename))
+            self.connection.execute(
+                "UPDATE checkpoints SET offset = ? WHERE filename = ?", (offset, filename))
+
+    def render_file(self, filename, pool=None, resume=False, format="text", **options):
+        """
+        generator yielding the receipt for each cart in a file, in order,
+        pricing only those not in the cache. Keyword options are passed on
+        to each Cart, pool and format are used as by render_carts
+        """
+        path = os.path.abspath(filename)
+        status = os.stat(path)
+        # sqlite3 only takes text as unicode
+        name = decode_filename(path)
+        rules = rules_version(options.get("engine"), options.get("classifier"),
+                              options.get("rules"))
+        version = "%s:%s" % (rules, format)
+        identity = u"%s:%r:%s" % (status.st_size, status.st_mtime, version)
+        offset = self.checkpoint(name, identity) if resume else 0
+        if offset:
+            for receipt in self.done(name):
+                yield receipt
+        else:
+            self.restart(name, identity)
+        with mapped_file(path) as data:
+            # through the module, which instrument patches
+            ranges = pricing.read_cart_ranges(path, data, offset)
+            while True:
+                chunk = list(islice(ranges, _CHECKPOINT_RANGES))
+                if not chunk:
+                    break
+                carts = [cart for start, end in chunk for cart in decode_cart(data, start, end)]
+                keys = [cart_key(cart, version) for cart in carts]
+                found = self.get_many(keys)
+                rendered = render_carts([cart for cart, key in zip(carts, keys) if key not in found],
+                                        pool, format=format, **options)
+                receipts = [found[key] if key in found else next(rendered) for key in keys]
+                self.record(name, chunk[-1][1], keys, receipts)
+                for receipt in receipts:
+                    yield receipt
+
+
+def rules_version(engine=None, classifier=None, rules=None):
+    """returns a digest of what receipts depend on besides their carts: the
+    tax rates and rounding of each jurisdiction, the rounding precision of
+    the engine and the keywords of the classifier
+    """
+    classifier = classifier or CLASSIFIER
+    rules = [_RECEIPT_FORMAT, unicode((engine or DECIMAL_ENGINE).precision),
+             (rules or RULES).describe()]
+    rules.extend(sorted((category, sorted(keywords))
+                        for category, keywords in classifier.catalog.items()))
+    return hashlib.sha1(json.dumps(rules)).hexdigest()
+
+
+def cart_key(cart, version):
+    """returns the 20 byte cache key of the text of a cart, normalized as
+    Cart reads it: lines stripped and blank ones left out
+    """
+    lines = [line.strip() for line in cart.split(u"\n")]
+    text = u"\n".join(line for line in lines if line)
+    return hashlib.sha1(version + text.encode("utf-8")).digest()
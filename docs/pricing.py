@@ -0,0 +1,1901 @@
+# -*- coding: utf-8 -*-
+
+"""This module  is used to calculate the taxes for shopping cart of goods.
+
+The Cart class consumes a string or unicode representation of a shopping list,
+calculatures applicable sales taxes on the items, then formats a receipt of the
+purchases
+
+It internally represents the goods as instances of the Item class
+
+command-line use of this module, through tax_calc.py, will take a list of file descriptors as
+arguments and return a formated recipt for each input. The file
+descriptors should point to ASCII or UTF-8 encoded string representations
+of shopping carts of the format below:
+
+Input 1:
+1 book at 12.49
+1 music CD at 14.99
+1 chocolate bar at 0.85
+
+Input 2:
+1 imported box of chocolates at 10.00
+1 imported bottle of perfume at 47.50
+
+Input 3:
+1 imported bottle of perfume at 27.99
+1 bottle of perfume at 18.99
+1 packet of headache pills at 9.75
+1 box of imported chocolates at 11.25
+
+Empty lines delimit seperate carts,
+lines with begining with the word "input" are ignored.
+
+With --rules a file of tax jurisdictions is loaded, see load_rules. A cart
+whose first line is "Jurisdiction: name" is priced under that jurisdiction,
+other carts under the default one, so one file can hold carts of several
+regions.
+
+With --stream each receipt is written as soon as its cart has been read,
+so memory use depends on the largest cart rather than the whole file.
+
+With --stdin carts are read from standard input for as long as it stays
+open, each receipt being written and flushed as soon as the blank line
+ending its cart arrives, so one process can serve a whole pipeline.
+"""
+
+from array import array
+from collections import deque, namedtuple, OrderedDict
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation, ROUND_CEILING, getcontext
+from itertools import chain
+import codecs
+import json
+import mmap
+import os
+import re
+import stat
+import sys
+
+from writers import FORMATS, RejectWriter, WRITERS, _csv_row
+
+# argparse is imported by _parse_arguments, so only the command line loads
+# it and modules importing pricing do not. multiprocessing and the cache and
+# stats modules are imported only by runs with --workers, --cache or --stats
+
+input_pattern = re.compile(u"(.+?)\s(.+)\s(at\s)(.+)", re.UNICODE)
+
+_MALFORMED = "Input is not well-formed. Items should take the form of a single line containing a quantity, name of the item, the word 'at' then the price"
+
+# characters matched by \s in input_pattern, for unicode and byte strings,
+# built by _whitespace when first needed
+_WHITESPACE = {}
+
+# a line of UTF-8 bytes can only be a cart delimiter when it starts with
+# whitespace, the "i" of "input" or the lead byte of a non-ASCII character
+_DELIMITER_BYTES = frozenset("\n \t\r\x0b\x0c\x1c\x1d\x1e\x1fIi" +
+                             "".join(chr(code) for code in range(0x80, 0x100)))
+_DELIMITER_LINE = re.compile(r"\n(?=[\n \t\r\x0b\x0c\x1c-\x1fIi\x80-\xff])")
+
+# line breaks other than \n and \r\n that codecs readers also split lines at
+_LINE_BREAKS = re.compile(u"\r(?!\n)|[\x0b\x0c\x1c-\x1e\x85\u2028\u2029]")
+
+# lines up to this long are split into words first, longer ones are only
+# scanned for their last " at "
+_SPLIT_LENGTH = 80
+
+# questionable, but best given the input
+_TAX_EXEMPT_GOODS = ["book", "pill", "chocolate"]
+
+# catalog categories of tax exempt goods, see load_classifier
+_EXEMPT_CATEGORIES = ("exempt", "food", "book", "medical")
+
+# up to this many keywords a KeywordIndex is searched with substring tests
+_SCAN_KEYWORDS = 16
+
+# entries memoized by each of the classification and tax caches
+_CACHE_SIZE = 65536
+
+# carts sent to a worker process per task, and tasks queued ahead of output
+_CHUNK_SIZE = 256
+_CHUNKS_IN_FLIGHT = 64
+
+# the Stats of a run being measured, set by stats.instrument, None otherwise
+STATS = None
+
+
+class Cart(object):
+
+    """Represents a shopping cart generated from a list of purchased items,
+    and their prices. Used to print a receipt that includes applicable taxes.
+
+    Items can also be added, removed or have their quantity changed one at a
+    time, the totals are kept up to date as they are and the receipt is only
+    rendered when it is asked for. A compact cart keeps its lines in an
+    ItemTable rather than as Item objects, for carts of very many lines.
+    """
+
+    def __init__(self, shopping_cart=u"", engine=None, classifier=None,
+                 compact=False, rules=None):
+        self.classifier = classifier
+        self.compact = compact
+        self.rules = rules or RULES
+        self.total = 0
+        self.sales_tax = 0
+        self._receipt = None
+        self._engine = engine
+        self.lines = None
+        lines = [line for line in shopping_cart.split(u'\n') if line.strip()]
+        name = jurisdiction_of(lines[0]) if lines else None
+        self.set_jurisdiction(name)
+        for item in lines if name is None else lines[1:]:
+            self.add_item(item)
+
+    def set_jurisdiction(self, name=None):
+        """prices the cart under a jurisdiction of its rules, by name, or the
+        default one. Only possible while the cart is empty
+        """
+        if self.lines:
+            raise ValueError("The jurisdiction of a cart must be set before its items")
+        self.jurisdiction = self.rules.jurisdiction(name)
+        self.engine = self.jurisdiction.engine(self._engine)
+        self.lines = ItemTable(self.engine, self.classifier, self.jurisdiction) \
+            if self.compact else ItemList()
+
+    @property
+    def items(self):
+        return self.lines.items()
+
+    @property
+    def receipt(self):
+        if self._receipt is None:
+            lines = [line + u"\n" for line in self.lines.render()]
+            lines.append(u"Sales Taxes: %s\n" % self.sales_tax)
+            lines.append(u"Total: %s\n" % self.total)
+            self._receipt = u"".join(lines)
+        return self._receipt
+
+    def add_item(self, item):
+        """adds an Item, or a line of a shopping list, to the cart and
+        returns the handle used to change it later: the Item itself, or the
+        row number in a compact cart
+        """
+        if not isinstance(item, Item):
+            item = Item(item, self.engine, self.classifier, self.jurisdiction)
+        amounts = item.get_amounts()
+        handle = self.lines.add(item, amounts)
+        self._adjust_totals(None, amounts)
+        return handle
+
+    def remove_item(self, handle):
+        """takes an item out of the cart"""
+        self._adjust_totals(self.lines.remove(handle), None)
+
+    def update_quantity(self, handle, quantity):
+        """changes the quantity of an item in the cart, keeping its place"""
+        item = self.lines.item(handle)
+        item.set_quantity(quantity)
+        amounts = item.get_amounts()
+        self._adjust_totals(self.lines.replace(handle, item, amounts), amounts)
+
+    def _adjust_totals(self, old_amounts, new_amounts):
+        """swaps what a line contributes to the totals, None for no line"""
+        if old_amounts is not None:
+            self.sales_tax -= old_amounts[0]
+            self.total -= old_amounts[1]
+        if new_amounts is not None:
+            self.sales_tax += new_amounts[0]
+            self.total += new_amounts[1]
+        self._receipt = None
+
+    def calculate_total(self):
+        """Returns the running total sales tax and final price of a cart of
+        items
+        """
+        return self.total, self.sales_tax
+
+    def __str__(self):
+        return self.receipt
+
+
+class Item(object):
+
+    """Representation of one item type on a shopping cart, calculates taxes for
+    that item based on its quantity, price and taxt status (imported, exempt)
+    """
+
+    __slots__ = ("engine", "jurisdiction", "quantity", "quantity_text", "name",
+                 "unit_price", "imported", "tax_exempt")
+
+    def __init__(self, item, engine=None, classifier=None, jurisdiction=None):
+        self.engine = engine or DECIMAL_ENGINE
+        self.jurisdiction = jurisdiction or DEFAULT_JURISDICTION
+        self.quantity_text, self.name, self.quantity, self.unit_price = \
+            tokenize_line(item)
+        self.imported, self.tax_exempt = classify(self.name, classifier)
+
+    @classmethod
+    def from_fields(cls, quantity_text, name, unit_price, imported, tax_exempt,
+                    engine=None, jurisdiction=None):
+        """builds an Item from fields already read, without parsing a line"""
+        item = cls.__new__(cls)
+        item.engine = engine or DECIMAL_ENGINE
+        item.jurisdiction = jurisdiction or DEFAULT_JURISDICTION
+        item.quantity_text = quantity_text
+        item.quantity = Decimal(quantity_text)
+        item.name = name
+        item.unit_price = unit_price
+        item.imported = imported
+        item.tax_exempt = tax_exempt
+        return item
+
+    def set_quantity(self, quantity):
+        """changes the quantity, given as a Decimal or a string of one"""
+        quantity_text = unicode(quantity)
+        quantity = Decimal(quantity)
+        if quantity < 0:
+            raise ValueError("Quantity cannot be negative")
+        self.quantity = quantity
+        self.quantity_text = quantity_text
+
+    def get_tax_rate(self):
+        """Calculates amount of taxes charged given what is known about
+        this item being tax exempt or imported, a lookup in the rate table
+        of its jurisdiction
+        """
+        return self.jurisdiction.rates[self.imported * 2 + self.tax_exempt]
+
+    def get_amounts(self):
+        """Calculates the sales tax and the taxed price of this item in one
+        go, using the tax engine the item was created with. Results are
+        memoized in TAX_CACHE as the same lines recur in many carts
+        """
+        rate = self.get_tax_rate()
+        # keyed on the text of the numbers, hashing a Decimal costs more
+        # than a cache hit saves
+        key = (self.engine, str(self.quantity), str(self.unit_price), str(rate))
+        amounts = TAX_CACHE.get(key)
+        if amounts is None:
+            amounts = self.engine.amounts(self.quantity, self.unit_price, rate)
+            TAX_CACHE.put(key, amounts)
+        return amounts
+
+    def get_tax_amount(self):
+        return self.get_amounts()[0]
+
+    def get_item_price(self):
+        return self.get_amounts()[1]
+
+    def __str__(self):
+        # output should have colon in place of 'at' and price adjusted for
+        # quantity and taxes
+        return self.quantity_text + ' ' + self.name + ': ' + \
+            str(self.get_item_price())
+
+
+class ItemList(object):
+
+    """Storage of the items of a Cart in the order they were added, mapped to
+    the (sales tax, price) each contributes to the totals
+    """
+
+    def __init__(self):
+        self.amounts_by_item = OrderedDict()
+
+    def add(self, item, amounts):
+        if item in self.amounts_by_item:
+            raise ValueError("Item is already in the cart")
+        self.amounts_by_item[item] = amounts
+        return item
+
+    def item(self, handle):
+        if handle not in self.amounts_by_item:
+            raise ValueError("Item is not in the cart")
+        return handle
+
+    def replace(self, handle, item, amounts):
+        """stores the new amounts of an item, returns the previous ones"""
+        old_amounts = self.amounts_by_item[self.item(handle)]
+        self.amounts_by_item[item] = amounts
+        return old_amounts
+
+    def remove(self, handle):
+        return self.amounts_by_item.pop(self.item(handle))
+
+    def items(self):
+        return list(self.amounts_by_item)
+
+    def render(self):
+        # from the stored price, rather than pricing each item again
+        for item, amounts in self.amounts_by_item.iteritems():
+            yield u"%s %s: %s" % (item.quantity_text, item.name, amounts[1])
+
+    def entries(self):
+        """generator yielding (quantity text, name, unit price, imported,
+        tax exempt, sales tax, price) for each line
+        """
+        for item, (sales_tax, price) in self.amounts_by_item.iteritems():
+            yield (item.quantity_text, item.name, item.unit_price, item.imported,
+                   item.tax_exempt, sales_tax, price)
+
+    def __len__(self):
+        return len(self.amounts_by_item)
+
+
+class ItemTable(object):
+
+    """Array-backed storage of the lines of a Cart. Prices and amounts are
+    kept as integer cents, quantities and unit prices as integers with their
+    decimal exponent, and the tax status as bit flags. Item objects are only
+    built again when asked for, and repeated names share one string.
+    Removed rows are flagged rather than deleted so row numbers stay valid.
+    The few rows whose numbers the arrays cannot hold exactly keep their
+    unit price and amounts as Decimals in exact instead
+    """
+
+    IMPORTED = 1
+    TAX_EXEMPT = 2
+    REMOVED = 4
+
+    def __init__(self, engine=None, classifier=None, jurisdiction=None):
+        self.engine = engine
+        self.classifier = classifier
+        self.jurisdiction = jurisdiction
+        self.quantities = array('l')
+        self.quantity_exponents = array('b')
+        self.unit_prices = array('l')
+        self.price_exponents = array('b')
+        self.taxes = array('l')
+        self.prices = array('l')
+        self.flags = array('B')
+        self.quantity_texts = []
+        self.names = []
+        self.strings = {}
+        self.exact = {}
+        self.live_rows = 0
+
+    def _values(self, row, item, amounts):
+        """returns the quantity, its exponent, the unit price, its exponent,
+        the sales tax and the price of a row as the arrays hold them. When
+        one is too large for them, has too many decimal places or is a
+        negative zero, the Decimals are kept in exact and zeros returned
+        """
+        self.exact.pop(row, None)
+        quantity, quantity_exponent = to_fixed(item.quantity)
+        unit_price, price_exponent = to_fixed(item.unit_price)
+        tax, price = to_cents(amounts[0]), to_cents(amounts[1])
+        if -_LONG_LIMIT <= min(quantity, unit_price, tax, price) and \
+                max(quantity, unit_price, tax, price) < _LONG_LIMIT and \
+                -128 <= min(quantity_exponent, price_exponent) and \
+                max(quantity_exponent, price_exponent) < 128 and \
+                not (_is_negative_zero(item.unit_price) or _is_negative_zero(amounts[0]) or
+                     _is_negative_zero(amounts[1])):
+            return quantity, quantity_exponent, unit_price, price_exponent, tax, price
+        self.exact[row] = (item.unit_price, amounts[0], amounts[1])
+        return 0, 0, 0, 0, 0, 0
+
+    def add(self, item, amounts):
+        quantity, quantity_exponent, unit_price, price_exponent, tax, price = \
+            self._values(len(self.flags), item, amounts)
+        self.quantities.append(quantity)
+        self.quantity_exponents.append(quantity_exponent)
+        self.unit_prices.append(unit_price)
+        self.price_exponents.append(price_exponent)
+        self.taxes.append(tax)
+        self.prices.append(price)
+        self.flags.append(self.IMPORTED * item.imported |
+                          self.TAX_EXEMPT * item.tax_exempt)
+        self.quantity_texts.append(
+            self.strings.setdefault(item.quantity_text, item.quantity_text))
+        self.names.append(self.strings.setdefault(item.name, item.name))
+        self.live_rows += 1
+        return len(self.flags) - 1
+
+    def _check_row(self, row):
+        if not 0 <= row < len(self.flags) or self.flags[row] & self.REMOVED:
+            raise ValueError("Item is not in the cart")
+
+    def amounts(self, row):
+        self._check_row(row)
+        if row in self.exact:
+            return self.exact[row][1:]
+        return from_cents(self.taxes[row]), from_cents(self.prices[row])
+
+    def _unit_price(self, row):
+        if row in self.exact:
+            return self.exact[row][0]
+        return from_fixed(self.unit_prices[row], self.price_exponents[row])
+
+    def _price(self, row):
+        if row in self.exact:
+            return self.exact[row][2]
+        return from_cents(self.prices[row])
+
+    def item(self, row):
+        """builds an Item equal to the one stored in a row"""
+        self._check_row(row)
+        return Item.from_fields(
+            self.quantity_texts[row], self.names[row], self._unit_price(row),
+            bool(self.flags[row] & self.IMPORTED), bool(self.flags[row] & self.TAX_EXEMPT),
+            self.engine, self.jurisdiction)
+
+    def replace(self, row, item, amounts):
+        """stores a changed quantity and amounts, returns the previous
+        amounts
+        """
+        old_amounts = self.amounts(row)
+        (self.quantities[row], self.quantity_exponents[row], self.unit_prices[row],
+         self.price_exponents[row], self.taxes[row], self.prices[row]) = \
+            self._values(row, item, amounts)
+        self.quantity_texts[row] = item.quantity_text
+        return old_amounts
+
+    def remove(self, row):
+        old_amounts = self.amounts(row)
+        self.flags[row] |= self.REMOVED
+        self.live_rows -= 1
+        return old_amounts
+
+    def rows(self):
+        """returns the numbers of the rows not removed"""
+        return [row for row, flags in enumerate(self.flags)
+                if not flags & self.REMOVED]
+
+    def items(self):
+        return [self.item(row) for row in self.rows()]
+
+    def render(self):
+        for row in self.rows():
+            yield u"%s %s: %s" % (self.quantity_texts[row], self.names[row], self._price(row))
+
+    def entries(self):
+        """generator yielding the same fields as ItemList.entries"""
+        for row in self.rows():
+            flags = self.flags[row]
+            yield ((self.quantity_texts[row], self.names[row], self._unit_price(row),
+                    bool(flags & self.IMPORTED), bool(flags & self.TAX_EXEMPT)) +
+                   self.amounts(row))
+
+    def __len__(self):
+        return self.live_rows
+
+
+# integers the "l" arrays of an ItemTable hold lie in [-_LONG_LIMIT, _LONG_LIMIT)
+_LONG_LIMIT = 2 ** (8 * array('l').itemsize - 1)
+
+
+def _is_negative_zero(number):
+    return not number and number.is_signed()
+
+
+def is_item_imported(item):
+    """returns true if the good looks like a tax exempt product,
+    which amounts searching for the word 'imported' in its name
+    """
+    item = item.lower()
+    if "imported" in item:
+        return True
+    else:
+        return False
+
+
+def is_item_tax_exempt(item):
+    """returns true if the good looks like a tax exempt product,
+    which amounts searching for similar keywords within the name
+    """
+    item = item.lower()
+    for untaxable in _TAX_EXEMPT_GOODS:
+        if untaxable in item:
+            return True
+    return False
+
+
+class KeywordIndex(object):
+
+    """Aho-Corasick automaton over catalogs of keywords, finds which catalogs
+    have a keyword within a name in a single case-insensitive pass, however
+    many keywords there are. Matches the substring search of is_item_imported
+    and is_item_tax_exempt. Catalogs of only a few keywords are searched with
+    plain substring tests instead, which are quicker at that size
+    """
+
+    def __init__(self, catalog):
+        """catalog maps a category name to an iterable of its keywords"""
+        catalog = dict((category, [keyword.lower() for keyword in keywords])
+                       for category, keywords in catalog.items())
+        self.catalog = catalog
+        self.bits = dict((category, 1 << i)
+                         for i, category in enumerate(sorted(catalog)))
+        self.all_bits = (1 << len(self.bits)) - 1
+        self.transitions = [{}]
+        self.outputs = [0]
+        keywords = [(keyword, self.bits[category])
+                    for category, category_keywords in catalog.items()
+                    for keyword in category_keywords]
+        for keyword, bit in keywords:
+            self._add_keyword(keyword, bit)
+        self._compile()
+        self.scan = keywords if len(keywords) <= _SCAN_KEYWORDS else None
+
+    def _add_keyword(self, keyword, bit):
+        state = 0
+        for char in keyword:
+            if char not in self.transitions[state]:
+                self.transitions.append({})
+                self.outputs.append(0)
+                self.transitions[state][char] = len(self.transitions) - 1
+            state = self.transitions[state][char]
+        self.outputs[state] |= bit
+
+    def _compile(self):
+        """turns the keyword trie into a DFA, following failure links ahead
+        of time so that matching is one dictionary lookup per character.
+        Transitions back to the root are left out of the tables
+        """
+        failures = [0] * len(self.transitions)
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            failure = self.transitions[failures[state]]
+            self.outputs[state] |= self.outputs[failures[state]]
+            for char, child in self.transitions[state].items():
+                failures[child] = failure.get(char, 0)
+                queue.append(child)
+            for char, target in failure.items():
+                if char not in self.transitions[state]:
+                    self.transitions[state][char] = target
+
+    def match(self, text):
+        """returns the bitmask of categories with a keyword found in text"""
+        if self.scan is not None:
+            return self._match_scan(text.lower())
+        transitions = self.transitions
+        outputs = self.outputs
+        found = state = 0
+        for char in text.lower():
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+                if found == self.all_bits:
+                    break
+        return found
+
+    def _match_scan(self, text):
+        found = 0
+        for keyword, bit in self.scan:
+            if keyword in text:
+                found |= bit
+        return found
+
+    def categories(self, text):
+        """returns the set of category names with a keyword found in text"""
+        found = self.match(text)
+        return set(category for category, bit in self.bits.items() if found & bit)
+
+    def classify(self, name):
+        """returns (imported, tax exempt) flags for the name of a good"""
+        found = self.match(name)
+        return (bool(found & self.bits.get("imported", 0)),
+                bool(found & self.bits.get("exempt", 0)))
+
+
+def load_catalog(filename):
+    """
+    reads a UTF-8 keyword catalog, where a line "[category]" starts the
+    keywords of a category, one keyword per line. Blank lines and lines
+    starting with # are ignored
+    """
+    catalog = {}
+    keywords = None
+    with codecs.open(filename, "r", "utf-8") as file_in:
+        for line in file_in:
+            line = line.strip()
+            if line == u"" or line.startswith(u"#"):
+                continue
+            if line.startswith(u"[") and line.endswith(u"]"):
+                keywords = catalog.setdefault(line[1:-1].strip(), [])
+            elif keywords is None:
+                raise ValueError(
+                    "Catalog keywords must follow a [category] line")
+            else:
+                keywords.append(line)
+    return catalog
+
+
+def load_classifier(filename):
+    """compiles a KeywordIndex from a keyword catalog file. The keywords of
+    [imported] mark imported goods, and those of [exempt], [food], [book]
+    and [medical] are merged into the tax exempt ones. Other categories, or
+    a catalog without [imported] or any exempt category, are refused rather
+    than quietly matching nothing
+    """
+    catalog = load_catalog(filename)
+    unknown = sorted(set(catalog) - set(("imported",) + _EXEMPT_CATEGORIES))
+    if unknown:
+        raise ValueError("Unknown catalog categories: %s" % ", ".join(unknown))
+    if "imported" not in catalog or not any(category in catalog
+                                            for category in _EXEMPT_CATEGORIES):
+        raise ValueError("Catalogs must have an [imported] category and one of "
+                         + ", ".join("[%s]" % category for category in _EXEMPT_CATEGORIES))
+    return KeywordIndex({"imported": catalog["imported"],
+                         "exempt": [keyword for category in _EXEMPT_CATEGORIES
+                                    for keyword in catalog.get(category, [])]})
+
+
+def tax_rate(imported, tax_exempt):
+    """returns the combined sales tax and import duty rate for a good in the
+    default jurisdiction
+    """
+    return DEFAULT_JURISDICTION.rates[imported * 2 + tax_exempt]
+
+
+def apply_rounding(number, precision=Decimal('0.05')):
+    """Applies rounding according to:
+    The rounding rules for sales tax are that for a tax rate of n%,
+    a shelf price of p contains (np/100 rounded up to the nearest 0.05)
+    amount of sales tax."""
+    # catchall in case a float sneaks by
+    number = Decimal(number)
+    precision = Decimal(precision)
+    rounding = (number / precision).quantize(Decimal('1'),
+                                             rounding=ROUND_CEILING)
+    return (rounding * precision).quantize(Decimal('0.01'))
+
+
+class DecimalEngine(object):
+
+    """Tax engine doing all arithmetic with Decimal, the reference
+    implementation of the rounding rules
+    """
+
+    def __init__(self, precision=Decimal('0.05')):
+        self.precision = Decimal(precision)
+
+    def amounts(self, quantity, unit_price, rate):
+        """returns (sales tax, taxed price) for a line of an item"""
+        untaxed_cost = (quantity * unit_price).quantize(Decimal('0.01'))
+        sales_tax = apply_rounding(
+            (untaxed_cost * rate).quantize(Decimal('0.01')), self.precision)
+        return sales_tax, untaxed_cost + sales_tax
+
+
+class CentsEngine(object):
+
+    """Tax engine doing the arithmetic on integer cents. Results are identical
+    to DecimalEngine, including its half-even rounding of intermediate cents,
+    but cost a fraction of the Decimal operations
+    """
+
+    def __init__(self, precision=Decimal('0.05')):
+        increment, exponent = to_fixed(precision)
+        if exponent > 2 or increment <= 0:
+            raise ValueError("Rounding precision must be a whole number of cents")
+        self.precision = Decimal(precision)
+        self.increment = increment * 10 ** (2 - exponent)
+
+    def amounts(self, quantity, unit_price, rate):
+        """returns (sales tax, taxed price) for a line of an item"""
+        quantity_digits, quantity_exponent = to_fixed(quantity)
+        price_digits, price_exponent = to_fixed(unit_price)
+        rate_digits, rate_exponent = to_fixed(rate)
+        untaxed_cost = _check_cents(round_cents(
+            quantity_digits * price_digits, quantity_exponent + price_exponent))
+        sales_tax = _check_cents(round_cents(untaxed_cost * rate_digits, rate_exponent + 2))
+        sales_tax = -(-sales_tax // self.increment) * self.increment
+        if not sales_tax:
+            return _zero_tax_amounts(untaxed_cost, quantity, unit_price, rate)
+        return from_cents(sales_tax), from_cents(untaxed_cost + sales_tax)
+
+
+def _check_cents(cents):
+    """returns an amount in cents, raising InvalidOperation as quantize does
+    when it has more digits than the decimal context allows
+    """
+    if abs(cents) >= 10 ** getcontext().prec:
+        raise InvalidOperation("quantize result has too many digits for current context")
+    return cents
+
+
+def _zero_tax_amounts(untaxed_cost, quantity, unit_price, rate):
+    """returns the amounts of a line whose sales tax is zero cents, the
+    zeros signed as Decimal signs them, which integers cannot: a product is
+    negative when one of its factors is, and a sum of zeros only when both
+    are. Only a line of "-0" shows it, as negative numbers are refused
+    """
+    cost_negative = untaxed_cost < 0 if untaxed_cost else \
+        Decimal(quantity).is_signed() != Decimal(unit_price).is_signed()
+    tax_negative = cost_negative != Decimal(rate).is_signed()
+    sales_tax = from_cents(0)
+    price = from_cents(untaxed_cost)
+    if tax_negative:
+        sales_tax = sales_tax.copy_negate()
+    if cost_negative and tax_negative and not untaxed_cost:
+        price = price.copy_negate()
+    return sales_tax, price
+
+
+class Jurisdiction(object):
+
+    """The tax rules of a region: the basic sales tax rate, that of tax
+    exempt goods, the import duty rate and the increment taxes are rounded
+    up to. The rates are precompiled into a table indexed by
+    imported * 2 + tax exempt, so pricing an item needs no branching
+    """
+
+    def __init__(self, name, basic_rate, import_rate, exempt_rate=0,
+                 precision=Decimal('0.05')):
+        self.name = name
+        basic_rate, import_rate, exempt_rate = (
+            Decimal(basic_rate), Decimal(import_rate), Decimal(exempt_rate))
+        if min(basic_rate, import_rate, exempt_rate) < 0:
+            raise ValueError("Tax rates cannot be negative")
+        self.precision = Decimal(precision)
+        if self.precision <= 0:
+            raise ValueError("Rounding precision must be positive")
+        self.rates = (basic_rate, exempt_rate,
+                      basic_rate + import_rate, exempt_rate + import_rate)
+        self.engines = {}
+
+    def engine(self, engine=None):
+        """returns a tax engine of the same kind rounding to this
+        jurisdiction's precision, the engine itself when it already does
+        """
+        engine = engine or DECIMAL_ENGINE
+        if engine.precision == self.precision:
+            return engine
+        kind = type(engine)
+        if kind not in self.engines:
+            self.engines[kind] = kind(self.precision)
+        return self.engines[kind]
+
+    def describe(self):
+        """returns the rules as plain values, for rules_version"""
+        return [self.name, unicode(self.precision)] + [unicode(rate) for rate in self.rates]
+
+
+class RuleBook(object):
+
+    """Jurisdictions by name, one of them the default of carts that do not
+    name theirs
+    """
+
+    def __init__(self, jurisdictions, default=None):
+        self.jurisdictions = OrderedDict(
+            (jurisdiction.name, jurisdiction) for jurisdiction in jurisdictions)
+        if not self.jurisdictions:
+            raise ValueError("Rules must have at least one jurisdiction")
+        self.default = self.jurisdiction(default or next(iter(self.jurisdictions)))
+
+    def jurisdiction(self, name=None):
+        """returns the Jurisdiction of a name, None for the default"""
+        if name is None:
+            return self.default
+        try:
+            return self.jurisdictions[name]
+        except KeyError:
+            raise ValueError("Unknown jurisdiction %r" % name)
+
+    def describe(self):
+        return [self.default.name] + [jurisdiction.describe()
+                                      for jurisdiction in self.jurisdictions.values()]
+
+
+_RULE_KEYS = {"basic_rate": "basic_rate", "import_rate": "import_rate",
+              "exempt_rate": "exempt_rate", "rounding": "precision"}
+
+
+def load_rules(filename, default=None):
+    """
+    reads a UTF-8 file of tax jurisdictions into a RuleBook. A line
+    "[name]" starts a jurisdiction, followed by "key = value" lines for
+    basic_rate and import_rate, and optionally exempt_rate (0) and rounding
+    (0.05). Blank lines and lines starting with # are ignored. The first
+    jurisdiction is the default unless another is named
+    """
+    sections = []
+    with codecs.open(filename, "r", "utf-8") as file_in:
+        for number, line in enumerate(file_in, 1):
+            line = line.strip()
+            if line == u"" or line.startswith(u"#"):
+                continue
+            if line.startswith(u"[") and line.endswith(u"]"):
+                sections.append((line[1:-1].strip(), {}))
+                continue
+            key, equals, value = line.partition(u"=")
+            key = key.strip().lower()
+            if not sections:
+                raise ValueError("Rules must follow a [jurisdiction] line (line %s)" % number)
+            if not equals or key not in _RULE_KEYS:
+                raise ValueError("Unknown rule %r (line %s)" % (key, number))
+            sections[-1][1][_RULE_KEYS[key]] = value.strip()
+    jurisdictions = []
+    for name, settings in sections:
+        if "basic_rate" not in settings or "import_rate" not in settings:
+            raise ValueError("Jurisdiction %r needs a basic_rate and an import_rate" % name)
+        try:
+            jurisdictions.append(Jurisdiction(name, **settings))
+        except InvalidOperation:
+            raise ValueError("Rules of jurisdiction %r must be numbers" % name)
+    return RuleBook(jurisdictions, default)
+
+
+def jurisdiction_of(line):
+    """returns the name in a "Jurisdiction: name" line, otherwise None"""
+    text = line.strip()
+    if text[:13].lower() != u"jurisdiction:":
+        return None
+    return text[13:].strip()
+
+
+def to_fixed(number):
+    """splits a Decimal, or a string of one, into an integer and a
+    decimal exponent so that number == integer * 10 ** -exponent. The sign
+    of a zero is lost
+    """
+    text = unicode(number)
+    whole, _, fraction = text.partition(u".")
+    digits = whole + fraction
+    if digits.isdigit():
+        try:
+            return int(digits), len(fraction)
+        except ValueError:
+            pass
+    sign, digits, exponent = Decimal(number).as_tuple()
+    if not isinstance(exponent, int):
+        raise ValueError("Quantities and prices must be finite numbers")
+    integer = 0
+    for digit in digits:
+        integer = integer * 10 + digit
+    return -integer if sign else integer, -exponent
+
+
+def round_cents(integer, exponent):
+    """rounds integer * 10 ** -exponent to a whole number of cents, half to
+    even like Decimal.quantize under the default context. Scales too large
+    to compute, as of "9E+999999999", raise InvalidOperation like quantize
+    """
+    if not integer:
+        return 0
+    if exponent <= 2:
+        if 2 - exponent > getcontext().prec:
+            raise InvalidOperation("quantize result has too many digits for current context")
+        return integer * 10 ** (2 - exponent)
+    if exponent - 2 > len(str(abs(integer))):
+        # less than half a cent
+        return 0
+    divisor = 10 ** (exponent - 2)
+    cents, remainder = divmod(integer, divisor)
+    if 2 * remainder > divisor or (2 * remainder == divisor and cents & 1):
+        cents += 1
+    return cents
+
+
+def from_fixed(integer, exponent):
+    """inverse of to_fixed, returns integer * 10 ** -exponent as a Decimal"""
+    return Decimal(integer).scaleb(-exponent)
+
+
+def from_cents(cents):
+    """converts integer cents back to a Decimal with two decimal places"""
+    return from_fixed(cents, 2)
+
+
+def to_cents(amount):
+    """converts an amount with at most two decimal places to integer cents"""
+    integer, exponent = to_fixed(amount)
+    if exponent > 2:
+        raise ValueError("Amounts must be a whole number of cents")
+    return integer * 10 ** (2 - exponent)
+
+
+class LRUCache(object):
+
+    """Mapping of bounded size that evicts its least recently used entry when
+    full, counting hits and misses. A maxsize of 0 disables caching
+    """
+
+    def __init__(self, maxsize=_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.clear()
+
+    def clear(self):
+        """empties the cache, leaving the hit and miss counters alone"""
+        self.links = {}
+        # circular doubly linked list of [previous, next, key, value] in order
+        # of use, the root's next link being the least recently used
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None]
+
+    def resize(self, maxsize):
+        """changes the maximum number of entries, evicting any excess"""
+        self.maxsize = maxsize
+        while len(self.links) > max(maxsize, 0):
+            self._evict()
+
+    def info(self):
+        """returns the counters and size of the cache as a dict"""
+        return {"hits": self.hits, "misses": self.misses,
+                "size": len(self.links), "maxsize": self.maxsize}
+
+    def get(self, key, default=None):
+        link = self.links.get(key)
+        if link is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        previous, following = link[0], link[1]
+        previous[1] = following
+        following[0] = previous
+        self._append(link)
+        return link[3]
+
+    def put(self, key, value):
+        if self.maxsize <= 0 or key in self.links:
+            return
+        if len(self.links) >= self.maxsize:
+            self._evict()
+        link = [None, None, key, value]
+        self._append(link)
+        self.links[key] = link
+
+    def _append(self, link):
+        last = self.root[0]
+        link[0] = last
+        link[1] = self.root
+        last[1] = self.root[0] = link
+
+    def _evict(self):
+        oldest = self.root[1]
+        self.root[1] = oldest[1]
+        oldest[1][0] = self.root
+        del self.links[oldest[2]]
+
+    def __len__(self):
+        return len(self.links)
+
+
+def classify(name, classifier=None):
+    """returns (imported, tax exempt) flags for the name of a good using a
+    KeywordIndex, CLASSIFIER by default, memoized in CLASSIFICATION_CACHE
+    """
+    classifier = classifier or CLASSIFIER
+    key = (classifier, name)
+    flags = CLASSIFICATION_CACHE.get(key)
+    if flags is None:
+        flags = classifier.classify(name)
+        CLASSIFICATION_CACHE.put(key, flags)
+    return flags
+
+
+def resize_caches(maxsize):
+    """sets the maximum entries of the classification and tax caches"""
+    CLASSIFICATION_CACHE.resize(maxsize)
+    TAX_CACHE.resize(maxsize)
+
+
+def clear_caches():
+    CLASSIFICATION_CACHE.clear()
+    TAX_CACHE.clear()
+
+
+DECIMAL_ENGINE = DecimalEngine()
+CENTS_ENGINE = CentsEngine()
+ENGINES = {"decimal": DECIMAL_ENGINE, "cents": CENTS_ENGINE}
+DEFAULT_JURISDICTION = Jurisdiction(u"default", Decimal('0.1'), Decimal('0.05'))
+RULES = RuleBook([DEFAULT_JURISDICTION])
+CLASSIFIER = KeywordIndex(
+    {"imported": ["imported"], "exempt": _TAX_EXEMPT_GOODS})
+CLASSIFICATION_CACHE = LRUCache()
+TAX_CACHE = LRUCache()
+
+
+class MalformedLineError(ValueError):
+
+    """Raised for a line of a shopping list that cannot be read, column is the
+    offset within the line of the field at fault
+    """
+
+    def __init__(self, message, column):
+        super(MalformedLineError, self).__init__(
+            "%s (column %s)" % (message, column))
+        self.reason = message
+        self.column = column
+
+    def __reduce__(self):
+        return self.__class__, (self.reason, self.column)
+
+
+class InvalidNumberError(MalformedLineError, InvalidOperation):
+
+    """Raised for a quantity or price that is not a number, still an
+    InvalidOperation as when Decimal rejected these itself
+    """
+
+
+def split_line(line):
+    """
+    hand-written equivalent of input_pattern.match(line).groups(). The
+    quantity runs up to the first whitespace, then the last " at " followed
+    by a price is searched for from the right, so long names cost a couple of
+    string searches rather than regex backtracking
+    """
+    if isinstance(line, unicode) and len(line) <= _SPLIT_LENGTH:
+        words = line.split()
+        # the usual case of words separated by single spaces, on one line
+        if u" ".join(words) == line and len(words) > 3:
+            at = len(words) - 2
+            while at > 1 and words[at] != u"at":
+                at -= 1
+            if at > 1:
+                price = u" ".join(words[at + 1:])
+                return (words[0], line[len(words[0]) + 1:-len(price) - 4],
+                        u"at ", price)
+    elif not isinstance(line, basestring):
+        return match_input_pattern(line)
+    quantity_end, name_start, at, price_end = _scan_line(line)
+    return (line[:quantity_end], line[name_start:at - 1], line[at:at + 3],
+            line[at + 3:price_end])
+
+
+def _scan_line(line):
+    """returns the offsets of the end of the quantity, the start of the name,
+    the word 'at' and the end of the price in a line
+    """
+    whitespace = _whitespace(unicode if isinstance(line, unicode) else str)
+    length = len(line)
+    if not length or line[0] == "\n":
+        raise MalformedLineError(_MALFORMED, 0)
+    quantity_end = 1
+    while quantity_end < length and line[quantity_end] not in whitespace:
+        quantity_end += 1
+    at = _find_at(line, quantity_end + 1, whitespace)
+    newline = line.find("\n", quantity_end)
+    if at < 0 and newline > quantity_end:
+        # the quantity may also run up to the end of the first line, as the
+        # name cannot span lines but can start on the next one
+        quantity_end = newline
+        at = _find_at(line, quantity_end + 1, whitespace)
+    if at < 0:
+        raise MalformedLineError(_MALFORMED, min(quantity_end + 1, length))
+    price_end = line.find("\n", at + 3)
+    return quantity_end, quantity_end + 1, at, length if price_end < 0 else price_end
+
+
+def _whitespace(kind):
+    """returns the whitespace characters of unicode or str strings, only
+    the lines _scan_line goes through needing them
+    """
+    whitespace = _WHITESPACE.get(kind)
+    if whitespace is None:
+        if kind is unicode:
+            whitespace = frozenset(
+                unichr(code) for code in range(0x3001) if unichr(code).isspace())
+        else:
+            whitespace = frozenset(chr(code) for code in range(256) if unichr(code).isspace())
+        _WHITESPACE[kind] = whitespace
+    return whitespace
+
+
+def _find_at(line, name_start, whitespace):
+    """returns the offset of the last " at " that ends a name starting at
+    name_start and is followed by a price, or -1
+    """
+    length = len(line)
+    name_end = line.find("\n", name_start)
+    # names cannot span lines, but the whitespace after them can be a newline
+    search_end = (length if name_end < 0 else name_end) + 3
+    while True:
+        at = line.rfind("at", name_start + 2, search_end)
+        if at < 0 or line[at - 1] in whitespace and at + 3 < length and \
+                line[at + 2] in whitespace and line[at + 3] != "\n":
+            return at
+        search_end = at + 1
+
+
+def tokenize_line(line):
+    """splits a line of a shopping list, surrounding whitespace aside, and
+    converts its numbers. Returns (quantity text, name, quantity, unit price).
+    Errors carry the column of the field at fault within line
+    """
+    text = line.strip()
+    offset = len(line) - len(line.lstrip())
+    try:
+        quantity_text, name, _, price_text = split_line(text)
+    except MalformedLineError as error:
+        raise MalformedLineError(_MALFORMED, error.column + offset)
+    quantity = _to_number(
+        quantity_text, offset, "Quantity cannot be negative")
+    price_column = offset + len(quantity_text) + len(name) + 5
+    unit_price = _to_number(
+        price_text, price_column, "Price of items cannot be negative")
+    return quantity_text, name, quantity, unit_price
+
+
+def _to_number(text, column, negative_message):
+    """converts a quantity or price to a Decimal, plain unsigned numbers
+    skip the comparison that rejects negative ones
+    """
+    try:
+        number = Decimal(text)
+    except InvalidOperation:
+        raise InvalidNumberError("Invalid number %r" % text, column)
+    if not text.replace(".", "", 1).isdigit() and number < 0:
+        raise MalformedLineError(negative_message, column)
+    return number
+
+
+def match_input_pattern(string):
+    """Validates input looks like a well-formed shopping cart item using the
+    input_pattern regex, returns chunked input
+    """
+    valid = input_pattern.match(string)
+    if not valid:
+        raise ValueError(_MALFORMED)
+    return valid.groups()
+
+
+def match_input(string):
+    """Validates input looks like a well-formed shopping cart item, returns chunked input"""
+    return split_line(string)
+
+
+def iter_carts(lines):
+    """generator over an iterable of lines yielding the text of each cart as
+    soon as its delimiter is seen, blank lines and input headers are skipped
+    """
+    cart = []
+    for line in lines:
+        if line.lower().startswith(u'input') or line.strip() == u"":
+            if cart:
+                yield u"".join(cart)
+                cart = []
+        else:
+            cart.append(line)
+    if cart:
+        yield u"".join(cart)
+
+
+def read_carts(filename):
+    """
+    generator yielding the text of each cart in a UTF-8 encoded file. The
+    file is memory mapped and split into carts as bytes, each cart only being
+    decoded when it is yielded. Pipes and other files that cannot be mapped
+    are read line by line instead
+    """
+    with open(filename, "rb") as file_in:
+        if not stat.S_ISREG(os.fstat(file_in.fileno()).st_mode):
+            for cart in iter_carts(codecs.getreader("utf-8")(file_in)):
+                yield cart
+            return
+    with mapped_file(filename) as data:
+        for start, end in iter_cart_ranges(data):
+            for cart in decode_cart(data, start, end):
+                yield cart
+
+
+def read_cart_ranges(filename, data=None, offset=0):
+    """generator yielding the byte range of each cart in a file, from the
+    line starting at offset on. data is the file as mapped_file gave it,
+    when it is already open
+    """
+    if data is not None:
+        for cart_range in iter_cart_ranges(data, offset):
+            yield cart_range
+        return
+    with mapped_file(filename) as data:
+        for cart_range in iter_cart_ranges(data, offset):
+            yield cart_range
+
+
+def decode_filename(filename):
+    """returns the name of a file as unicode, for receipts and rejects,
+    decoding a byte string name as the file system encodes them, or as
+    UTF-8 when the locale gives an encoding the name is not in
+    """
+    if isinstance(filename, unicode):
+        return filename
+    try:
+        return filename.decode(sys.getfilesystemencoding() or "utf-8")
+    except UnicodeDecodeError:
+        return filename.decode("utf-8", "replace")
+
+
+def is_regular_file(filename):
+    """tells whether a file can be memory mapped and read again by worker
+    processes, which pipes, FIFOs and devices cannot. A missing file is
+    left for open to raise on
+    """
+    try:
+        return stat.S_ISREG(os.stat(filename).st_mode)
+    except OSError:
+        return False
+
+
+@contextmanager
+def mapped_file(filename):
+    """context manager mapping a file into memory read-only. An empty file,
+    which cannot be mapped, is given as an empty string, and one that is not
+    a regular file as a string of all its bytes
+    """
+    with open(filename, "rb") as file_in:
+        status = os.fstat(file_in.fileno())
+        if not stat.S_ISREG(status.st_mode):
+            yield file_in.read()
+            return
+        if not status.st_size:
+            yield ""
+            return
+        data = mmap.mmap(file_in.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        yield data
+    finally:
+        data.close()
+
+
+def iter_cart_ranges(data, offset=0):
+    """
+    generator yielding the (start, end) byte offsets of each cart in a string
+    or memory map of UTF-8 text, the carts iter_carts would find in its
+    lines, from the line starting at offset on. Only the lines that could be
+    delimiters are looked at one by one, the rest are skipped over by a
+    regex search without being copied
+    """
+    size = len(data)
+    start = offset if offset < size and data[offset] not in _DELIMITER_BYTES else None
+    first = [] if start is not None or offset >= size else [offset]
+    candidates = (match.end() for match in _DELIMITER_LINE.finditer(data, offset))
+    for line_start in chain(first, candidates):
+        line_end = data.find("\n", line_start) + 1 or size
+        if not _is_delimiter(data[line_start:line_end]):
+            if start is None:
+                start = line_start
+            continue
+        if start is not None:
+            yield start, line_start
+        start = None
+        if line_end < size and data[line_end] not in _DELIMITER_BYTES:
+            start = line_end
+    if start is not None:
+        yield start, size
+
+
+def _is_delimiter(line):
+    """tells whether a line of UTF-8 bytes is blank or an input header. A
+    header holding other line breaks is kept in its cart for decode_cart to
+    split
+    """
+    # bytes that are not UTF-8 are left for decode_cart to raise on, or for
+    # the error policy of bulk mode to reject
+    text = line.decode("utf-8", "replace")
+    if not text.strip():
+        return True
+    body = text[:-2] if text.endswith(u"\r\n") else text.rstrip(u"\n")
+    return text.lower().startswith(u"input") and not _LINE_BREAKS.search(body)
+
+
+def decode_cart(data, start, end):
+    """returns the text of the cart in a byte range as a list, of more than
+    one cart in the rare case of line breaks other than \n and \r\n, which
+    codecs readers split lines at as well
+    """
+    text = data[start:end].decode("utf-8")
+    if _LINE_BREAKS.search(text):
+        return list(iter_carts(text.splitlines(True)))
+    return [text]
+
+
+# what bulk mode does with a line that cannot be read: stop there, price its
+# cart without it, or leave out its whole cart
+ERROR_POLICIES = ("fail", "skip-line", "skip-cart")
+
+# what reading and pricing a line can raise: ValueError for what is not
+# well-formed, and ArithmeticError for the decimal signals, InvalidOperation
+# and Overflow among them, and the OverflowError of compact storage
+_LINE_ERRORS = (ValueError, ArithmeticError)
+
+# bytes counted for newlines at a time when numbering lines
+_COUNT_BLOCK = 1 << 20
+
+Reject = namedtuple("Reject", ["offset", "reason", "line"])
+
+
+class RejectedLineError(ValueError):
+
+    """Raised by the fail policy of bulk mode, locating the line at fault
+    within its file
+    """
+
+    def __init__(self, filename, line, offset, reason):
+        super(RejectedLineError, self).__init__(
+            u"%s, line %s (byte %s): %s" % (filename, line, offset, reason))
+        self.filename = filename
+        self.line = line
+        self.offset = offset
+        self.reason = reason
+
+    def __reduce__(self):
+        return self.__class__, (self.filename, self.line, self.offset, self.reason)
+
+
+class LineCounter(object):
+
+    """Numbers the lines of a file at increasing byte offsets, each byte
+    only being counted for newlines once
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+        self.line = 1
+
+    def line_at(self, offset):
+        if offset < self.offset:
+            self.offset, self.line = 0, 1
+        while self.offset < offset:
+            end = min(offset, self.offset + _COUNT_BLOCK)
+            self.line += self.data[self.offset:end].count("\n")
+            self.offset = end
+        return self.line
+
+
+def _range_lines(data, start, end):
+    """generator yielding the byte offset, bytes and text of each line in a
+    byte range, the text being None for bytes that are not UTF-8. Lines
+    holding other line breaks are split as decode_cart splits them
+    """
+    while start < end:
+        line_end = data.find("\n", start, end) + 1 or end
+        raw = data[start:line_end]
+        try:
+            text = raw.decode("utf-8")
+        except UnicodeDecodeError:
+            yield start, raw, None
+        else:
+            for line in text.splitlines(True) if _LINE_BREAKS.search(text) else [text]:
+                yield start, raw, line
+        start = line_end
+
+
+def price_range(data, start, end, policy="skip-line", **options):
+    """
+    prices the carts in a byte range of UTF-8 text following one of
+    ERROR_POLICIES, returning the Carts and a Reject for each line that
+    cannot be read. A cart is priced whole first, and only gone through
+    line by line when that fails, so carts without errors cost no more than
+    usual. With the fail policy nothing after the first Reject is priced,
+    and a Jurisdiction line that is rejected leaves out its whole cart under
+    every policy, rather than pricing it under the default rules
+    """
+    mark = STATS and STATS.mark()
+    try:
+        return [Cart(text, **options) for text in decode_cart(data, start, end)], []
+    except _LINE_ERRORS:
+        # the lines are counted as they are gone through again
+        if STATS:
+            STATS.rewind(mark)
+        return _price_lines(data, start, end, policy, options)
+
+
+def _price_lines(data, start, end, policy, options):
+    """the line by line pricing of price_range, for byte ranges holding
+    lines that cannot be read
+    """
+    carts, rejects = [], []
+    cart, dropped = None, False
+    for offset, raw, text in _range_lines(data, start, end):
+        if text is not None and (text.lower().startswith(u"input") or not text.strip()):
+            if cart is not None and not dropped and len(cart.lines):
+                carts.append(cart)
+            cart, dropped = None, False
+            continue
+        if cart is None:
+            cart = Cart(**options)
+        name = None if text is None or len(cart.lines) else jurisdiction_of(text)
+        mark = STATS and STATS.mark()
+        try:
+            _add_line(cart, raw, text, name)
+        except _LINE_ERRORS as error:
+            if STATS:
+                STATS.rewind(mark, ("errors",))
+                STATS.count("errors")
+            rejects.append(Reject(offset, unicode(error),
+                                  raw.decode("utf-8", "replace").rstrip(u"\r\n")))
+            if policy == "fail":
+                return carts, rejects
+            dropped = dropped or policy == "skip-cart" or name is not None
+    if cart is not None and not dropped and len(cart.lines):
+        carts.append(cart)
+    return carts, rejects
+
+
+def _add_line(cart, raw, text, name):
+    """adds a line of bulk mode to a cart, text being None for bytes that
+    are not UTF-8 and name that of a Jurisdiction line
+    """
+    if text is None:
+        raw.decode("utf-8")
+    if name is None:
+        cart.add_item(text)
+    else:
+        cart.set_jurisdiction(name)
+
+
+def _price_ranges(data, ranges, policy, format, options):
+    """renders the carts in byte ranges following an error policy, returns
+    the receipts and Rejects
+    """
+    receipts, rejects = [], []
+    for start, end in ranges:
+        carts, range_rejects = price_range(data, start, end, policy, **options)
+        receipts.extend(render_receipt(cart, format) for cart in carts)
+        rejects.extend(range_rejects)
+        if range_rejects and policy == "fail":
+            break
+    return receipts, rejects
+
+
+def iter_receipts(filenames, **options):
+    """
+    generator that iterates over a list of filenames, yielding a Cart for each
+    shopping list in turn. Only one cart is held in memory at a time. Keyword
+    options (engine, classifier) are passed on to each Cart
+    """
+    for filename in filenames:
+        for cart in read_carts(filename):
+            yield Cart(cart, **options)
+
+
+# Cart options and receipt format of a worker process, set once when the
+# pool starts rather than pickled along with every chunk
+_worker_options = {}
+_worker_format = "text"
+
+
+def _init_worker(options, format="text"):
+    global _worker_format
+    _worker_options.update(options)
+    _worker_format = format
+
+
+# files mapped by a worker process, by filename, with the identity of the
+# file each was mapped from
+_worker_files = {}
+
+
+def _worker_data(filename):
+    """returns the memory map of a file in a worker process, which maps each
+    file once for as long as it is unchanged, so that a pool reused after a
+    file was rewritten does not read stale bytes
+    """
+    status = os.stat(filename)
+    identity = (status.st_dev, status.st_ino, status.st_size, status.st_mtime)
+    mapped = _worker_files.get(filename)
+    if mapped is None or mapped[0] != identity:
+        if mapped is not None:
+            mapped[1].close()
+        with open(filename, "rb") as file_in:
+            mapped = _worker_files[filename] = identity, mmap.mmap(
+                file_in.fileno(), 0, access=mmap.ACCESS_READ)
+    return mapped[1]
+
+
+def _worker_carts(filename, ranges):
+    """returns the cart texts in byte ranges of a file, run inside worker
+    processes
+    """
+    data = _worker_data(filename)
+    return [cart for start, end in ranges for cart in decode_cart(data, start, end)]
+
+
+def _render_ranges(filename, ranges):
+    """renders the carts in byte ranges of a file to receipts"""
+    return _render_chunk(_worker_carts(filename, ranges))
+
+
+def _render_ranges_tolerant(filename, ranges, policy):
+    """bulk mode counterpart of _render_ranges, returning the receipts and
+    Rejects of the chunk as one result
+    """
+    result = _price_ranges(_worker_data(filename), ranges, policy, _worker_format,
+                           _worker_options)
+    return [result], STATS and STATS.drain()
+
+
+def _map_ranges(function, filename, ranges):
+    """calls function with the Carts in byte ranges of a file, built with the
+    options of the worker, see map_file_carts
+    """
+    carts = [Cart(cart, **_worker_options) for cart in _worker_carts(filename, ranges)]
+    return [function(carts)], STATS and STATS.drain()
+
+
+def _render_chunk(carts):
+    """renders a list of cart texts to receipts, run inside worker processes.
+    Returns the receipts and, while instrumented, the stats of the chunk
+    """
+    receipts = [render_receipt(Cart(cart, **_worker_options), _worker_format)
+                for cart in carts]
+    return receipts, STATS and STATS.drain()
+
+
+def _chunked(iterable, size):
+    """generator grouping an iterable into lists of at most size elements"""
+    chunk = []
+    for element in iterable:
+        chunk.append(element)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@contextmanager
+def worker_pool(workers, format="text", **options):
+    """context manager providing a process pool of the given size whose
+    workers build each Cart with the keyword options given and render it in
+    format, or None when workers is falsy or 1 so that callers fall back to
+    the serial path
+    """
+    if not workers or workers < 2:
+        yield None
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(workers, _init_worker, (options, format))
+    try:
+        yield pool
+    finally:
+        pool.close()
+        pool.join()
+
+
+def render_carts(carts, pool=None, chunksize=_CHUNK_SIZE, format="text", **options):
+    """
+    generator yielding the receipt, rendered by render_receipt, for each cart
+    text, in the same order as the input. With a pool, chunks of carts are
+    priced in worker processes, using the options and format the pool was
+    created with, and only a bounded number of chunks is in flight at any time
+    """
+    if pool is None:
+        for cart in carts:
+            yield render_receipt(Cart(cart, **options), format)
+        return
+    for receipt in _dispatch(pool, _render_chunk,
+                             ((chunk,) for chunk in _chunked(carts, chunksize))):
+        yield receipt
+
+
+def render_file(filename, pool=None, chunksize=_CHUNK_SIZE, cache=None,
+                resume=False, format="text", errors=None, rejects=None, **options):
+    """
+    generator yielding the receipt for each cart in a file, in order. With a
+    pool only the byte ranges of carts are sent to the workers, which read
+    the carts from the file themselves, unless it is a pipe they cannot
+    read again. With a ReceiptCache, receipts are
+    looked up in it first, and resume carries on from its checkpoint.
+    errors, one of ERROR_POLICIES, turns on bulk mode, lines that cannot be
+    read being passed to rejects, a RejectWriter, rather than raising
+    """
+    if errors is not None:
+        if errors not in ERROR_POLICIES:
+            raise ValueError("Unknown error policy %r" % errors)
+        if cache is not None:
+            raise ValueError("Error policies cannot be combined with a cache")
+        return _render_tolerant(filename, pool, chunksize, format, errors, rejects, options)
+    if cache is not None:
+        return cache.render_file(filename, pool, resume, format, **options)
+    if pool is None or not is_regular_file(filename):
+        return render_carts(read_carts(filename), pool, chunksize, format, **options)
+    ranges = _chunked(read_cart_ranges(filename), chunksize)
+    return _dispatch(pool, _render_ranges, ((filename, chunk) for chunk in ranges))
+
+
+def map_file_carts(function, filename, pool, chunksize=None):
+    """
+    generator yielding function(carts) for each chunk of chunksize carts of
+    a file, as many as render_file sends when None, in order. The byte
+    ranges of the chunks are sent to the workers of pool, which read the
+    carts themselves and call function with a list of Carts built with the
+    options the pool was created with. function has to be defined at module
+    level, so that it can be sent to the workers
+    """
+    ranges = _chunked(read_cart_ranges(filename), chunksize or _CHUNK_SIZE)
+    return _dispatch(pool, _map_ranges, ((function, filename, chunk) for chunk in ranges))
+
+
+def _render_tolerant(filename, pool, chunksize, format, policy, rejects, options):
+    """generator behind the bulk mode of render_file, numbering the lines of
+    Rejects in the parent as they come back in file order
+    """
+    name = decode_filename(filename)
+    with mapped_file(filename) as data:
+        counter = LineCounter(data)
+        chunks = _chunked(read_cart_ranges(filename, data), chunksize)
+        if pool is None or not is_regular_file(filename):
+            results = (_price_ranges(data, chunk, policy, format, options) for chunk in chunks)
+        else:
+            results = _dispatch(pool, _render_ranges_tolerant,
+                                ((filename, chunk, policy) for chunk in chunks))
+        for receipts, chunk_rejects in results:
+            for receipt in receipts:
+                yield receipt
+            for reject in chunk_rejects:
+                line = counter.line_at(reject.offset)
+                if rejects is not None:
+                    rejects.reject(name, line, reject)
+                if policy == "fail":
+                    raise RejectedLineError(name, line, reject.offset, reject.reason)
+
+
+def _dispatch(pool, function, arguments):
+    """generator yielding the receipts of calls of function in a pool, in
+    order, with only a bounded number of calls in flight at any time
+    """
+    pending = deque()
+    for args in arguments:
+        pending.append(pool.apply_async(function, args))
+        if len(pending) >= _CHUNKS_IN_FLIGHT:
+            for receipt in _collect(pending.popleft()):
+                yield receipt
+    while pending:
+        for receipt in _collect(pending.popleft()):
+            yield receipt
+
+
+def _collect(result):
+    """returns the receipts of a chunk, merging in the stats of the worker"""
+    receipts, state = result.get()
+    if state and STATS:
+        STATS.merge(state)
+    return receipts
+
+
+def write_receipts(filenames, out, workers=None, cache=None, resume=False,
+                   format="text", errors=None, rejects=None, **options):
+    """
+    streaming counterpart of parse_files, writes each receipt to the file-like
+    object out as soon as it is calculated instead of building one string,
+    in one of FORMATS. The receipts before a failure are still written
+    """
+    writer = WRITERS[format](out)
+    try:
+        with worker_pool(workers, format, **options) as pool:
+            for filename in filenames:
+                name = decode_filename(filename)
+                writer.begin_file(name)
+                receipts = render_file(filename, pool, cache=cache, resume=resume,
+                                       format=format, errors=errors, rejects=rejects,
+                                       **options)
+                for number, receipt in enumerate(receipts, 1):
+                    writer.receipt(name, number, receipt)
+    finally:
+        writer.flush()
+        if rejects is not None:
+            rejects.flush()
+
+
+def iter_stream_carts(lines):
+    """
+    generator over lines of UTF-8 bytes, such as those of stdin, yielding
+    the byte offset, line number and bytes of each cart as soon as the line
+    ending it arrives, split as iter_cart_ranges splits a file
+    """
+    offset, number = 0, 1
+    cart, start, first = [], 0, 1
+    for line in lines:
+        if _is_delimiter(line):
+            if cart:
+                yield start, first, "".join(cart)
+                cart = []
+        else:
+            if not cart:
+                start, first = offset, number
+            cart.append(line)
+        offset += len(line)
+        number += 1
+    if cart:
+        yield start, first, "".join(cart)
+
+
+def stream_receipts(in_file, out, format="text", errors=None, rejects=None, **options):
+    """
+    persistent counterpart of write_receipts, reads carts from the file-like
+    object in_file until it is closed, writing and flushing each receipt to
+    out as soon as its cart is complete. errors and rejects turn on bulk
+    mode as in render_file, lines being numbered from the start of in_file
+    """
+    if errors is not None and errors not in ERROR_POLICIES:
+        raise ValueError("Unknown error policy %r" % errors)
+    writer = WRITERS[format](out)
+    writer.begin_file(_STDIN)
+    writer.flush()
+    out.flush()
+    number = 0
+    for start, line, data in iter_stream_carts(iter(in_file.readline, "")):
+        if errors is None:
+            carts, cart_rejects = [Cart(text, **options)
+                                   for text in decode_cart(data, 0, len(data))], []
+        else:
+            carts, cart_rejects = price_range(data, 0, len(data), errors, **options)
+        for cart in carts:
+            number += 1
+            writer.receipt(_STDIN, number, render_receipt(cart, format))
+        writer.flush()
+        out.flush()
+        for reject in cart_rejects:
+            reject_line = line + data.count("\n", 0, reject.offset)
+            if rejects is not None:
+                rejects.reject(_STDIN, reject_line, reject._replace(offset=start + reject.offset))
+                rejects.flush()
+            if errors == "fail":
+                raise RejectedLineError(_STDIN, reject_line, start + reject.offset,
+                                        reject.reason)
+
+
+# name standard input is given in receipts and rejects
+_STDIN = u"<stdin>"
+
+
+def render_receipt(cart, format="text"):
+    """
+    renders a Cart in one of FORMATS: the text of its receipt, CSV rows of
+    each line then the totals, or the members of a JSON object. Both of the
+    latter lack the file and cart number, which ReceiptWriters add
+    """
+    if format == "text":
+        return cart.receipt
+    entries = cart.lines.entries()
+    if format == "csv":
+        rows = [_csv_row([u"item", quantity, name, unit_price, sales_tax, price,
+                          int(imported), int(exempt)])
+                for quantity, name, unit_price, imported, exempt, sales_tax, price in entries]
+        rows.append(_csv_row([u"total", u"", u"", u"", cart.sales_tax, cart.total, u"", u""]))
+        return u"".join(rows)
+    if format == "jsonl":
+        items = [{"quantity": quantity, "name": name, "unit_price": unicode(unit_price),
+                  "imported": imported, "exempt": exempt, "sales_tax": unicode(sales_tax),
+                  "price": unicode(price)}
+                 for quantity, name, unit_price, imported, exempt, sales_tax, price in entries]
+        members = json.dumps({"items": items, "sales_tax": unicode(cart.sales_tax),
+                              "total": unicode(cart.total)}, ensure_ascii=False, sort_keys=True)
+        return unicode(members)[1:-1]
+    raise ValueError("Unknown receipt format %r" % format)
+
+
+def parse_files(filenames, workers=None, cache=None, resume=False, errors=None,
+                rejects=None, **options):
+    """
+    function that iterates over a list of filenames, treating each as
+    cart(s) and printing receipts. workers > 1 prices carts in a process pool.
+    cache is a ReceiptCache keeping receipts between runs, resume skips the
+    carts its checkpoint has already been through. errors and rejects turn
+    on bulk mode as in render_file.
+    Keyword options are passed on to each Cart: engine selects the tax
+    arithmetic, DECIMAL_ENGINE by default, and classifier the KeywordIndex
+    used to tell imported and tax exempt goods
+    """
+    stdout = []
+    with worker_pool(workers, **options) as pool:
+        for filename in filenames:
+            print "Receipts from " + filename
+            receipts = render_file(filename, pool, cache=cache, resume=resume,
+                                   errors=errors, rejects=rejects, **options)
+            for j, receipt in enumerate(receipts, 1):
+                stdout.append(u"Output %s:\n" % j)
+                stdout.append(receipt)
+    return u"".join(stdout)
+
+
+def main(argv):
+    """command-line entry point, argv excludes the name of this file"""
+    args = _parse_arguments(argv)
+    resize_caches(args.cache_size)
+    options, rejects_out = _run_options(args)
+    try:
+        if not args.stats:
+            run(args, options)
+            return
+        from stats import Stats, instrument, write_stats
+        with instrument(Stats()) as stats:
+            run(args, options)
+        write_stats(stats, args.stats_file)
+    except RejectedLineError as error:
+        sys.exit(unicode(error).encode("utf-8"))
+    finally:
+        if args.on_error:
+            options["rejects"].flush()
+        if rejects_out is not None:
+            rejects_out.close()
+
+
+def _parse_arguments(argv):
+    """parses and checks the command-line arguments of main"""
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Prints receipts for files of shopping carts")
+    parser.add_argument("filenames", nargs="*", metavar="file")
+    parser.add_argument("--stream", action="store_true",
+                        help="write each receipt as soon as it is calculated")
+    parser.add_argument("--stdin", action="store_true",
+                        help="read carts from standard input until it is closed, "
+                        "flushing each receipt as soon as its cart ends")
+    parser.add_argument("--workers", type=int, default=None, metavar="N",
+                        help="price carts in N worker processes")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="decimal",
+                        help="arithmetic used for the tax calculation")
+    parser.add_argument("--catalog", metavar="FILE",
+                        help="keyword catalog of imported and exempt goods")
+    parser.add_argument("--cache-size", type=int, default=_CACHE_SIZE, metavar="N",
+                        help="names and prices memoized, 0 disables the caches")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="tax jurisdictions carts can name, see load_rules")
+    parser.add_argument("--jurisdiction", metavar="NAME",
+                        help="jurisdiction of carts that do not name one")
+    parser.add_argument("--compact", action="store_true",
+                        help="store the lines of each cart in an ItemTable")
+    parser.add_argument("--stats", action="store_true",
+                        help="write timings of each stage as JSON to stderr")
+    parser.add_argument("--stats-file", metavar="FILE",
+                        help="file to write the --stats JSON to rather than stderr")
+    parser.add_argument("--cache", metavar="FILE",
+                        help="database of receipts kept between runs")
+    parser.add_argument("--resume", action="store_true",
+                        help="carry on from where an interrupted run with --cache stopped")
+    parser.add_argument("--format", choices=FORMATS, default="text",
+                        help="layout of the receipts, csv and jsonl are always streamed")
+    parser.add_argument("--on-error", choices=ERROR_POLICIES, metavar="POLICY",
+                        help="bulk mode, lines that cannot be read are recorded and "
+                        "either fail the run, are skipped or have their cart skipped: "
+                        + ", ".join(ERROR_POLICIES))
+    parser.add_argument("--rejects", metavar="FILE",
+                        help="CSV file of the lines rejected in bulk mode, stderr by default")
+    args = parser.parse_args(argv)
+    if args.stdin and (args.filenames or args.workers or args.cache):
+        parser.error("--stdin cannot be combined with files, --workers or --cache")
+    if not args.stdin and not args.filenames:
+        parser.error("files or --stdin are required")
+    if args.resume and not args.cache:
+        parser.error("--resume requires --cache")
+    if args.jurisdiction and not args.rules:
+        parser.error("--jurisdiction requires --rules")
+    if args.rejects and not args.on_error:
+        parser.error("--rejects requires --on-error")
+    if args.stats_file and not args.stats:
+        parser.error("--stats-file requires --stats")
+    if args.on_error and args.cache:
+        parser.error("--on-error cannot be combined with --cache")
+    return args
+
+
+def _run_options(args):
+    """returns the keyword options of render_file for the parsed arguments,
+    and the file rejects are written to when it is to be closed
+    """
+    options = {"engine": ENGINES[args.engine], "compact": args.compact}
+    if args.catalog:
+        options["classifier"] = load_classifier(args.catalog)
+    if args.rules:
+        options["rules"] = load_rules(args.rules, args.jurisdiction)
+    if args.cache:
+        from cache import ReceiptCache
+        options["cache"] = ReceiptCache(args.cache)
+    rejects_out = None
+    if args.on_error:
+        options["errors"] = args.on_error
+        rejects_out = open(args.rejects, "wb") if args.rejects else None
+        options["rejects"] = RejectWriter(codecs.getwriter("utf-8")(rejects_out or sys.stderr))
+    return options, rejects_out
+
+
+def run(args, options):
+    """prints the receipts for the parsed command-line arguments"""
+    if args.stdin:
+        stream_receipts(sys.stdin, codecs.getwriter("utf-8")(sys.stdout),
+                        format=args.format, **options)
+    elif args.stream or args.format != "text":
+        write_receipts(args.filenames, codecs.getwriter("utf-8")(sys.stdout),
+                       args.workers, resume=args.resume, format=args.format, **options)
+    else:
+        print parse_files(args.filenames, args.workers, resume=args.resume, **options)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Summary reports over many shopping carts, built in one streaming pass
+without keeping receipts around.
+
+A TaxSummary accumulates the totals of the items added to it as integer
+cents, so summaries of chunks, files or worker processes can be merged
+exactly, in any order. A Report keeps one overall TaxSummary and one for
+each file.
+
+An item's sales tax is split into basic sales tax and import duty. Basic
+tax is what the item would be charged if it were not imported, rounded the
+same way, and import duty is the rest, so the two always add up to the
+sales tax on the receipt. Revenue is the price before tax, split by
+whether the item is tax exempt.
+
+/tax_calc/docs$ python reports.py --workers 4 input.txt
+"""
+
+from collections import OrderedDict
+import argparse
+import json
+import sys
+
+from pricing import Cart, ENGINES, Item, from_cents, is_regular_file, load_classifier, \
+    load_rules, map_file_carts, read_carts, to_cents, worker_pool
+
+
+class TaxSummary(object):
+
+    """Running totals of priced carts, in integer cents"""
+
+    FIELDS = ("carts", "items", "sales_tax", "basic_tax", "import_duty",
+              "exempt_revenue", "taxable_revenue", "total")
+    AMOUNTS = FIELDS[2:]
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add_item(self, item):
+        """adds the amounts of an Item, using the engine it was created with"""
+        sales_tax, price = item.get_amounts()
+        sales_tax = to_cents(sales_tax)
+        basic_tax = sales_tax
+        if item.imported:
+            domestic = Item.from_fields(item.quantity_text, item.name, item.unit_price,
+                                        False, item.tax_exempt, item.engine,
+                                        item.jurisdiction)
+            basic_tax = to_cents(domestic.get_tax_amount())
+        revenue = to_cents(price) - sales_tax
+        self.items += 1
+        self.sales_tax += sales_tax
+        self.basic_tax += basic_tax
+        self.import_duty += sales_tax - basic_tax
+        if item.tax_exempt:
+            self.exempt_revenue += revenue
+        else:
+            self.taxable_revenue += revenue
+        self.total += revenue + sales_tax
+
+    def add_cart(self, cart):
+        self.carts += 1
+        for item in cart.items:
+            self.add_item(item)
+
+    def merge(self, other):
+        """adds in the totals of another TaxSummary, returns self"""
+        for field in self.FIELDS:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        return self
+
+    def __eq__(self, other):
+        return isinstance(other, TaxSummary) and all(
+            getattr(self, field) == getattr(other, field) for field in self.FIELDS)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "TaxSummary(%s)" % ", ".join(
+            "%s=%s" % (field, getattr(self, field)) for field in self.FIELDS)
+
+    def report(self):
+        """returns the totals as a dict ready to be written as JSON, amounts
+        being strings of two decimal places
+        """
+        return OrderedDict((field, unicode(from_cents(getattr(self, field)))
+                            if field in self.AMOUNTS else getattr(self, field))
+                           for field in self.FIELDS)
+
+
+class Report(object):
+
+    """A TaxSummary of everything, and one for each file, in the order the
+    files were first seen
+    """
+
+    def __init__(self):
+        self.overall = TaxSummary()
+        self.files = OrderedDict()
+
+    def summary(self, filename):
+        summary = self.files.get(filename)
+        if summary is None:
+            summary = self.files[filename] = TaxSummary()
+        return summary
+
+    def add_cart(self, cart, filename):
+        self.add_summary(summarize_carts([cart]), filename)
+
+    def add_summary(self, summary, filename):
+        """merges the summary of some carts of a file"""
+        self.summary(filename).merge(summary)
+        self.overall.merge(summary)
+
+    def merge(self, other):
+        """adds in another Report, returns self"""
+        for filename, summary in other.files.iteritems():
+            self.add_summary(summary, filename)
+        return self
+
+    def report(self):
+        return {"overall": self.overall.report(),
+                "files": OrderedDict((filename, summary.report())
+                                     for filename, summary in self.files.iteritems())}
+
+
+def summarize_carts(carts):
+    """returns the TaxSummary of an iterable of Carts"""
+    summary = TaxSummary()
+    for cart in carts:
+        summary.add_cart(cart)
+    return summary
+
+
+def summarize_file(filename, pool=None, chunksize=None, **options):
+    """returns the TaxSummary of the carts in a file. With a pool, chunks of
+    the file are summarized in the workers, which were created with the
+    options, and the partial summaries merged, see map_file_carts
+    """
+    if pool is None or not is_regular_file(filename):
+        return summarize_carts(Cart(cart, **options) for cart in read_carts(filename))
+    summary = TaxSummary()
+    for partial in map_file_carts(summarize_carts, filename, pool, chunksize):
+        summary.merge(partial)
+    return summary
+
+
+def summarize_files(filenames, workers=None, **options):
+    """returns the Report of files of shopping carts, workers > 1 pricing
+    them in a process pool. Keyword options are passed on to each Cart
+    """
+    report = Report()
+    with worker_pool(workers, **options) as pool:
+        for filename in filenames:
+            report.add_summary(summarize_file(filename, pool, **options), filename)
+    return report
+
+
+def main(argv):
+    """command-line entry point, argv excludes the name of this file"""
+    parser = argparse.ArgumentParser(description="Summarizes the taxes of shopping carts")
+    parser.add_argument("filenames", nargs="+", metavar="FILE")
+    parser.add_argument("--workers", type=int, default=None, metavar="N")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="decimal")
+    parser.add_argument("--catalog", metavar="FILE")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="tax jurisdictions carts can name, see tax_calc.load_rules")
+    parser.add_argument("--jurisdiction", metavar="NAME",
+                        help="jurisdiction of carts that do not name one")
+    parser.add_argument("--output", metavar="FILE", help="file to write the report JSON to")
+    args = parser.parse_args(argv)
+    if args.jurisdiction and not args.rules:
+        parser.error("--jurisdiction requires --rules")
+    options = {"engine": ENGINES[args.engine]}
+    if args.catalog:
+        options["classifier"] = load_classifier(args.catalog)
+    if args.rules:
+        options["rules"] = load_rules(args.rules, args.jurisdiction)
+    text = json.dumps(summarize_files(args.filenames, args.workers, **options).report(),
+                      indent=2)
+    if args.output:
+        with open(args.output, "w") as file_out:
+            file_out.write(text + "\n")
+    else:
+        print text
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Long-running receipt service, so that pricing a cart does not pay for
+starting an interpreter and warming the caches each time.
+
+Clients connect over TCP or a Unix socket and send carts in either of two
+ways, which can be mixed on one connection:
+
+A JSON object on a line of its own, {"id": 1, "cart": "1 book at 12.49\\n"},
+answered by a line {"id": 1, "receipt": ..., "sales_tax": "1.25",
+"total": "13.74"}, or {"id": 1, "error": ...} for a cart that cannot be read.
+
+The plain text of a cart ended by a blank line, answered by its receipt and
+a blank line. Lines beginning with "input" are skipped as in input files.
+
+Connections are served by threads, asyncio being unavailable on Python 2.
+Their requests are queued for a single batching thread which prices up to
+batch_size carts at a time, batches of many lines being sent to a worker
+pool. The queue is bounded: when it is full connections are no longer read
+from, slowing clients down rather than letting requests pile up.
+"""
+
+from functools import partial
+from Queue import Empty, Queue
+import SocketServer
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from pricing import Cart, ENGINES, load_classifier, load_rules, resize_caches
+
+# carts priced together, and seconds spent waiting for a batch to fill
+_BATCH_SIZE = 64
+_BATCH_DELAY = 0.0
+
+# requests queued before connections stop being read
+_QUEUE_SIZE = 1024
+
+# batches of at least this many lines are priced in the worker pool, of
+# which only so many can be in flight at a time
+_POOL_LINES = 64
+_BATCHES_IN_FLIGHT = 8
+
+
+def price_carts(carts, **options):
+    """returns a response dict for each cart text, a cart that cannot be read
+    getting an error rather than failing the others, whatever it raises.
+    Keyword options are passed on to each Cart
+    """
+    responses = []
+    for cart in carts:
+        try:
+            priced = Cart(cart, **options)
+        except Exception as error:
+            responses.append({"error": unicode(error)})
+        else:
+            responses.append({"receipt": priced.receipt,
+                              "sales_tax": unicode(priced.sales_tax),
+                              "total": unicode(priced.total)})
+    return responses
+
+
+# Cart options of a worker process, set once when the pool starts
+_worker_options = {}
+
+
+def _init_worker(options):
+    _worker_options.update(options)
+
+
+def _price_in_worker(carts):
+    """price_carts run inside worker processes. Any other error is answered
+    too, as the batching thread is only called back with results
+    """
+    try:
+        return price_carts(carts, **_worker_options)
+    except Exception as error:
+        return [{"error": unicode(error)}] * len(carts)
+
+
+class Request(object):
+
+    """A cart waiting to be priced, and the event its connection waits on
+    for the response
+    """
+
+    __slots__ = ("cart", "lines", "response", "done")
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.lines = cart.count(u"\n") + 1
+        self.response = None
+        self.done = threading.Event()
+
+    def resolve(self, response):
+        self.response = response
+        self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        return self.response
+
+
+class Batcher(object):
+
+    """Prices queued requests in batches on a thread of its own. Whatever is
+    queued when a batch starts is taken, up to batch_size requests, waiting
+    up to batch_delay seconds for more when batch_delay is set. Batches of
+    pool_lines lines or more are handed to pool when there is one
+    """
+
+    def __init__(self, pool=None, batch_size=_BATCH_SIZE, batch_delay=_BATCH_DELAY,
+                 queue_size=_QUEUE_SIZE, pool_lines=_POOL_LINES, **options):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.pool_lines = pool_lines
+        self.options = options
+        self.queue = Queue(queue_size)
+        self.in_flight = threading.Semaphore(_BATCHES_IN_FLIGHT)
+        self.batches = 0
+        self.thread = threading.Thread(target=self.run, name="batcher")
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        """prices what is already queued, then ends the thread"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    def submit(self, cart):
+        """queues a cart text, blocking while the queue is full, and returns
+        its Request
+        """
+        request = Request(cart)
+        self.queue.put(request)
+        return request
+
+    def run(self):
+        running = True
+        while running:
+            batch, running = self.next_batch()
+            if batch:
+                try:
+                    self.price(batch)
+                except Exception as error:
+                    # answers the batch rather than ending the thread, which
+                    # would leave every later request waiting
+                    self.resolve(batch, [{"error": unicode(error)}] * len(batch))
+
+    def next_batch(self):
+        """returns the requests of the next batch, and False once stop has
+        been asked for
+        """
+        request = self.queue.get()
+        if request is None:
+            return [], False
+        batch = [request]
+        deadline = time.time() + self.batch_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.time()
+            try:
+                if timeout > 0:
+                    request = self.queue.get(True, timeout)
+                else:
+                    request = self.queue.get_nowait()
+            except Empty:
+                break
+            if request is None:
+                return batch, False
+            batch.append(request)
+        return batch, True
+
+    def price(self, batch):
+        self.batches += 1
+        carts = [request.cart for request in batch]
+        if self.pool is None or sum(request.lines for request in batch) < self.pool_lines:
+            self.resolve(batch, price_carts(carts, **self.options))
+            return
+        # blocks the batching thread, and so in turn the connections, while
+        # the pool is busy enough
+        self.in_flight.acquire()
+        try:
+            self.pool.apply_async(_price_in_worker, (carts,),
+                                  callback=partial(self.resolve_pooled, batch))
+        except Exception:
+            self.in_flight.release()
+            raise
+
+    def resolve(self, batch, responses):
+        for request, response in zip(batch, responses):
+            request.resolve(response)
+
+    def resolve_pooled(self, batch, responses):
+        self.in_flight.release()
+        self.resolve(batch, responses)
+
+
+class ReceiptHandler(SocketServer.StreamRequestHandler):
+
+    """Serves one connection, answering its requests in the order they are
+    sent
+    """
+
+    def handle(self):
+        lines = []
+        for line in iter(self.rfile.readline, ""):
+            try:
+                text = line.decode("utf-8")
+            except UnicodeDecodeError as error:
+                self.write(u"Error: %s\n\n" % error)
+                lines = []
+                continue
+            if not lines and text.startswith(u"{"):
+                self.answer_json(text)
+            elif text.strip() and not text.lower().startswith(u"input"):
+                lines.append(text)
+            elif lines:
+                self.answer_text(u"".join(lines))
+                lines = []
+        if lines:
+            self.answer_text(u"".join(lines))
+
+    def answer_json(self, text):
+        message = None
+        try:
+            message = json.loads(text)
+            cart = message["cart"]
+            if not isinstance(cart, basestring):
+                raise ValueError("cart must be a string")
+        except (ValueError, KeyError, TypeError) as error:
+            response = {"error": u"Bad request: %s" % error}
+        else:
+            response = dict(self.server.batcher.submit(cart).wait())
+        if isinstance(message, dict) and "id" in message:
+            response["id"] = message["id"]
+        self.write(json.dumps(response, sort_keys=True) + u"\n")
+
+    def answer_text(self, cart):
+        response = self.server.batcher.submit(cart).wait()
+        if "error" in response:
+            self.write(u"Error: %s\n\n" % response["error"])
+        else:
+            self.write(response["receipt"] + u"\n")
+
+    def write(self, text):
+        self.wfile.write(text.encode("utf-8"))
+
+
+class ThreadingTCPServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ThreadingUnixServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+class ReceiptService(object):
+
+    """The receipt server, its batching thread and worker pool. address is
+    a (host, port) pair, port 0 picking a free one, or the path of a Unix
+    socket. workers > 1 starts a pool for large batches, keyword settings
+    are passed on to the Batcher and from there to each Cart
+    """
+
+    def __init__(self, address, workers=None, **settings):
+        self.pool = None
+        if workers and workers > 1:
+            options = dict((key, value) for key, value in settings.items()
+                           if key in ("engine", "classifier", "compact", "rules"))
+            self.pool = multiprocessing.Pool(workers, _init_worker, (options,))
+        self.batcher = Batcher(self.pool, **settings)
+        if isinstance(address, basestring):
+            self.server = ThreadingUnixServer(address, ReceiptHandler)
+        else:
+            self.server = ThreadingTCPServer(address, ReceiptHandler)
+        self.server.batcher = self.batcher
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address
+
+    def start(self):
+        """serves on a thread of its own, returns at once"""
+        self.batcher.start()
+        self.thread = threading.Thread(target=self.server.serve_forever, name="server")
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.batcher.start()
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.thread is not None:
+            self.server.shutdown()
+            self.thread.join()
+        self.server.server_close()
+        self.batcher.stop()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+        if isinstance(self.address, basestring) and os.path.exists(self.address):
+            os.remove(self.address)
+
+
+def main(argv):
+    """command-line entry point, argv excludes the name of this file"""
+    parser = argparse.ArgumentParser(description="Serves receipts for shopping carts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket", metavar="PATH",
+                        help="listen on a Unix socket rather than TCP")
+    parser.add_argument("--workers", type=int, default=None, metavar="N",
+                        help="price large batches in N worker processes")
+    parser.add_argument("--batch-size", type=int, default=_BATCH_SIZE, metavar="N")
+    parser.add_argument("--batch-delay", type=float, default=_BATCH_DELAY, metavar="SECONDS",
+                        help="time to wait for a batch to fill")
+    parser.add_argument("--queue-size", type=int, default=_QUEUE_SIZE, metavar="N",
+                        help="requests queued before clients are slowed down")
+    parser.add_argument("--engine", choices=sorted(ENGINES), default="decimal")
+    parser.add_argument("--catalog", metavar="FILE")
+    parser.add_argument("--rules", metavar="FILE",
+                        help="tax jurisdictions carts can name")
+    parser.add_argument("--cache-size", type=int, default=None, metavar="N")
+    args = parser.parse_args(argv)
+    if args.cache_size is not None:
+        resize_caches(args.cache_size)
+    settings = {"engine": ENGINES[args.engine], "batch_size": args.batch_size,
+                "batch_delay": args.batch_delay, "queue_size": args.queue_size}
+    if args.catalog:
+        settings["classifier"] = load_classifier(args.catalog)
+    if args.rules:
+        settings["rules"] = load_rules(args.rules)
+    service = ReceiptService(args.socket or (args.host, args.port), args.workers, **settings)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
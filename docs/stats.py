@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Counters and per-stage timings of pricing runs. instrument swaps the
+functions of each stage in the pricing module for timed wrappers while a
+run is measured, and sets pricing.STATS, which worker processes report
+their share of the work through.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import sys
+import time
+
+import pricing
+from pricing import CLASSIFICATION_CACHE, TAX_CACHE, Item
+
+
+class Stats(object):
+
+    """Counters and per-stage timings of a run, filled in while instrument()
+    is in effect. The stages are reading carts from files, tokenizing lines,
+    classifying names, the tax arithmetic and rendering receipts. Hooks are
+    called with (stage, seconds) as each call of a stage completes, in the
+    process doing the work
+    """
+
+    STAGES = ("read", "tokenize", "classify", "tax", "render")
+    COUNTERS = ("lines", "carts", "bytes", "errors")
+    CACHES = ("classification", "tax")
+
+    def __init__(self):
+        self.hooks = []
+        self.elapsed = 0.0
+        self.reset()
+
+    def reset(self):
+        """zeroes the timings and counters, keeping the hooks"""
+        self.seconds = dict.fromkeys(self.STAGES, 0.0)
+        self.calls = dict.fromkeys(self.STAGES, 0)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        for cache in self.CACHES:
+            self.counters[cache + "_hits"] = self.counters[cache + "_misses"] = 0
+        self.cache_marks = self._cache_counts()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def record(self, stage, seconds):
+        self.seconds[stage] += seconds
+        self.calls[stage] += 1
+        for hook in self.hooks:
+            hook(stage, seconds)
+
+    def count(self, counter, number=1):
+        self.counters[counter] += number
+
+    def mark(self):
+        """returns the counters as they are, for rewind"""
+        return dict(self.counters)
+
+    def rewind(self, mark, counters=("lines", "errors")):
+        """sets counters back to a mark, so that work which is done again,
+        or fails in several places at once, is only counted once
+        """
+        for counter in counters:
+            self.counters[counter] = mark[counter]
+
+    def _cache_counts(self):
+        return dict(zip(self.CACHES, [(cache.hits, cache.misses) for cache in
+                                      (CLASSIFICATION_CACHE, TAX_CACHE)]))
+
+    def count_caches(self):
+        """adds the cache hits and misses since the last call"""
+        counts = self._cache_counts()
+        for cache, (hits, misses) in counts.iteritems():
+            marked_hits, marked_misses = self.cache_marks[cache]
+            self.count(cache + "_hits", hits - marked_hits)
+            self.count(cache + "_misses", misses - marked_misses)
+        self.cache_marks = counts
+
+    def drain(self):
+        """returns the timings and counters as plain dicts and zeroes them,
+        used to send the stats of worker processes back to the parent
+        """
+        self.count_caches()
+        state = {"seconds": self.seconds, "calls": self.calls,
+                 "counters": self.counters}
+        self.reset()
+        return state
+
+    def merge(self, state):
+        """adds in timings and counters returned by drain()"""
+        for stage in self.STAGES:
+            self.seconds[stage] += state["seconds"][stage]
+            self.calls[stage] += state["calls"][stage]
+        for counter, number in state["counters"].iteritems():
+            self.count(counter, number)
+
+    def report(self):
+        """returns the stats as a dict ready to be written as JSON, with the
+        throughput of each stage and of the run as a whole
+        """
+        def rate(number, seconds):
+            return round(number / seconds, 1) if seconds else None
+        stages = dict((stage, {"seconds": round(self.seconds[stage], 6),
+                               "calls": self.calls[stage],
+                               "calls_per_sec": rate(self.calls[stage], self.seconds[stage])})
+                      for stage in self.STAGES)
+        throughput = dict(("%s_per_sec" % counter, rate(self.counters[counter], self.elapsed))
+                          for counter in ("lines", "carts", "bytes"))
+        return {"elapsed": round(self.elapsed, 6), "counters": dict(self.counters),
+                "stages": stages, "throughput": throughput}
+
+
+def _timed(stats, stage, function, counter=None):
+    """wraps function so that each call is recorded against a stage of
+    stats, counting calls that raise as errors
+    """
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        except Exception:
+            stats.count("errors")
+            raise
+        finally:
+            stats.record(stage, time.time() - start)
+            if counter:
+                stats.count(counter)
+    return timed
+
+
+def _timed_reader(stats, read, stream=False):
+    """wraps read_carts, read_cart_ranges or, with stream, iter_stream_carts
+    to time reading each cart and count carts and bytes, those of the whole
+    file read or of each line of a stream as it arrives
+    """
+    def timed(source, *args):
+        carts = read(_counted_lines(stats, source) if stream else source, *args)
+        while True:
+            start = time.time()
+            try:
+                cart = next(carts)
+            except StopIteration:
+                break
+            finally:
+                stats.record("read", time.time() - start)
+            stats.count("carts")
+            yield cart
+        if not stream:
+            stats.count("bytes", _bytes_read(source, *args))
+    return timed
+
+
+def _counted_lines(stats, lines):
+    """generator passing lines on, counting their bytes"""
+    for line in lines:
+        stats.count("bytes", len(line))
+        yield line
+
+
+def _bytes_read(filename, data=None, offset=0):
+    """returns the bytes read_carts or read_cart_ranges go through"""
+    return (os.path.getsize(filename) if data is None else len(data)) - offset
+
+
+@contextmanager
+def instrument(stats):
+    """
+    context manager filling in stats with the timings of each stage of
+    pricing carts. The functions of each stage are swapped for timed wrappers
+    and restored on exit, so that nothing is spent on instrumentation the
+    rest of the time. Worker pools started within it report back to stats as
+    well. Not meant to be nested or used from several threads at once
+    """
+    module = vars(pricing)
+    patches = [(module, "read_carts", _timed_reader(stats, pricing.read_carts)),
+               (module, "read_cart_ranges", _timed_reader(stats, pricing.read_cart_ranges)),
+               (module, "iter_stream_carts",
+                _timed_reader(stats, pricing.iter_stream_carts, True)),
+               (module, "tokenize_line", _timed(stats, "tokenize", pricing.tokenize_line, "lines")),
+               (module, "classify", _timed(stats, "classify", pricing.classify)),
+               (Item, "get_amounts", _timed(stats, "tax", Item.__dict__["get_amounts"])),
+               (module, "render_receipt", _timed(stats, "render", pricing.render_receipt))]
+    originals = [(target, name, _get_attribute(target, name)) for target, name, _ in patches]
+    for target, name, value in patches:
+        _set_attribute(target, name, value)
+    pricing.STATS = stats
+    stats.cache_marks = stats._cache_counts()
+    start = time.time()
+    try:
+        yield stats
+    finally:
+        stats.elapsed += time.time() - start
+        stats.count_caches()
+        pricing.STATS = None
+        for target, name, value in originals:
+            _set_attribute(target, name, value)
+
+
+def _get_attribute(target, name):
+    return target[name] if isinstance(target, dict) else target.__dict__[name]
+
+
+def _set_attribute(target, name, value):
+    if isinstance(target, dict):
+        target[name] = value
+    else:
+        setattr(target, name, value)
+
+
+def write_stats(stats, filename=None):
+    """writes the report of stats as JSON to a file, or to stderr"""
+    text = json.dumps(stats.report(), indent=2, sort_keys=True) + "\n"
+    if filename:
+        with open(filename, "w") as file_out:
+            file_out.write(text)
+    else:
+        sys.stderr.write(text)
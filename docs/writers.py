@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Writers streaming the receipts pricing.render_receipt renders to a file,
+framing each for one of FORMATS, and the CSV rows of the lines bulk mode
+rejects.
+"""
+
+import json
+
+FORMATS = ("text", "csv", "jsonl")
+
+_CSV_COLUMNS = (u"file", u"cart", u"kind", u"quantity", u"name", u"unit_price",
+                u"sales_tax", u"price", u"imported", u"exempt")
+
+# characters written before a ReceiptWriter passes them on to its file
+_WRITE_BUFFER = 65536
+
+
+def _csv_row(fields):
+    """returns a CSV record ending in CRLF, quoting fields as the csv module
+    does, which cannot write unicode on Python 2
+    """
+    fields = [unicode(field) for field in fields]
+    return u",".join(u'"%s"' % field.replace(u'"', u'""')
+                     if any(char in field for char in u',"\r\n') else field
+                     for field in fields) + u"\r\n"
+
+
+class ReceiptWriter(object):
+
+    """Streams receipts rendered by render_receipt to a file-like object,
+    gathering them into blocks of about _WRITE_BUFFER characters. Subclasses
+    frame each receipt for their format
+    """
+
+    format = None
+
+    def __init__(self, out):
+        self.out = out
+        self.pending = []
+        self.size = 0
+
+    def write(self, text):
+        self.pending.append(text)
+        self.size += len(text)
+        if self.size >= _WRITE_BUFFER:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.out.write(u"".join(self.pending))
+            self.pending = []
+            self.size = 0
+
+    def begin_file(self, filename):
+        pass
+
+    def receipt(self, filename, number, receipt):
+        raise NotImplementedError
+
+
+class TextWriter(ReceiptWriter):
+
+    """The "Output N:" layout of parse_files"""
+
+    format = "text"
+
+    def begin_file(self, filename):
+        self.write(u"Receipts from %s\n" % filename)
+
+    def receipt(self, filename, number, receipt):
+        self.write(u"Output %s:\n" % number)
+        self.write(receipt)
+
+
+class CsvWriter(ReceiptWriter):
+
+    """A header, then a row for every line and for the totals of each cart"""
+
+    format = "csv"
+
+    def __init__(self, out):
+        super(CsvWriter, self).__init__(out)
+        self.write(_csv_row(_CSV_COLUMNS))
+
+    def receipt(self, filename, number, receipt):
+        prefix = _csv_row([filename, number])[:-2] + u","
+        for row in receipt.split(u"\r\n")[:-1]:
+            self.write(prefix + row + u"\r\n")
+
+
+class JsonLinesWriter(ReceiptWriter):
+
+    """A JSON object on a line of its own for each cart"""
+
+    format = "jsonl"
+
+    def receipt(self, filename, number, receipt):
+        self.write(u'{"cart": %s, "file": %s, %s}\n' % (
+            number, json.dumps(filename, ensure_ascii=False), receipt))
+
+
+WRITERS = dict((writer.format, writer) for writer in (TextWriter, CsvWriter, JsonLinesWriter))
+
+_REJECT_COLUMNS = (u"file", u"line", u"offset", u"reason", u"text")
+
+
+class RejectWriter(ReceiptWriter):
+
+    """CSV rows of the lines bulk mode could not read: their file, line
+    number, byte offset, the reason and the line itself
+    """
+
+    def __init__(self, out):
+        super(RejectWriter, self).__init__(out)
+        self.rejects = 0
+        self.write(_csv_row(_REJECT_COLUMNS))
+
+    def reject(self, filename, line, reject):
+        self.rejects += 1
+        self.write(_csv_row([filename, line, reject.offset, reject.reason, reject.line]))
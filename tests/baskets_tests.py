@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+from decimal import Decimal
+from docs.baskets import *
+from docs.pricing import CENTS_ENGINE, Cart, decode_filename, load_rules, read_carts
+from tests import tax_calc_tests
+
+
+class TestBaskets(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "priced.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        self.assertEqual(write_files(["docs/input.txt", "docs/inpututf8.txt"], self.filename), 6)
+        carts = [Cart(cart) for filename in ["docs/input.txt", "docs/inpututf8.txt"]
+                 for cart in read_carts(filename)]
+        with BasketFile(self.filename) as baskets:
+            self.assertEqual(len(baskets), 6)
+            self.assertEqual([cart.receipt for cart in baskets], [cart.receipt for cart in carts])
+            self.assertEqual(baskets.receipt(0), tax_calc_tests.TestCart.expectation1)
+            self.assertEqual([cart.total for cart in baskets[1:6:2]],
+                             [carts[1].total, carts[3].total, carts[5].total])
+            self.assertEqual(baskets[-1].source, u"docs/inpututf8.txt")
+            self.assertEqual(baskets[2].items[0],
+                             PricedItem(u"1", u"imported bottle of perfume", Decimal("27.99"),
+                                        True, False, Decimal("4.20"), Decimal("32.19")))
+            self.assertRaises(IndexError, baskets.cart, 6)
+
+    def test_non_ascii_source(self):
+        source = os.path.join(self.directory, "caf\xc3\xa9.txt")
+        shutil.copy("docs/input.txt", source)
+        self.assertEqual(write_files([source], self.filename), 3)
+        with BasketFile(self.filename) as baskets:
+            self.assertEqual(baskets[0].source, decode_filename(source))
+            self.assertTrue(baskets[0].source.endswith(u"caf\xe9.txt"))
+
+    def test_layout(self):
+        with BasketWriter(self.filename) as writer:
+            writer.add_cart(Cart(u"2 book at 1.5\n0.5 imported perfume at 10.00"), u"a")
+        with open(self.filename, "rb") as file_in:
+            data = file_in.read()
+        header = HEADER.unpack_from(data, 0)
+        self.assertEqual(header[:6], ("TAXB", 2, 48, 2, 1, 6))
+        self.assertEqual(header[6:], (64, 160, 200, 256))
+        self.assertEqual(RECORD.unpack_from(data, 64), (2, 15, 0, 300, 0, 1, 0, 1, 2))
+        self.assertEqual(RECORD.unpack_from(data, 112), (5, 1000, 75, 575, 2, 3, 1, 2, 1))
+        self.assertEqual(CART.unpack_from(data, 160), (0, 2, 4, 5, 75, 875))
+        self.assertEqual(data[256:], "book2imported perfume0.5adefault")
+        self.assertEqual(len(data), 288)
+
+    def test_failed_write(self):
+        bad = os.path.join(self.directory, "bad.txt")
+        with open(bad, "w") as file_out:
+            file_out.write("1 book at 12.49\n\n1 book for 12.49\n")
+        self.assertRaises(ValueError, write_files, ["docs/input.txt", bad], self.filename)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_compact_and_priced_carts(self):
+        cart = Cart(u"3 box of imported chocolates at 11.25\n1 music CD at 14.99",
+                    engine=CENTS_ENGINE, compact=True)
+        with BasketWriter(self.filename) as writer:
+            writer.add_cart(cart)
+        with BasketFile(self.filename) as baskets:
+            priced = baskets[0]
+        self.assertEqual(priced.receipt, cart.receipt)
+        copy = os.path.join(self.directory, "copy.bin")
+        with BasketWriter(copy) as writer:
+            writer.add_cart(priced, u"again")
+        with BasketFile(copy) as baskets:
+            self.assertEqual(baskets[0], priced._replace(source=u"again"))
+        self.assertEqual(priced.to_cart().receipt, cart.receipt)
+
+    def test_empty(self):
+        BasketWriter(self.filename).close()
+        with BasketFile(self.filename) as baskets:
+            self.assertEqual(len(baskets), 0)
+            self.assertEqual(list(baskets), [])
+
+    def test_refused(self):
+        writer = BasketWriter(self.filename)
+        writer.add_cart(Cart(u"1 book at 1.00"))
+        writer.file.flush()
+        self.assertRaises(ValueError, BasketFile, self.filename)
+        writer.close()
+        with open(self.filename, "r+b") as file_out:
+            file_out.seek(4)
+            file_out.write(struct.pack("<H", 1))
+        self.assertRaisesRegexp(ValueError, "version 1", BasketFile, self.filename)
+        self.assertRaises(ValueError, BasketFile, "docs/input.txt")
+
+    def test_too_large(self):
+        with BasketWriter(self.filename) as writer:
+            self.assertRaisesRegexp(ValueError, "too large", writer.add_cart,
+                                    Cart(u"1 book at 100000000000000000"))
+            self.assertEqual(writer.cart_count, 0)
+
+    def test_main(self):
+        self.assertEqual(main(["--output", self.filename, "docs/input.txt"]), 0)
+        with BasketFile(self.filename) as baskets:
+            self.assertEqual(len(baskets), 3)
+
+    def test_jurisdictions(self):
+        mixed = os.path.join(self.directory, "mixed.txt")
+        with open(mixed, "wb") as file_out:
+            file_out.write(u"1 music CD at 10.00\n\nJurisdiction: north\n1 music CD at 10.00\n"
+                           .encode("utf-8"))
+        self.assertRaises(ValueError, main, ["--output", self.filename, mixed])
+        self.assertFalse(os.path.exists(self.filename))
+        self.assertEqual(main(["--rules", "docs/rules.txt", "--output", self.filename, mixed]), 0)
+        rules = load_rules("docs/rules.txt")
+        with BasketFile(self.filename) as baskets:
+            self.assertEqual([cart.jurisdiction for cart in baskets], [u"default", u"north"])
+            self.assertEqual([cart.to_cart(rules=rules).total for cart in baskets],
+                             [Decimal("11.00"), Decimal("12.00")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from docs.pricing import Cart, from_cents, read_carts, to_cents
+from docs.baskets import BasketFile, write_files
+
+try:
+    import numpy
+    from docs.batch import *
+    from docs.batch import _scale
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, "NumPy is not installed")
+class TestBatch(unittest.TestCase):
+    names = [u"book", u"music CD", u"imported bottle of perfume", u"box of imported chocolates",
+             u"packet of headache pills", u"bottle of perfume", u"chocolate bär"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def random_file(self, seed, carts):
+        rng = random.Random(seed)
+        filename = os.path.join(self.directory, "input%s.txt" % seed)
+        with open(filename, "w") as file_out:
+            for i in range(carts):
+                file_out.write("Input %s:\n" % (i + 1))
+                for _ in range(rng.randint(1, 8)):
+                    quantity = rng.choice(["1", "2", "3", "1.5", "0.25", "12"])
+                    price = "%s.%02d" % (rng.randint(0, 500), rng.randint(0, 99))
+                    name = rng.choice(self.names)
+                    file_out.write((u"%s %s at %s\n" % (quantity, name, price)).encode("utf-8"))
+                file_out.write("\n")
+        return filename
+
+    def assert_matches_carts(self, filenames):
+        priced = price_files(filenames)
+        carts = [Cart(cart) for filename in filenames for cart in read_carts(filename)]
+        self.assertEqual(len(priced.cart_total), len(carts))
+        for cart, total, sales_tax in zip(carts, priced.cart_total, priced.cart_tax):
+            self.assertEqual(cart.calculate_total(),
+                             (from_cents(int(total)), from_cents(int(sales_tax))))
+
+    def test_price_files_examples(self):
+        self.assert_matches_carts(["docs/input.txt", "docs/inpututf8.txt"])
+
+    def test_price_files_random(self):
+        self.assert_matches_carts([self.random_file(1, 300), self.random_file(2, 300)])
+
+    def test_basket_columns(self):
+        filenames = [self.random_file(3, 200), "docs/input.txt"]
+        output = os.path.join(self.directory, "priced.bin")
+        write_files(filenames, output)
+        columns = basket_columns(output)
+        expected = read_columns(filenames)
+        for name in ("quantity", "unit_price", "imported", "exempt", "cart_offsets"):
+            self.assertEqual(getattr(columns, name).tolist(), getattr(expected, name).tolist())
+        self.assertEqual(columns[5:], expected[5:])
+        priced = price_columns(*columns)
+        with BasketFile(output) as baskets:
+            self.assertEqual([from_cents(int(total)) for total in priced.cart_total],
+                             [cart.total for cart in baskets])
+
+    def test_price_columns(self):
+        priced = price_columns([1, 1, 1, 1], [2799, 1899, 975, 1125],
+                               [True, False, False, True], [False, False, True, True])
+        self.assertEqual(priced.tax.tolist(), [420, 190, 0, 60])
+        self.assertEqual(priced.line_total.tolist(), [3219, 2089, 975, 1185])
+        self.assertEqual(priced.cart_tax.tolist(), [670])
+        self.assertEqual(priced.cart_total.tolist(), [7468])
+
+    def test_price_columns_empty_carts(self):
+        priced = price_columns([1, 1], [1249, 1499], [False, False], [True, False],
+                               cart_offsets=[0, 0, 1, 2])
+        self.assertEqual(priced.cart_total.tolist(), [0, 1249, 1649, 0])
+
+    def test_price_columns_fractional_quantity(self):
+        priced = price_columns([15], [1249], [False], [True], quantity_exponent=1)
+        self.assertEqual(priced.line_total.tolist(), [1874])
+
+    def test_price_columns_negative(self):
+        with self.assertRaisesRegexp(ValueError, "Price of items cannot be negative"):
+            price_columns([1], [-1], [False], [False])
+
+    def test_price_columns_overflow(self):
+        with self.assertRaisesRegexp(OverflowError, "Values are too large to be priced as int64 columns"):
+            price_columns([2 ** 40], [2 ** 20], [False], [False])
+        # fits in an int64 until scaled to cents and taxed
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            price_columns([10 ** 14], [900], [True], [False], price_exponent=0)
+        # each line fits, but not their sum
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            price_columns([10 ** 12] * 1000, [900] * 1000, [False] * 1000, [True] * 1000,
+                          price_exponent=0)
+        priced = price_columns([10 ** 12], [900], [True], [False], price_exponent=0)
+        self.assertEqual(priced.line_total.tolist(),
+                         [to_cents(Cart(u"%s imported perfume at 900" % 10 ** 12).total)])
+
+    def test_price_columns_extreme_exponents(self):
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            price_columns([1], [9], [False], [False], price_exponent=-999999999)
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            price_columns([1], [1], [False], [False], price_exponent=999999999)
+        self.assertEqual(_scale([(0, -999999999), (125, 2)]), ([0, 125], 2))
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            _scale([(9, -999999999), (125, 2)])
+
+    def test_basket_columns_mixed_exponents(self):
+        filename = os.path.join(self.directory, "mixed.txt")
+        output = os.path.join(self.directory, "mixed.bin")
+        with open(filename, "w") as file_out:
+            file_out.write("1 a at 2000000000000000\n1 b at 0.0001\n")
+        write_files([filename], output)
+        with self.assertRaisesRegexp(OverflowError, "too large"):
+            basket_columns(output)
+        with open(filename, "w") as file_out:
+            file_out.write("1 a at 2000\n1 b at 0.0001\n0 c at 0.00000\n")
+        write_files([filename], output)
+        columns = basket_columns(output)
+        self.assertEqual((columns.unit_price.tolist(), columns.price_exponent),
+                         ([20000000, 1, 0], 4))
+
+    def test_rate_table(self):
+        rates, exponent = rate_table()
+        self.assertEqual((rates.tolist(), exponent), ([10, 0, 15, 5], 2))
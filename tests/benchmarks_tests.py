@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import tempfile
+import unittest
+from benchmarks.generator import *
+from benchmarks.load import parse_address, percentile, run_load
+from benchmarks.run import compare, run_end_to_end, run_micro
+from benchmarks.startup import run_per_process, run_sustained, time_startup
+from docs.server import ReceiptService
+from docs.pricing import Cart, read_carts
+
+
+class TestGenerator(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_size(self):
+        self.assertEqual(parse_size("1MB"), 1024 ** 2)
+        self.assertEqual(parse_size("1.5kb"), 1536)
+        self.assertEqual(parse_size("100"), 100)
+
+    def test_seeded(self):
+        self.assertEqual(BasketGenerator(4).cart(), BasketGenerator(4).cart())
+        self.assertNotEqual([BasketGenerator(4).line() for _ in range(5)],
+                            [BasketGenerator(5).line() for _ in range(5)])
+
+    def test_ratios(self):
+        generator = BasketGenerator(1, imported_ratio=1, exempt_ratio=0, name_length=(30, 30))
+        for _ in range(50):
+            name = generator.name()
+            self.assertTrue(u"imported" in name)
+            self.assertTrue(len(name) >= 30)
+        generator = BasketGenerator(1, imported_ratio=0, exempt_ratio=0)
+        for _ in range(50):
+            self.assertEqual(Cart(generator.line()).items[0].get_tax_rate() * 10, 1)
+
+    def test_write_input_file(self):
+        filename = os.path.join(self.directory, "input.txt")
+        carts, lines, _ = write_input_file(filename, carts=20, seed=3, lines_per_cart=(2, 4))
+        parsed = list(read_carts(filename))
+        self.assertEqual((carts, lines), (20, sum(cart.count(u"\n") for cart in parsed)))
+        self.assertEqual(len(parsed), 20)
+
+    def test_write_input_file_size(self):
+        filename = os.path.join(self.directory, "input.txt")
+        _, _, written = write_input_file(filename, size=10000)
+        self.assertTrue(10000 <= written < 11000)
+
+
+class TestRun(unittest.TestCase):
+
+    def test_run_micro(self):
+        results = run_micro(seed=0, repeat=1, lines=100)
+        self.assertEqual(sorted(results), ["micro.classify", "micro.parse", "micro.render",
+                                           "micro.tax_cents", "micro.tax_decimal"])
+        self.assertTrue(all(result["lines"] == 100 for result in results.values()))
+
+    def test_run_end_to_end(self):
+        directory = tempfile.mkdtemp()
+        try:
+            result = run_end_to_end("4KB", 0, directory)
+            self.assertTrue(result["lines"] > 0 and result["peak_rss_kb"] > 0)
+            self.assertTrue(os.path.exists(os.path.join(directory, "input-4KB-0.txt")))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_run_end_to_end_child_dies(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # an option parse_files does not take makes the child raise
+            with self.assertRaisesRegexp(RuntimeError, "exited with code 1"):
+                run_end_to_end("4KB", 0, directory, unknown=True)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_compare(self):
+        report, regressed = compare({"a": {"lines_per_sec": 80.0}, "b": {"lines_per_sec": 120.0}},
+                                    {"a": {"lines_per_sec": 100.0}, "b": {"lines_per_sec": 100.0},
+                                     "c": {"lines_per_sec": 1.0}}, 0.1)
+        self.assertTrue(regressed)
+        self.assertEqual(len(report), 2)
+        self.assertTrue(report[0].endswith("REGRESSION"))
+
+    def test_compare_peak_rss(self):
+        baseline = {"a": {"lines_per_sec": 100.0, "peak_rss_kb": 1000}}
+        report, regressed = compare({"a": {"lines_per_sec": 100.0, "peak_rss_kb": 1100}},
+                                    baseline, 0.1, 0.2)
+        self.assertFalse(regressed)
+        self.assertEqual(len(report), 2)
+        report, regressed = compare({"a": {"lines_per_sec": 100.0, "peak_rss_kb": 1300}},
+                                    baseline, 0.1, 0.2)
+        self.assertTrue(regressed)
+        self.assertFalse(report[0].endswith("REGRESSION"))
+        self.assertTrue(report[1].endswith("REGRESSION"))
+
+
+class TestLoad(unittest.TestCase):
+
+    def test_run_load(self):
+        service = ReceiptService(("127.0.0.1", 0)).start()
+        try:
+            result = run_load(service.address, connections=4, requests=40)
+        finally:
+            service.stop()
+        self.assertEqual((result["requests"], result["errors"]), (40, 0))
+        self.assertTrue(0 < result["p50_ms"] <= result["p99_ms"] <= result["max_ms"])
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual([percentile(values, fraction) for fraction in (0.5, 0.99, 1.0)],
+                         [51, 100, 100])
+        self.assertEqual(percentile([], 0.5), None)
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("localhost:8000"), ("localhost", 8000))
+        self.assertEqual(parse_address("/tmp/server.sock"), "/tmp/server.sock")
+
+
+class TestStartup(unittest.TestCase):
+
+    def test_startup(self):
+        result = time_startup(repeat=1)
+        self.assertTrue(0 < result["interpreter_ms"] < result["startup_ms"])
+        self.assertTrue(result["first_receipt_ms"] > 0)
+
+    def test_sustained(self):
+        result = run_sustained(carts=50, args=["--engine", "cents"])
+        self.assertEqual(result["carts"], 50)
+        self.assertTrue(result["lines_per_sec"] > 0)
+        self.assertEqual(run_per_process(carts=2)["carts"], 2)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from decimal import Decimal
+from docs.cache import *
+from docs.stats import Stats, instrument
+from docs.pricing import CENTS_ENGINE, DECIMAL_ENGINE, RULES, CentsEngine, KeywordIndex, \
+    load_rules, main, parse_files, render_file, worker_pool
+from tests import tax_calc_tests
+
+
+class TestReceiptCache(unittest.TestCase):
+
+    def setUp(self):
+        import docs.cache as module
+        self.module = module
+        self.checkpoint_ranges = module._CHECKPOINT_RANGES
+        module._CHECKPOINT_RANGES = 2
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "input.txt")
+        with open(self.filename, "w") as file_out:
+            file_out.write("".join("Input %s:\n%s book at %s.00\n1 music CD at 14.99\n\n" % (i, i, i)
+                                   for i in range(1, 8)))
+        self.cache = ReceiptCache(os.path.join(self.directory, "receipts.db"))
+        self.expected = list(render_file(self.filename))
+
+    def tearDown(self):
+        self.module._CHECKPOINT_RANGES = self.checkpoint_ranges
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def test_non_ascii_file_name(self):
+        filename = os.path.join(self.directory, "caf\xc3\xa9.txt")
+        shutil.copy(self.filename, filename)
+        self.assertEqual(list(render_file(filename, cache=self.cache)), self.expected)
+        self.assertEqual(list(render_file(filename, cache=self.cache, resume=True)),
+                         self.expected)
+
+    def test_cached(self):
+        self.assertEqual(list(render_file(self.filename, cache=self.cache)), self.expected)
+        with instrument(Stats()) as stats:
+            self.assertEqual(list(render_file(self.filename, cache=self.cache)), self.expected)
+        self.assertEqual(stats.calls["tokenize"], 0)
+
+    def test_resume(self):
+        receipts = render_file(self.filename, cache=self.cache)
+        self.assertEqual([next(receipts) for _ in range(3)], self.expected[:3])
+        receipts.close()
+        with instrument(Stats()) as stats:
+            self.assertEqual(list(render_file(self.filename, cache=self.cache, resume=True)),
+                             self.expected)
+        self.assertEqual(stats.calls["tokenize"], 6)
+
+    def test_resume_changed_file(self):
+        list(render_file(self.filename, cache=self.cache))
+        with open(self.filename, "a") as file_out:
+            file_out.write("1 imported bottle of perfume at 27.99\n")
+        os.utime(self.filename, (0, 0))
+        receipts = list(render_file(self.filename, cache=self.cache, resume=True))
+        self.assertEqual(receipts[:-1], self.expected)
+        self.assertEqual(receipts[-1], u"1 imported bottle of perfume: 32.19\n"
+                                       u"Sales Taxes: 4.20\nTotal: 32.19\n")
+
+    def test_workers(self):
+        with worker_pool(2) as pool:
+            self.assertEqual(list(render_file(self.filename, pool, cache=self.cache)), self.expected)
+
+    def test_parse_files(self):
+        self.assertEqual(parse_files(["docs/input.txt"], cache=self.cache, resume=True),
+                         tax_calc_tests.TestModuleFunctions.expectation)
+
+    def test_cart_key(self):
+        version = rules_version()
+        self.assertEqual(cart_key(u"1 book at 1.00\n\n2 pen at 2.00\n", version),
+                         cart_key(u"  1 book at 1.00\n2 pen at 2.00", version))
+        self.assertNotEqual(cart_key(u"1 book at 1.00", version),
+                            cart_key(u"1 book at 1.00", rules_version(CentsEngine(Decimal("0.10")))))
+
+    def test_rules_version(self):
+        self.assertEqual(rules_version(CENTS_ENGINE), rules_version(DECIMAL_ENGINE))
+        self.assertNotEqual(rules_version(), rules_version(
+            classifier=KeywordIndex({"imported": [u"imported"], "exempt": [u"book"]})))
+
+    def test_jurisdictions(self):
+        rules = load_rules("docs/rules.txt")
+        self.assertNotEqual(rules_version(rules=rules), rules_version())
+        self.assertEqual(rules_version(rules=RULES), rules_version())
+
+    def test_resume_requires_cache(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            with self.assertRaises(SystemExit):
+                main(["--resume", "docs/input.txt"])
+        finally:
+            sys.stderr = stderr
+
+if __name__ == "__main__":
+    unittest.main()
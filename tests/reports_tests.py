@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from docs.reports import *
+from docs.pricing import CENTS_ENGINE, Cart, read_carts, worker_pool
+
+
+class TestTaxSummary(unittest.TestCase):
+
+    def test_split(self):
+        summary = summarize_carts([Cart(u"1 imported bottle of perfume at 27.99\n"
+                                        u"1 box of imported chocolates at 11.25\n"
+                                        u"1 music CD at 14.99")])
+        self.assertEqual(summary.report(), {
+            "carts": 1, "items": 3, "sales_tax": u"6.30", "basic_tax": u"4.30",
+            "import_duty": u"2.00", "exempt_revenue": u"11.25", "taxable_revenue": u"42.98",
+            "total": u"60.53"})
+
+    def test_merge(self):
+        carts = [Cart(cart) for cart in read_carts("docs/input.txt")]
+        whole = summarize_carts(carts)
+        merged = summarize_carts(carts[2:]).merge(summarize_carts(carts[:2]))
+        self.assertEqual(merged, whole)
+        self.assertEqual(whole.sales_tax, sum(int(cart.sales_tax * 100) for cart in carts))
+        self.assertEqual(whole.total, sum(int(cart.total * 100) for cart in carts))
+        self.assertEqual(whole.basic_tax + whole.import_duty, whole.sales_tax)
+        self.assertNotEqual(merged.merge(TaxSummary()).merge(whole), whole)
+
+    def test_compact(self):
+        text = u"2 imported book at 3.33\n0.5 bottle of perfume at 9.99"
+        self.assertEqual(summarize_carts([Cart(text, engine=CENTS_ENGINE, compact=True)]),
+                         summarize_carts([Cart(text)]))
+
+
+class TestReport(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_files(self):
+        report = summarize_files(["docs/input.txt", "docs/inpututf8.txt"])
+        self.assertEqual(report.files.keys(), ["docs/input.txt", "docs/inpututf8.txt"])
+        self.assertEqual(report.files["docs/input.txt"], report.files["docs/inpututf8.txt"])
+        self.assertEqual(report.overall.carts, 6)
+        self.assertEqual(report.overall.report()["sales_tax"], u"31.70")
+        single = Report()
+        for filename in ["docs/input.txt", "docs/inpututf8.txt"]:
+            for cart in read_carts(filename):
+                single.add_cart(Cart(cart), filename)
+        self.assertEqual(single.report(), report.report())
+        self.assertEqual(Report().merge(report).merge(report).overall.carts, 12)
+
+    def test_workers(self):
+        filename = os.path.join(self.directory, "input.txt")
+        with open("docs/input.txt") as file_in:
+            text = file_in.read()
+        with open(filename, "w") as file_out:
+            file_out.write(text * 200)
+        self.assertEqual(summarize_files([filename], workers=2, engine=CENTS_ENGINE).report(),
+                         summarize_files([filename]).report())
+
+    def test_workers_rewritten(self):
+        filename = os.path.join(self.directory, "input.txt")
+        with worker_pool(2) as pool:
+            for carts in (1, 4):
+                with open(filename, "w") as file_out:
+                    file_out.write("1 music CD at 14.99\n\n" * carts)
+                self.assertEqual(summarize_file(filename, pool, chunksize=1),
+                                 summarize_file(filename))
+                self.assertEqual(summarize_file(filename, pool).carts, carts)
+
+    def test_main(self):
+        output = os.path.join(self.directory, "report.json")
+        self.assertEqual(main(["--output", output, "docs/input.txt"]), 0)
+        with open(output) as file_in:
+            report = json.load(file_in)
+        self.assertEqual(report["overall"], report["files"]["docs/input.txt"])
+        self.assertEqual(report["overall"]["total"], u"169.66")
+
+    def test_main_rules(self):
+        filename = os.path.join(self.directory, "mixed.txt")
+        with open(filename, "wb") as file_out:
+            file_out.write(u"Jurisdiction: north\n1 music CD at 10.00\n".encode("utf-8"))
+        output = os.path.join(self.directory, "report.json")
+        self.assertRaises(ValueError, main, ["--output", output, filename])
+        self.assertEqual(main(["--rules", "docs/rules.txt", "--output", output, filename]), 0)
+        with open(output) as file_in:
+            self.assertEqual(json.load(file_in)["overall"]["total"], u"12.00")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+from docs.server import *
+from docs.pricing import CENTS_ENGINE
+from tests import tax_calc_tests
+
+
+def connect(address):
+    family = socket.AF_UNIX if isinstance(address, basestring) else socket.AF_INET
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    connection.connect(address)
+    return connection, connection.makefile("rb")
+
+
+class TestReceiptService(unittest.TestCase):
+
+    def setUp(self):
+        self.service = ReceiptService(("127.0.0.1", 0)).start()
+
+    def tearDown(self):
+        self.service.stop()
+
+    def request(self, message, connection=None):
+        connection, responses = connection or connect(self.service.address)
+        connection.sendall(json.dumps(message) + "\n")
+        return json.loads(responses.readline())
+
+    def test_json(self):
+        self.assertEqual(self.request({"id": 7, "cart": u"1 book at 12.49\n1 music CD at 14.99"}),
+                         {"id": 7, "receipt": u"1 book: 12.49\n1 music CD: 16.49\n"
+                          u"Sales Taxes: 1.50\nTotal: 28.98\n",
+                          "sales_tax": u"1.50", "total": u"28.98"})
+
+    def test_json_errors(self):
+        self.assertEqual(self.request({"cart": u"1 book for 12.49"}),
+                         {"error": u"Input is not well-formed. Items should take the form of a single "
+                          u"line containing a quantity, name of the item, the word 'at' then the "
+                          u"price (column 2)"})
+        self.assertEqual(self.request({"id": 1, "cart": 5}),
+                         {"id": 1, "error": u"Bad request: cart must be a string"})
+        connection, responses = connect(self.service.address)
+        connection.sendall("{cart\n")
+        self.assertTrue(json.loads(responses.readline())["error"].startswith(u"Bad request: Expecting"))
+
+    def test_text(self):
+        connection, responses = connect(self.service.address)
+        with open("docs/input.txt", "rb") as file_in:
+            connection.sendall(file_in.read() + "\n")
+        connection.shutdown(socket.SHUT_WR)
+        self.assertEqual(responses.read().decode("utf-8"),
+                         u"\n".join([tax_calc_tests.TestCart.expectation1,
+                                     tax_calc_tests.TestCart.expectation2,
+                                     tax_calc_tests.TestCart.expectation3, u""]))
+
+    def test_text_error(self):
+        connection, responses = connect(self.service.address)
+        connection.sendall("1 book at -1\n\n1 b\xc3\xa4r at 1.00\n\n")
+        self.assertEqual(responses.readline(), "Error: Price of items cannot be negative (column 10)\n")
+        self.assertEqual(responses.readline(), "\n")
+        self.assertEqual(responses.readline().decode("utf-8"), u"1 b\xe4r: 1.10\n")
+
+    def test_concurrent_connections(self):
+        results = {}
+
+        def client(i):
+            connection = connect(self.service.address)
+            results[i] = [self.request({"cart": u"%s book at %s.00" % (i, j)}, connection)["total"]
+                          for j in range(1, 11)]
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((i, [u"%s.00" % (i * j) for j in range(1, 11)])
+                                       for i in range(1, 9)))
+
+
+class TestPooledService(unittest.TestCase):
+
+    def test_pool(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "server.sock")
+        service = ReceiptService(path, workers=2, pool_lines=1, engine=CENTS_ENGINE).start()
+        try:
+            connection, responses = connect(path)
+            connection.sendall(json.dumps({"cart": u"1 imported bottle of perfume at 27.99"}) + "\n")
+            self.assertEqual(json.loads(responses.readline())["total"], u"32.19")
+            self.assertEqual(service.batcher.batches, 1)
+        finally:
+            service.stop()
+            shutil.rmtree(directory)
+        self.assertFalse(os.path.exists(path))
+
+
+class TestBatcher(unittest.TestCase):
+
+    def test_batches(self):
+        batcher = Batcher(batch_size=3)
+        requests = [batcher.submit(u"%s book at 1.00" % i) for i in range(1, 8)]
+        batcher.start()
+        self.assertEqual([request.wait()["total"] for request in requests],
+                         [u"%s.00" % i for i in range(1, 8)])
+        batcher.stop()
+        self.assertEqual(batcher.batches, 3)
+
+    def test_stop_prices_queued(self):
+        batcher = Batcher()
+        request = batcher.submit(u"1 book at 1.00")
+        batcher.queue.put(None)
+        batcher.run()
+        self.assertEqual(request.wait()["total"], u"1.00")
+
+    def test_price_carts(self):
+        self.assertEqual(price_carts([u"1 book at 1.00", u"x"]),
+                         [{"receipt": u"1 book: 1.00\nSales Taxes: 0.00\nTotal: 1.00\n",
+                           "sales_tax": u"0.00", "total": u"1.00"},
+                          {"error": u"Input is not well-formed. Items should take the form of a "
+                           u"single line containing a quantity, name of the item, the word 'at' "
+                           u"then the price (column 1)"}])
+
+    def test_price_carts_overflow(self):
+        responses = price_carts([u"9E+999999999 x at 9E+999999999", u"1e20 book at 1e20",
+                                 u"1 book at 1.00"], compact=True)
+        self.assertEqual([sorted(response) for response in responses],
+                         [["error"], ["error"], ["receipt", "sales_tax", "total"]])
+
+    def test_failed_batch(self):
+        batcher = Batcher(batch_size=1)
+        batcher.start()
+        try:
+            price, batcher.price = batcher.price, None
+            self.assertIn("error", batcher.submit(u"1 book at 1.00").wait())
+            batcher.price = price
+            self.assertEqual(batcher.submit(u"1 book at 1.00").wait()["total"], u"1.00")
+        finally:
+            batcher.stop()
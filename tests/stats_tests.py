@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+from docs.cache import ReceiptCache
+from docs.stats import *
+from docs.pricing import Cart, Item, MalformedLineError, main, parse_files, render_file, \
+    stream_receipts
+from tests import tax_calc_tests
+
+
+class TestStats(unittest.TestCase):
+
+    def test_instrument_counts(self):
+        with instrument(Stats()) as stats:
+            parse_files(["docs/input.txt"])
+        self.assertEqual(stats.counters["lines"], 9)
+        self.assertEqual(stats.counters["carts"], 3)
+        self.assertEqual(stats.counters["bytes"], os.path.getsize("docs/input.txt"))
+        self.assertEqual(stats.counters["tax_hits"] + stats.counters["tax_misses"], 9)
+        self.assertEqual(stats.calls["render"], 3)
+        self.assertEqual(stats.calls["classify"], 9)
+
+    def test_instrument_workers(self):
+        with instrument(Stats()) as stats:
+            parse_files(["docs/input.txt", "docs/inpututf8.txt"], workers=2)
+        self.assertEqual((stats.counters["lines"], stats.counters["carts"]), (18, 6))
+        self.assertEqual(stats.calls["tax"], 18)
+
+    def test_instrument_restores(self):
+        import docs.pricing as module
+        functions = (module.tokenize_line, module.classify, module.read_carts,
+                     Item.__dict__["get_amounts"], module.render_receipt)
+        with instrument(Stats()):
+            self.assertNotEqual(module.tokenize_line, functions[0])
+            self.assertTrue(module.STATS)
+        self.assertEqual((module.tokenize_line, module.classify, module.read_carts,
+                          Item.__dict__["get_amounts"], module.render_receipt), functions)
+        self.assertEqual(module.STATS, None)
+
+    def test_errors(self):
+        with instrument(Stats()) as stats:
+            with self.assertRaises(MalformedLineError):
+                Cart(u"1 book at 12.49\n1 book for 12.49")
+        self.assertEqual((stats.counters["lines"], stats.counters["errors"]), (2, 1))
+
+    def test_instrument_other_paths(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "bad.txt")
+            with open(filename, "wb") as file_out:
+                file_out.write(tax_calc_tests.TestBulkMode.text)
+            size = os.path.getsize("docs/input.txt")
+            cache = ReceiptCache(os.path.join(directory, "cache.db"))
+            for run, counters in [
+                    (lambda: list(render_file(filename, errors="skip-line")),
+                     (3, len(tax_calc_tests.TestBulkMode.text), 6, 4)),
+                    (lambda: list(render_file("docs/input.txt", cache=cache)), (3, size, 9, 0)),
+                    (lambda: stream_receipts(open("docs/input.txt", "rb"), StringIO()),
+                     (3, size, 9, 0))]:
+                with instrument(Stats()) as stats:
+                    run()
+                self.assertEqual(tuple(stats.counters[counter] for counter in
+                                       ("carts", "bytes", "lines", "errors")), counters)
+            cache.close()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_hooks(self):
+        calls = []
+        stats = Stats()
+        stats.add_hook(lambda stage, seconds: calls.append(stage))
+        import docs.pricing as module
+        with instrument(stats):
+            module.render_receipt(Cart(u"1 book at 12.49"))
+        self.assertEqual(calls, ["tokenize", "classify", "tax", "render"])
+
+    def test_drain_merge(self):
+        stats = Stats()
+        stats.record("tax", 0.5)
+        stats.count("lines", 3)
+        other = Stats()
+        other.merge(stats.drain())
+        other.merge({"seconds": dict.fromkeys(Stats.STAGES, 0.25),
+                     "calls": dict.fromkeys(Stats.STAGES, 1), "counters": {"lines": 1}})
+        self.assertEqual((other.seconds["tax"], other.calls["tax"]), (0.75, 2))
+        self.assertEqual(other.counters["lines"], 4)
+        self.assertEqual((stats.calls["tax"], stats.counters["lines"]), (0, 0))
+
+    def test_report(self):
+        stats = Stats()
+        stats.record("tokenize", 2.0)
+        stats.count("lines", 10)
+        stats.elapsed = 4.0
+        report = stats.report()
+        self.assertEqual(report["stages"]["tokenize"],
+                         {"seconds": 2.0, "calls": 1, "calls_per_sec": 0.5})
+        self.assertEqual(report["stages"]["render"]["calls_per_sec"], None)
+        self.assertEqual(report["throughput"]["lines_per_sec"], 2.5)
+
+    def test_main_stats_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "stats.json")
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                main(["--stats", "--stats-file", filename, "docs/input.txt"])
+            finally:
+                sys.stdout = stdout
+            with open(filename) as file_in:
+                report = json.load(file_in)
+            self.assertEqual(report["counters"]["carts"], 3)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_main_stats_before_files(self):
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            main(["--stats", "docs/input.txt", "docs/inpututf8.txt"])
+            output, report = sys.stdout.getvalue(), json.loads(sys.stderr.getvalue())
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        self.assertEqual(output.count(u"Receipts from"), 2)
+        self.assertEqual(report["counters"]["carts"], 6)
+        with open("docs/input.txt") as file_in:
+            self.assertTrue(file_in.read().startswith("Input 1:"))
+
+if __name__ == "__main__":
+    unittest.main()
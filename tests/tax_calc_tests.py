@@ -1,8 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import codecs
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
 import unittest
-from decimal import Decimal
-from docs.tax_calc import *
+from StringIO import StringIO
+from decimal import Decimal, InvalidOperation
+from docs.pricing import *
 
 
 class TestItem(unittest.TestCase):
@@ -313,3 +321,841 @@ class TestModuleFunctions(unittest.TestCase):
     def test_apply_rounding_size_limits(self):
         self.assertEqual(apply_rounding(Decimal('9999999999999999999999999.01')), Decimal(
             '9999999999999999999999999.05'))
+
+
+class TestStreaming(unittest.TestCase):
+    lines = [u"Input 1:\n", u"1 book at 12.49\n", u"\n", u"\n", u"Input 2:\n",
+             u"1 imported bottle of perfume at 27.99\n", u"1 music CD at 14.99\n"]
+
+    def test_iter_carts(self):
+        self.assertEqual(list(iter_carts(self.lines)), [
+                         u"1 book at 12.49\n", u"1 imported bottle of perfume at 27.99\n1 music CD at 14.99\n"])
+
+    def test_iter_carts_empty(self):
+        self.assertEqual(list(iter_carts([u"\n", u"Input 1:\n"])), [])
+
+    def test_no_empty_receipt_at_end(self):
+        # the first parse_files printed an extra "Output N:" of no items, with
+        # totals of 0, after the last cart when a delimiter followed it
+        self.assertEqual(list(iter_carts([u"1 book at 12.49\n", u"\n"])), [u"1 book at 12.49\n"])
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "carts.txt")
+            for ending in ("\n\n", "\n\n\n", "\nInput 2:\n"):
+                with open(filename, "w") as file_out:
+                    file_out.write("Input 1:\n1 book at 12.49" + ending)
+                self.assertEqual(parse_files([filename]), u"Output 1:\n1 book: 12.49\n"
+                                                          u"Sales Taxes: 0.00\nTotal: 12.49\n")
+        finally:
+            shutil.rmtree(directory)
+
+    def test_iter_receipts(self):
+        receipts = [unicode(cart)
+                    for cart in iter_receipts(["docs/input.txt"])]
+        self.assertEqual(receipts, [TestCart.expectation1,
+                                    TestCart.expectation2, TestCart.expectation3])
+
+    def test_iter_receipts_is_lazy(self):
+        receipts = iter_receipts(["docs/input.txt", "docs/inpucxt.txt"])
+        self.assertEqual(unicode(next(receipts)), TestCart.expectation1)
+
+    def test_write_receipts(self):
+        out = StringIO()
+        write_receipts(["docs/input.txt"], out)
+        self.assertEqual(out.getvalue(), u"Receipts from docs/input.txt\n" +
+                         TestModuleFunctions.expectation)
+
+
+class TestParallel(unittest.TestCase):
+
+    def test_parse_workers(self):
+        self.assertEqual(parse_files(["docs/input.txt"], workers=2),
+                         TestModuleFunctions.expectation)
+
+    def test_parse_multiple_files_workers(self):
+        self.assertEqual(parse_files(["docs/input.txt", "docs/inpututf8.txt"], workers=3),
+                         TestModuleFunctions.expectation + TestModuleFunctions.expectationutf8)
+
+    def test_render_carts_order(self):
+        carts = [u"%s book at %s.00\n" % (i, i) for i in range(1, 200)]
+        with worker_pool(4) as pool:
+            self.assertEqual(list(render_carts(carts, pool, chunksize=7)),
+                             list(render_carts(carts)))
+
+    def test_worker_pool_serial(self):
+        with worker_pool(1) as pool:
+            self.assertEqual(pool, None)
+
+    def test_write_receipts_workers(self):
+        out = StringIO()
+        write_receipts(["docs/inpututf8.txt"], out, workers=2)
+        self.assertEqual(out.getvalue(), u"Receipts from docs/inpututf8.txt\n" +
+                         TestModuleFunctions.expectationutf8)
+
+
+class TestCentsEngine(unittest.TestCase):
+    rates = [Decimal('0'), Decimal('0.05'), Decimal('0.1'), Decimal('0.15')]
+
+    def random_number(self, rng):
+        digits = rng.choice([0, 0, 1, 2, 2, 2, 3])
+        value = Decimal(rng.randint(0, 10 ** rng.randint(1, 8))).scaleb(-digits)
+        return Decimal(str(value))
+
+    def test_equivalence_random(self):
+        rng = random.Random(2016)
+        for _ in range(5000):
+            quantity = self.random_number(rng)
+            unit_price = self.random_number(rng)
+            rate = rng.choice(self.rates)
+            self.assertEqual(CENTS_ENGINE.amounts(quantity, unit_price, rate),
+                             DECIMAL_ENGINE.amounts(quantity, unit_price, rate))
+
+    def test_equivalence_rendering(self):
+        rng = random.Random(7)
+        for _ in range(2000):
+            quantity = self.random_number(rng)
+            unit_price = self.random_number(rng)
+            rate = rng.choice(self.rates)
+            self.assertEqual(map(str, CENTS_ENGINE.amounts(quantity, unit_price, rate)),
+                             map(str, DECIMAL_ENGINE.amounts(quantity, unit_price, rate)))
+
+    def test_equivalence_signed_zeros(self):
+        numbers = [Decimal(text) for text in ("0", "-0", "0.000", "-0.000", "-0E+2", "0.001",
+                                              "-0.001", "0.04", "-0.04", "1", "-1", "12.49")]
+        for quantity in numbers:
+            for unit_price in numbers:
+                for rate in self.rates + [Decimal("-0"), Decimal("-0.1")]:
+                    self.assertEqual(map(str, CENTS_ENGINE.amounts(quantity, unit_price, rate)),
+                                     map(str, DECIMAL_ENGINE.amounts(quantity, unit_price, rate)))
+
+    def test_signed_zero_receipt(self):
+        text = u"-0 book at 12.49\n-0 music CD at 14.99"
+        self.assertEqual(Cart(text, CENTS_ENGINE).receipt, Cart(text).receipt)
+        self.assertTrue(Cart(text).receipt.startswith(u"-0 book: -0.00\n"))
+
+    def test_exponent_notation(self):
+        self.assertEqual(CENTS_ENGINE.amounts(Decimal('1E+1'), Decimal('2.5E-1'), Decimal('0.1')),
+                         DECIMAL_ENGINE.amounts(Decimal('1E+1'), Decimal('2.5E-1'), Decimal('0.1')))
+
+    def test_extreme_exponents(self):
+        for quantity, unit_price in [("9E+999999999", "9E+999999999"), ("1E+20", "1E+20"),
+                                     ("1E-999999999", "1"), ("0E+999999999", "1")]:
+            quantity, unit_price = Decimal(quantity), Decimal(unit_price)
+            try:
+                expected = map(str, DECIMAL_ENGINE.amounts(quantity, unit_price, self.rates[0]))
+            except ArithmeticError:
+                self.assertRaises(InvalidOperation, CENTS_ENGINE.amounts,
+                                  quantity, unit_price, self.rates[0])
+            else:
+                self.assertEqual(map(str, CENTS_ENGINE.amounts(quantity, unit_price, self.rates[0])),
+                                 expected)
+
+    def test_to_fixed(self):
+        self.assertEqual(to_fixed(Decimal('12.49')), (1249, 2))
+        self.assertEqual(to_fixed("-2.5"), (-25, 1))
+        self.assertEqual(to_fixed(Decimal('1E+2')), (1, -2))
+
+    def test_to_fixed_infinite(self):
+        with self.assertRaisesRegexp(ValueError, "Quantities and prices must be finite numbers"):
+            to_fixed(Decimal('Infinity'))
+
+    def test_round_cents_half_even(self):
+        self.assertEqual(round_cents(125, 3), 12)
+        self.assertEqual(round_cents(135, 3), 14)
+        self.assertEqual(round_cents(-125, 3), -12)
+
+    def test_invalid_precision(self):
+        with self.assertRaisesRegexp(ValueError, "Rounding precision must be a whole number of cents"):
+            CentsEngine(Decimal('0.005'))
+
+    def test_cart_engine(self):
+        cart = Cart(TestCart.input3, CENTS_ENGINE)
+        self.assertEqual(cart.receipt, TestCart.expectation3)
+
+    def test_parse_engine(self):
+        self.assertEqual(parse_files(["docs/input.txt", "docs/inpututf8.txt"], engine=CENTS_ENGINE),
+                         TestModuleFunctions.expectation + TestModuleFunctions.expectationutf8)
+
+
+class TestKeywordIndex(unittest.TestCase):
+    catalog = {"a": [u"he", u"hers"], "b": [u"she", u"his"], "c": [u"Ärger"]}
+
+    def test_match_overlapping(self):
+        index = KeywordIndex(self.catalog)
+        self.assertEqual(index.categories(u"ushers"), set(["a", "b"]))
+        self.assertEqual(index.categories(u"hishe"), set(["a", "b"]))
+        self.assertEqual(index.categories(u"hrs"), set())
+
+    def test_match_case_insensitive(self):
+        index = KeywordIndex(self.catalog)
+        self.assertEqual(index.categories(u"viel äRGER"), set(["c"]))
+
+    def test_classify_matches_functions(self):
+        rng = random.Random(5)
+        words = [u"book", u"imported", u"pill", u"chocolate", u"perfume", u"bo", u"imp", u"Im", u"PILLS", u" "]
+        for _ in range(2000):
+            name = u"".join(rng.choice(words) for _ in range(rng.randint(0, 6)))
+            self.assertEqual(CLASSIFIER.classify(name),
+                             (is_item_imported(name), is_item_tax_exempt(name)))
+
+    def test_classify_large_catalog(self):
+        keywords = [u"food%s" % i for i in range(5000)]
+        index = KeywordIndex({"exempt": keywords, "imported": [u"imported"]})
+        self.assertEqual(index.classify(u"imported food4999 crate"), (True, True))
+        self.assertEqual(index.classify(u"imported foo4999 crate"), (True, False))
+
+    def test_load_catalog(self):
+        self.assertEqual(load_catalog("docs/catalog.txt"),
+                         {u"imported": [u"imported"], u"exempt": [u"book", u"pill", u"chocolate"]})
+
+    def test_load_catalog_missing_category(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "catalog.txt")
+            with open(filename, "w") as file_out:
+                file_out.write("book\n")
+            with self.assertRaisesRegexp(ValueError, "Catalog keywords must follow a \\[category\\] line"):
+                load_catalog(filename)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_load_classifier_categories(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "catalog.txt")
+            for text, message in [("[exempt]\nbook\n", "must have an \\[imported\\] category"),
+                                  ("[imported]\nimported\n", "one of \\[exempt\\], \\[food\\]"),
+                                  ("[imported]\nimported\n[drinks]\nwine\n[Food]\nbread\n",
+                                   "Unknown catalog categories: Food, drinks")]:
+                with open(filename, "w") as file_out:
+                    file_out.write(text)
+                with self.assertRaisesRegexp(ValueError, message):
+                    load_classifier(filename)
+            with open(filename, "w") as file_out:
+                file_out.write("[imported]\nforeign\n[food]\nbread\n[book]\nnovel\n"
+                               "[medical]\naspirin\n")
+            classifier = load_classifier(filename)
+            self.assertEqual([classifier.classify(name) for name in
+                              (u"foreign bread", u"novel", u"aspirin", u"imported pen")],
+                             [(True, True), (False, True), (False, True), (False, False)])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_item_classifier(self):
+        index = KeywordIndex({"exempt": [u"perfume"]})
+        item = Item(u"1 imported bottle of perfume at 27.99", classifier=index)
+        self.assertEqual((item.imported, item.tax_exempt), (False, True))
+        self.assertEqual(str(item), "1 imported bottle of perfume: 27.99")
+
+    def test_parse_classifier_workers(self):
+        classifier = load_classifier("docs/catalog.txt")
+        self.assertEqual(parse_files(["docs/input.txt"], workers=2, classifier=classifier),
+                         TestModuleFunctions.expectation)
+
+    def test_automaton_matches_scan(self):
+        rng = random.Random(11)
+        keywords = [u"".join(rng.choice(u"abc") for _ in range(rng.randint(1, 4))) for _ in range(40)]
+        catalog = {"x": keywords[:20], "y": keywords[20:]}
+        index = KeywordIndex(catalog)
+        self.assertEqual(index.scan, None)
+        for _ in range(500):
+            text = u"".join(rng.choice(u"abcd") for _ in range(rng.randint(0, 12)))
+            expected = set(category for category, words in catalog.items()
+                           if any(word in text for word in words))
+            self.assertEqual(index.categories(text), expected)
+
+
+class TestCaches(unittest.TestCase):
+
+    def setUp(self):
+        clear_caches()
+
+    def test_lru_eviction(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.info(), {"hits": 3, "misses": 1, "size": 2, "maxsize": 2})
+
+    def test_lru_resize(self):
+        cache = LRUCache(3)
+        for key in "abc":
+            cache.put(key, key)
+        cache.get("a")
+        cache.resize(1)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get("a"), "a")
+
+    def test_lru_disabled(self):
+        cache = LRUCache(0)
+        cache.put("a", 1)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_clear(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.clear()
+        self.assertEqual(cache.get("a"), None)
+        cache.put("a", 2)
+        self.assertEqual(cache.get("a"), 2)
+
+    def test_item_uses_caches(self):
+        Item(TestItem.input_imported).get_amounts()
+        misses = (CLASSIFICATION_CACHE.misses, TAX_CACHE.misses)
+        hits = (CLASSIFICATION_CACHE.hits, TAX_CACHE.hits)
+        item = Item(TestItem.input_imported)
+        item.get_amounts()
+        self.assertEqual((CLASSIFICATION_CACHE.misses, TAX_CACHE.misses), misses)
+        self.assertEqual((CLASSIFICATION_CACHE.hits, TAX_CACHE.hits), (hits[0] + 1, hits[1] + 1))
+        self.assertEqual(str(item), "1 imported bottle of perfume: 32.19")
+
+    def test_cache_keeps_mutations_apart(self):
+        item = Item(TestItem.input_imported)
+        item.imported = False
+        self.assertEqual(item.get_item_price(), Decimal('30.79'))
+        item.quantity = Decimal('2')
+        self.assertEqual(item.get_item_price(), Decimal('61.58'))
+
+    def test_cache_keeps_engines_apart(self):
+        self.assertEqual(Cart(TestCart.input3, CENTS_ENGINE).receipt, TestCart.expectation3)
+        self.assertEqual(len(TAX_CACHE), 4)
+        self.assertEqual(Cart(TestCart.input3).receipt, TestCart.expectation3)
+        self.assertEqual(len(TAX_CACHE), 8)
+
+    def test_resize_caches(self):
+        try:
+            resize_caches(0)
+            self.assertEqual(Cart(TestCart.input1).receipt, TestCart.expectation1)
+            self.assertEqual(len(TAX_CACHE), 0)
+        finally:
+            resize_caches(65536)
+
+
+class TestIncrementalCart(unittest.TestCase):
+
+    def test_add_items(self):
+        cart = Cart()
+        for line in TestCart.input3.split("\n"):
+            cart.add_item(line)
+        self.assertEqual(cart.receipt, TestCart.expectation3)
+        self.assertEqual(cart.calculate_total(), (Decimal('74.68'), Decimal('6.70')))
+
+    def test_add_item_instance(self):
+        cart = Cart(TestCart.input1)
+        item = cart.add_item(Item("1 imported bottle of perfume at 27.99"))
+        self.assertEqual(cart.items[-1], item)
+        self.assertEqual(cart.calculate_total(), (Decimal('62.02'), Decimal('5.70')))
+
+    def test_add_item_twice(self):
+        cart = Cart()
+        item = cart.add_item("1 book at 12.49")
+        with self.assertRaisesRegexp(ValueError, "Item is already in the cart"):
+            cart.add_item(item)
+
+    def test_remove_item(self):
+        cart = Cart(TestCart.input1)
+        music = cart.items[1]
+        cart.remove_item(music)
+        self.assertEqual(cart.receipt, u'1 book: 12.49\n1 chocolate bar: 0.85\nSales Taxes: 0.00\nTotal: 13.34\n')
+
+    def test_remove_missing_item(self):
+        cart = Cart(TestCart.input1)
+        with self.assertRaisesRegexp(ValueError, "Item is not in the cart"):
+            cart.remove_item(Item("1 book at 12.49"))
+
+    def test_update_quantity(self):
+        cart = Cart(TestCart.input1)
+        cart.update_quantity(cart.items[1], "2")
+        self.assertEqual(cart.receipt, u'1 book: 12.49\n2 music CD: 32.98\n1 chocolate bar: 0.85\nSales Taxes: 3.00\nTotal: 46.32\n')
+
+    def test_update_quantity_negative(self):
+        cart = Cart(TestCart.input1)
+        with self.assertRaisesRegexp(ValueError, "Quantity cannot be negative"):
+            cart.update_quantity(cart.items[0], Decimal('-1'))
+        self.assertEqual(cart.receipt, TestCart.expectation1)
+
+    def test_receipt_rendered_lazily(self):
+        cart = Cart(TestCart.input1)
+        self.assertTrue(cart.receipt is cart.receipt)
+        first = cart.receipt
+        cart.add_item("1 book at 1.00")
+        self.assertNotEqual(cart.receipt, first)
+
+    def test_empty_cart(self):
+        self.assertEqual(Cart().receipt, u"Sales Taxes: 0\nTotal: 0\n")
+
+    def test_blank_lines(self):
+        self.assertEqual(Cart("1 book at 12.49\n\n  \n").receipt,
+                         u"1 book: 12.49\nSales Taxes: 0.00\nTotal: 12.49\n")
+
+
+class TestCompactStorage(unittest.TestCase):
+
+    def test_item_slots(self):
+        item = Item(TestItem.input_imported)
+        self.assertFalse(hasattr(item, "__dict__"))
+        with self.assertRaises(AttributeError):
+            item.colour = "red"
+
+    def test_item_rendered_on_demand(self):
+        item = Item(TestItem.input_imported)
+        item.quantity = Decimal('2')
+        item.quantity_text = "2"
+        self.assertEqual(str(item), "2 imported bottle of perfume: 64.38")
+
+    def test_compact_receipts(self):
+        for shopping_list, expectation in [(TestCart.input1, TestCart.expectation1),
+                                           (TestCart.input3, TestCart.expectation3),
+                                           (TestCart.input_utf8, TestCart.expectation_utf8)]:
+            cart = Cart(shopping_list, compact=True)
+            self.assertEqual(cart.receipt, expectation)
+            self.assertEqual(cart.calculate_total(), Cart(shopping_list).calculate_total())
+
+    def test_compact_fractional(self):
+        cart = Cart("1.5 book at 12.49\n01 music CD at 14.990", compact=True)
+        self.assertEqual(cart.receipt, Cart("1.5 book at 12.49\n01 music CD at 14.990").receipt)
+
+    def test_compact_flags(self):
+        cart = Cart(TestCart.input3, compact=True)
+        self.assertEqual(cart.lines.flags.tolist(), [1, 0, 2, 3])
+        self.assertEqual(cart.lines.prices.tolist(), [3219, 2089, 975, 1185])
+
+    def test_compact_exact_rows(self):
+        for text in (u"1 x at 100000000000000000000\n2 book at 1.00",
+                     u"1 x at 0.%s1\n1 pen at 1.%s" % ("0" * 130, "0" * 200),
+                     u"-0 book at 12.49\n1 pen at -0\n1 imported pen at -0.00"):
+            cart = Cart(text, compact=True)
+            self.assertEqual(cart.receipt, Cart(text).receipt)
+            self.assertEqual(render_receipt(cart, "jsonl"), render_receipt(Cart(text), "jsonl"))
+            self.assertEqual([str(item) for item in cart.items],
+                             [str(item) for item in Cart(text).items])
+        self.assertEqual(Cart(u"-0 book at 12.49", compact=True).receipt,
+                         u"-0 book: -0.00\nSales Taxes: 0.00\nTotal: 0.00\n")
+
+    def test_compact_exact_update(self):
+        cart = Cart(u"1 x at 100000000000000000000\n-0 pen at 2.00", compact=True)
+        self.assertEqual(sorted(cart.lines.exact), [0, 1])
+        cart.update_quantity(1, "2")
+        self.assertEqual(sorted(cart.lines.exact), [0])
+        cart.update_quantity(1, "-0")
+        self.assertEqual(sorted(cart.lines.exact), [0, 1])
+        cart.update_quantity(1, "2")
+        cart.update_quantity(0, "3")
+        self.assertEqual(cart.receipt, Cart(u"3 x at 100000000000000000000\n2 pen at 2.00").receipt)
+        cart.remove_item(0)
+        self.assertEqual(cart.total, Decimal("4.40"))
+
+    def test_compact_shares_strings(self):
+        cart = Cart("1 book at 1.00\n1 book at 2.00", compact=True)
+        self.assertTrue(cart.lines.names[0] is cart.lines.names[1])
+
+    def test_compact_remove_and_update(self):
+        cart = Cart(TestCart.input1, compact=True)
+        cart.remove_item(1)
+        cart.update_quantity(2, "2")
+        self.assertEqual(cart.receipt, u'1 book: 12.49\n2 chocolate bar: 1.70\nSales Taxes: 0.00\nTotal: 14.19\n')
+        self.assertEqual(len(cart.lines), 2)
+        self.assertEqual([str(item) for item in cart.items], ["1 book: 12.49", "2 chocolate bar: 1.70"])
+
+    def test_compact_missing_row(self):
+        cart = Cart(TestCart.input1, compact=True)
+        cart.remove_item(0)
+        with self.assertRaisesRegexp(ValueError, "Item is not in the cart"):
+            cart.remove_item(0)
+        with self.assertRaisesRegexp(ValueError, "Item is not in the cart"):
+            cart.update_quantity(7, "1")
+
+    def test_compact_keeps_flags_on_update(self):
+        cart = Cart(compact=True, classifier=KeywordIndex({"exempt": [u"perfume"]}))
+        row = cart.add_item("1 bottle of perfume at 10.00")
+        cart.update_quantity(row, "3")
+        self.assertEqual(cart.calculate_total(), (Decimal('30.00'), Decimal('0.00')))
+
+    def test_parse_compact(self):
+        self.assertEqual(parse_files(["docs/input.txt"], compact=True), TestModuleFunctions.expectation)
+
+
+class TestTokenizer(unittest.TestCase):
+    pieces = [u"1", u"2.5", u" ", u"  ", u"\t", u"\n", u"\xa0", u"　", u"at", u"a", u"t",
+              u"book", u"12.49", u"x", u"-", u"ä"]
+
+    def assert_same_as_pattern(self, line):
+        expected = input_pattern.match(line)
+        if expected is None:
+            with self.assertRaises(ValueError):
+                split_line(line)
+        else:
+            self.assertEqual(split_line(line), expected.groups(), repr(line))
+
+    def test_matches_pattern_random(self):
+        rng = random.Random(3)
+        for _ in range(20000):
+            line = u"".join(rng.choice(self.pieces) for _ in range(rng.randint(0, 10)))
+            self.assert_same_as_pattern(line)
+            self.assert_same_as_pattern(line.encode("latin-1", "replace"))
+
+    def test_matches_pattern_bytes(self):
+        for code in range(256):
+            self.assert_same_as_pattern("1 thing%sat%s2" % (chr(code), chr(code)))
+
+    def test_matches_pattern_cases(self):
+        for line in [u"1 book at 12.49", u"1 at at 5", u"1 x at at 5", u"1 at 5", u"1  at 5",
+                     u"1\nbook at 5", u"1 book\nat 5", u"1 book at\n5", u"1 book at 5\n6 x at 7",
+                     u" 1 book at 5", u"\n1 book at 5", u"1 book at ", u"1 book cat at dog"]:
+            self.assert_same_as_pattern(line)
+
+    def test_long_name(self):
+        name = u"very " * 2000 + u"long name"
+        self.assertEqual(split_line(u"2 %s at 3.00" % name), (u"2", name, u"at ", u"3.00"))
+
+    def test_tokenize_line(self):
+        self.assertEqual(tokenize_line(u"  1.5 book at 12.49\n"),
+                         (u"1.5", u"book", Decimal('1.5'), Decimal('12.49')))
+
+    def test_malformed_column(self):
+        with self.assertRaises(MalformedLineError) as context:
+            tokenize_line(u"  12")
+        self.assertEqual(context.exception.column, 4)
+        with self.assertRaises(MalformedLineError) as context:
+            tokenize_line(u"12 book for 3")
+        self.assertEqual(context.exception.column, 3)
+
+    def test_invalid_price_column(self):
+        with self.assertRaises(InvalidOperation) as context:
+            tokenize_line(u"1 book at 12,49")
+        self.assertEqual(context.exception.column, 10)
+        self.assertTrue(isinstance(context.exception, ValueError))
+
+    def test_invalid_quantity_column(self):
+        with self.assertRaisesRegexp(InvalidNumberError, "Invalid number u'one' \\(column 1\\)"):
+            tokenize_line(u" one book at 12.49")
+
+    def test_negative_price_column(self):
+        with self.assertRaises(MalformedLineError) as context:
+            Item(u"1 book at -12.49")
+        self.assertEqual(context.exception.column, 10)
+
+    def test_error_pickles(self):
+        import pickle
+        error = pickle.loads(pickle.dumps(InvalidNumberError("Invalid number 'x'", 3)))
+        self.assertEqual((str(error), error.column), ("Invalid number 'x' (column 3)", 3))
+
+
+class TestMappedCarts(unittest.TestCase):
+    pieces = [u"1 book at 1\n", u"\n", u"\r\n", u"\r", u" ", u"\t", u"Input 1:", u"input",
+              u"İnput", u"\x0c", u"\x1c", u"\x85", u" ", u"\xa0", u"\xe4", u"1", u"x"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "carts.txt")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, text):
+        with open(self.filename, "wb") as file_out:
+            file_out.write(text.encode("utf-8"))
+
+    def test_iter_cart_ranges(self):
+        data = "Input 1:\n1 book at 1\n2 pen at 2\n\n  \nInput 2:\n3 x at 3"
+        self.assertEqual([data[start:end] for start, end in iter_cart_ranges(data)],
+                         ["1 book at 1\n2 pen at 2\n", "3 x at 3"])
+
+    def test_read_carts_as_codecs(self):
+        rng = random.Random(5)
+        for _ in range(3000):
+            self.write(u"".join(rng.choice(self.pieces) for _ in range(rng.randint(0, 12))))
+            with codecs.open(self.filename, "r", "utf-8") as file_in:
+                expected = list(iter_carts(file_in))
+            self.assertEqual(list(read_carts(self.filename)), expected)
+
+    def test_empty_file(self):
+        self.write(u"")
+        self.assertEqual(list(read_carts(self.filename)), [])
+        self.assertEqual(parse_files([self.filename], workers=2), u"")
+
+    def test_pipe(self):
+        fifo = os.path.join(self.directory, "fifo")
+        os.mkfifo(fifo)
+        with open("docs/input.txt", "rb") as file_in:
+            carts = file_in.read()
+        bad = "Input 1:\n1 book at 12.49\n\n1 x for 2\n\n1 pen at 1.00\n"
+        expected = [u"1 book: 12.49\nSales Taxes: 0.00\nTotal: 12.49\n",
+                    u"1 pen: 1.10\nSales Taxes: 0.10\nTotal: 1.10\n"]
+        for workers, text, read in [
+                (None, carts, lambda pool: parse_files([fifo])),
+                (2, carts, lambda pool: parse_files([fifo], workers=2)),
+                (None, bad, lambda pool: list(render_file(fifo, errors="skip-line"))),
+                (2, bad, lambda pool: list(render_file(fifo, pool, errors="skip-line")))]:
+            writer = threading.Thread(target=self.write_fifo, args=(fifo, text))
+            writer.start()
+            with worker_pool(workers) as pool:
+                result = read(pool)
+            writer.join()
+            self.assertEqual(result, TestModuleFunctions.expectation if text is carts else expected)
+
+    def write_fifo(self, fifo, text):
+        with open(fifo, "wb") as file_out:
+            file_out.write(text)
+
+    def test_render_file_workers(self):
+        self.write(u"1 book at 12.49\r\n\r\n1 imported \xe4 at 1.00\x0cInput\n2 pen at 2.00\n")
+        with worker_pool(2) as pool:
+            self.assertEqual(list(render_file(self.filename, pool, chunksize=1)),
+                             list(render_file(self.filename)))
+        self.assertEqual(len(list(render_file(self.filename))), 3)
+
+    def test_map_file_carts(self):
+        self.write(u"1 book at 12.49\n\n" * 5)
+        with worker_pool(2) as pool:
+            self.assertEqual(list(map_file_carts(len, self.filename, pool, 2)), [2, 2, 1])
+            self.assertEqual(list(map_file_carts(len, self.filename, pool)), [5])
+
+    def test_render_file_rewritten(self):
+        with worker_pool(2) as pool:
+            for text in [u"1 book at 1.00\n", u"1 pen at 2.00\n\n" * 3,
+                         u"1 imported cup at 3.00\n\n" * 5]:
+                self.write(text)
+                self.assertEqual(list(render_file(self.filename, pool, chunksize=1)),
+                                 list(render_file(self.filename)))
+                self.assertEqual(list(render_file(self.filename, pool, chunksize=1,
+                                                  errors="skip-line")),
+                                 list(render_file(self.filename)))
+
+
+class TestBulkMode(unittest.TestCase):
+    text = ("Input 1:\n1 book at 12.49\n1 book for 1\n1 music CD at 14.99\n\n"
+            "Input 2:\n1 pen at -1\n\xff\xfe at 1\n1 cup at 2.00\n\n1 book at x\n")
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "bad.txt")
+        with open(self.filename, "wb") as file_out:
+            file_out.write(self.text)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def render(self, policy, **options):
+        out = StringIO()
+        rejects = RejectWriter(out)
+        receipts = list(render_file(self.filename, errors=policy, rejects=rejects, **options))
+        rejects.flush()
+        return receipts, out.getvalue().split(u"\r\n")[1:-1]
+
+    def test_skip_line(self):
+        receipts, rejects = self.render("skip-line")
+        self.assertEqual(receipts, [TestCart.expectation1.replace(u"1 chocolate bar: 0.85\n", u"")
+                                    .replace(u"29.83", u"28.98"),
+                                    u"1 cup: 2.20\nSales Taxes: 0.20\nTotal: 2.20\n"])
+        self.assertEqual([reject.split(u",")[:3] for reject in rejects],
+                         [[self.filename, u"3", u"25"], [self.filename, u"7", u"68"],
+                          [self.filename, u"8", u"80"], [self.filename, u"11", u"103"]])
+        self.assertTrue(rejects[1].endswith(u",Price of items cannot be negative (column 9),1 pen at -1"))
+        self.assertTrue(u"can't decode byte 0xff" in rejects[2])
+
+    def test_arithmetic_errors(self):
+        with open(self.filename, "wb") as file_out:
+            file_out.write("1 book at 1.00\n9E+999999999 x at 9E+999999999\n1e20 pen at 1e20\n")
+        for options in ({}, {"engine": CENTS_ENGINE, "compact": True}):
+            receipts, rejects = self.render("skip-line", **options)
+            self.assertEqual(receipts, [u"1 book: 1.00\nSales Taxes: 0.00\nTotal: 1.00\n"])
+            self.assertEqual([reject.split(u",")[1] for reject in rejects], [u"2", u"3"])
+
+    def test_skip_cart(self):
+        receipts, rejects = self.render("skip-cart")
+        self.assertEqual(receipts, [])
+        self.assertEqual(len(rejects), 4)
+
+    def test_fail(self):
+        out = StringIO()
+        rejects = RejectWriter(out)
+        receipts = render_file(self.filename, errors="fail", rejects=rejects)
+        with self.assertRaisesRegexp(RejectedLineError, r"bad.txt, line 3 \(byte 25\): Input is not"):
+            list(receipts)
+        self.assertEqual(rejects.rejects, 1)
+
+    def test_workers(self):
+        with open(self.filename, "ab") as file_out:
+            file_out.write(("\n" + self.text) * 50)
+        for policy in ERROR_POLICIES[1:]:
+            with worker_pool(2) as pool:
+                self.assertEqual(self.render(policy, pool=pool, chunksize=3),
+                                 self.render(policy))
+        receipts, rejects = self.render("skip-line")
+        self.assertEqual((len(receipts), len(rejects)), (102, 204))
+        self.assertEqual(rejects[-1].split(u",")[1], str(len(self.text.split("\n")) * 51 - 1))
+
+    def test_clean_file(self):
+        out = StringIO()
+        write_receipts(["docs/input.txt"], out, errors="fail", rejects=RejectWriter(StringIO()))
+        self.assertEqual(out.getvalue(), u"Receipts from docs/input.txt\n" +
+                         TestModuleFunctions.expectation)
+
+    def test_line_counter(self):
+        counter = LineCounter("a\nb\n\nc\n")
+        self.assertEqual([counter.line_at(offset) for offset in (0, 2, 5, 6, 4)], [1, 2, 4, 4, 3])
+
+    def test_unknown_policy(self):
+        with self.assertRaisesRegexp(ValueError, "Unknown error policy 'ignore'"):
+            render_file(self.filename, errors="ignore")
+
+
+class TestJurisdictions(unittest.TestCase):
+    mixed = (u"Input 1:\n1 book at 12.49\n1 music CD at 14.99\n\n"
+             u"Input 2:\nJurisdiction: north\n1 book at 12.49\n1 imported music CD at 14.99\n\n"
+             u"Input 3:\njurisdiction: south\n1 imported bottle of perfume at 27.99\n")
+
+    def setUp(self):
+        self.rules = load_rules("docs/rules.txt")
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "mixed.txt")
+        with open(self.filename, "wb") as file_out:
+            file_out.write(self.mixed.encode("utf-8"))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_load_rules(self):
+        self.assertEqual(self.rules.jurisdictions.keys(), [u"default", u"north", u"south"])
+        self.assertEqual(self.rules.default.name, u"default")
+        self.assertEqual(self.rules.jurisdiction(u"north").rates,
+                         (Decimal("0.20"), Decimal("0.05"), Decimal("0.225"), Decimal("0.075")))
+        self.assertEqual(self.rules.jurisdiction(u"south").precision, Decimal("0.10"))
+        self.assertEqual(load_rules("docs/rules.txt", u"south").default.name, u"south")
+        self.assertEqual(RULES.default.rates,
+                         tuple(tax_rate(imported, exempt)
+                               for imported in (False, True) for exempt in (False, True)))
+
+    def test_bad_rules(self):
+        for text, message in [(u"basic_rate = 0.1\n", "must follow a \\[jurisdiction\\]"),
+                              (u"[x]\nbasic_rate = 0.1\n", "needs a basic_rate and an import_rate"),
+                              (u"[x]\nbasic = 0.1\n", "Unknown rule u'basic' \\(line 2\\)"),
+                              (u"[x]\nbasic_rate = a\nimport_rate = 0\n", "must be numbers"),
+                              (u"[x]\nbasic_rate = -1\nimport_rate = 0\n", "cannot be negative"),
+                              (u"# nothing\n", "at least one jurisdiction")]:
+            filename = os.path.join(self.directory, "rules.txt")
+            with open(filename, "wb") as file_out:
+                file_out.write(text.encode("utf-8"))
+            with self.assertRaisesRegexp(ValueError, message):
+                load_rules(filename)
+
+    def test_cart(self):
+        cart = Cart(u"Jurisdiction: north\n1 book at 12.49\n1 imported music CD at 14.99",
+                    rules=self.rules)
+        self.assertEqual(cart.jurisdiction.name, u"north")
+        # 5% of the exempt book and 22.5% of the imported CD, to the cent
+        self.assertEqual(cart.receipt, u"1 book: 13.11\n1 imported music CD: 18.36\n"
+                                       u"Sales Taxes: 3.99\nTotal: 31.47\n")
+        south = Cart(u"Jurisdiction: south\n1 imported bottle of perfume at 27.99",
+                     engine=CENTS_ENGINE, rules=self.rules)
+        self.assertEqual((south.sales_tax, south.total), (Decimal("5.10"), Decimal("33.09")))
+        self.assertEqual(Cart(u"1 book at 12.49", rules=self.rules).receipt,
+                         Cart(u"1 book at 12.49").receipt)
+
+    def test_errors(self):
+        with self.assertRaisesRegexp(ValueError, "Unknown jurisdiction u'east'"):
+            Cart(u"Jurisdiction: east\n1 book at 1.00", rules=self.rules)
+        cart = Cart(u"1 book at 1.00", rules=self.rules)
+        with self.assertRaisesRegexp(ValueError, "must be set before its items"):
+            cart.set_jurisdiction(u"north")
+        with self.assertRaisesRegexp(ValueError, "Input is not well-formed"):
+            Cart(u"1 book at 1.00\nJurisdiction: north", rules=self.rules)
+
+    def test_compact_update(self):
+        text = u"Jurisdiction: north\n2 imported book at 12.49"
+        cart = Cart(text, rules=self.rules, compact=True)
+        cart.update_quantity(0, 1)
+        self.assertEqual(cart.receipt, Cart(text.replace(u"2 ", u"1 "), rules=self.rules).receipt)
+
+    def test_mixed_file(self):
+        expected = [Cart(cart, rules=self.rules).receipt for cart in read_carts(self.filename)]
+        self.assertEqual(expected[0], u"1 book: 12.49\n1 music CD: 16.49\n"
+                                      u"Sales Taxes: 1.50\nTotal: 28.98\n")
+        self.assertEqual(list(render_file(self.filename, rules=self.rules)), expected)
+        with worker_pool(2, rules=self.rules) as pool:
+            self.assertEqual(list(render_file(self.filename, pool, chunksize=1, rules=self.rules)),
+                             expected)
+        self.assertEqual(list(render_file(self.filename, errors="skip-line", rules=self.rules)),
+                         expected)
+        self.assertEqual(parse_files([self.filename], rules=self.rules),
+                         u"".join(u"Output %s:\n%s" % (number, receipt)
+                                  for number, receipt in enumerate(expected, 1)))
+
+    def test_unknown_jurisdiction_drops_cart(self):
+        with open(self.filename, "wb") as file_out:
+            file_out.write(u"Jurisdiction: nowhere\n1 book at 12.49\n\n1 pen at 1.00\n"
+                           .encode("utf-8"))
+        for policy in ERROR_POLICIES[1:]:
+            out = StringIO()
+            rejects = RejectWriter(out)
+            self.assertEqual(list(render_file(self.filename, errors=policy, rejects=rejects,
+                                              rules=self.rules)),
+                             [u"1 pen: 1.10\nSales Taxes: 0.10\nTotal: 1.10\n"])
+            self.assertEqual(rejects.rejects, 1)
+
+
+class TestStdin(unittest.TestCase):
+
+    class Pipe(object):
+        """a file of lines that records how many had been read at each flush"""
+
+        def __init__(self, lines):
+            self.lines = iter(lines)
+            self.read = 0
+            self.out = StringIO()
+            self.flushed = []
+
+        def readline(self):
+            line = next(self.lines, "")
+            self.read += bool(line)
+            return line
+
+        def write(self, text):
+            self.out.write(text)
+
+        def flush(self):
+            self.flushed.append((self.read, self.out.getvalue()))
+
+    def test_iter_stream_carts(self):
+        lines = ["Input 1:\n", "1 book at 1\n", "2 pen at 2\n", "\n", "  \n", "3 x at 3"]
+        self.assertEqual(list(iter_stream_carts(lines)),
+                         [(9, 2, "1 book at 1\n2 pen at 2\n"), (36, 6, "3 x at 3")])
+
+    def test_flushed_as_carts_end(self):
+        with open("docs/input.txt", "rb") as file_in:
+            pipe = self.Pipe(file_in.readlines())
+        stream_receipts(pipe, pipe)
+        self.assertEqual(pipe.out.getvalue(), u"Receipts from <stdin>\n" +
+                         TestModuleFunctions.expectation)
+        # each receipt is out once the blank line after its cart, or the end
+        # of the input, is read
+        self.assertEqual([read for read, _ in pipe.flushed], [0, 5, 9, 14])
+        self.assertTrue(pipe.flushed[1][1].endswith(TestCart.expectation1))
+
+    def test_bulk_mode(self):
+        pipe = self.Pipe(["1 book at 1\n", "1 x for 2\n", "\n", "1 pen at -2\n"])
+        rejects = StringIO()
+        stream_receipts(pipe, pipe, format="jsonl", errors="skip-line",
+                        rejects=RejectWriter(rejects))
+        self.assertEqual(len(pipe.out.getvalue().splitlines()), 1)
+        self.assertEqual([row.split(u",")[:3] for row in rejects.getvalue().splitlines()[1:]],
+                         [[u"<stdin>", u"2", u"12"], [u"<stdin>", u"4", u"23"]])
+        pipe = self.Pipe(["1 book at 1\n", "\n", "1 x for 2\n"])
+        with self.assertRaisesRegexp(RejectedLineError, "<stdin>, line 3 \\(byte 13\\)"):
+            stream_receipts(pipe, pipe, errors="fail")
+        self.assertTrue(pipe.out.getvalue().endswith(u"Total: 1.00\n"))
+
+    def test_arguments(self):
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            for argv in [[], ["--stdin", "docs/input.txt"], ["--stdin", "--workers", "2"]]:
+                self.assertRaises(SystemExit, main, argv)
+        finally:
+            sys.stderr = stderr
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+from docs.pricing import Cart, RejectedLineError, decode_filename, render_receipt, \
+    write_receipts
+from docs.writers import *
+from tests import tax_calc_tests
+
+
+class TestWriters(unittest.TestCase):
+
+    def write(self, format, filenames=("docs/input.txt",), **options):
+        out = StringIO()
+        write_receipts(list(filenames), out, format=format, **options)
+        return out.getvalue()
+
+    def test_text_unchanged(self):
+        self.assertEqual(self.write("text"), u"Receipts from docs/input.txt\n" +
+                         tax_calc_tests.TestModuleFunctions.expectation)
+
+    def test_csv(self):
+        rows = self.write("csv", ["docs/inpututf8.txt"]).split(u"\r\n")
+        self.assertEqual(rows[0], u"file,cart,kind,quantity,name,unit_price,sales_tax,price,imported,exempt")
+        self.assertEqual(rows[1], u"docs/inpututf8.txt,1,item,1,book,12.49,0.00,12.49,0,1")
+        self.assertEqual(rows[5], u"docs/inpututf8.txt,2,item,1,imported box of chocolates,"
+                                  u"10.00,0.50,10.50,1,1")
+        self.assertEqual(rows[-3], u"docs/inpututf8.txt,3,item,1,box of imported chocolates,"
+                                   u"11.25,0.60,11.85,1,1")
+        self.assertEqual(rows[-2], u"docs/inpututf8.txt,3,total,,,,6.70,74.68,,")
+        self.assertTrue(u"p\xe4cket of he\xe4dache pills" in rows[-4])
+
+    def test_csv_quoting(self):
+        self.assertEqual(render_receipt(Cart(u'2 "big", red pen at 1.00'), "csv"),
+                         u'item,2,"""big"", red pen",1.00,0.20,2.20,0,0\r\n'
+                         u'total,,,,0.20,2.20,,\r\n')
+
+    def test_jsonl(self):
+        lines = self.write("jsonl").splitlines()
+        self.assertEqual(len(lines), 3)
+        receipt = json.loads(lines[1])
+        self.assertEqual((receipt["file"], receipt["cart"], receipt["sales_tax"], receipt["total"]),
+                         (u"docs/input.txt", 2, u"7.65", u"65.15"))
+        self.assertEqual(receipt["items"][0], {
+            u"quantity": u"1", u"name": u"imported box of chocolates", u"unit_price": u"10.00",
+            u"imported": True, u"exempt": True, u"sales_tax": u"0.50", u"price": u"10.50"})
+
+    def test_compact_entries(self):
+        cart = Cart(u"3 imported book at 1.50\n1 pen at 2.00", compact=True)
+        self.assertEqual(render_receipt(cart, "jsonl"),
+                         render_receipt(Cart(u"3 imported book at 1.50\n1 pen at 2.00"), "jsonl"))
+
+    def test_workers(self):
+        for format in FORMATS:
+            self.assertEqual(self.write(format, ["docs/input.txt", "docs/inpututf8.txt"], workers=2),
+                             self.write(format, ["docs/input.txt", "docs/inpututf8.txt"]))
+
+    def test_non_ascii_file_name(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, "caf\xc3\xa9.txt")
+            with open(filename, "w") as file_out:
+                file_out.write("1 book at 12.49\n\n1 x for 2\n")
+            name = decode_filename(filename)
+            self.assertTrue(name.endswith(u"caf\xe9.txt"))
+            self.assertTrue(self.write("text", [filename], errors="skip-line")
+                            .startswith(u"Receipts from " + name))
+            self.assertTrue(self.write("csv", [filename], errors="skip-line")
+                            .split(u"\r\n")[1].startswith(name + u",1,item"))
+            self.assertEqual(json.loads(self.write("jsonl", [filename],
+                                                   errors="skip-line"))["file"], name)
+            rejects = RejectWriter(StringIO())
+            self.write("text", [filename], errors="skip-line", rejects=rejects)
+            self.assertTrue(rejects.out.getvalue().split(u"\r\n")[1].startswith(name + u",3,"))
+            with self.assertRaises(RejectedLineError) as raised:
+                self.write("text", [filename], errors="fail")
+            self.assertTrue(unicode(raised.exception).startswith(name + u", line 3"))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_buffered(self):
+        out = StringIO()
+        writer = TextWriter(out)
+        writer.receipt("x", 1, u"1 book: 1.00\n")
+        self.assertEqual(out.getvalue(), u"")
+        writer.flush()
+        self.assertEqual(out.getvalue(), u"Output 1:\n1 book: 1.00\n")
+
+    def test_unknown_format(self):
+        with self.assertRaisesRegexp(ValueError, "Unknown receipt format 'xml'"):
+            render_receipt(Cart(u"1 book at 1.00"), "xml")
+
+if __name__ == "__main__":
+    unittest.main()